@@ -0,0 +1,40 @@
+"""Add the issue_attachments table
+
+Revision ID: 1cd0a853e2a5
+Revises: abc71fd60fa
+Create Date: 2015-06-15 10:32:41.563105
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1cd0a853e2a5'
+down_revision = 'abc71fd60fa'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the table issue_attachments.
+    '''
+    op.create_table(
+        'issue_attachments',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column(
+            'project_id',
+            sa.Integer,
+            sa.ForeignKey(
+                'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+            nullable=False,
+        ),
+        sa.Column('sha256', sa.String(64), nullable=False),
+        sa.Column('filename', sa.Text, nullable=False),
+        sa.Column('date_created', sa.DateTime, nullable=False),
+        sa.UniqueConstraint('project_id', 'sha256'),
+    )
+
+
+def downgrade():
+    ''' Remove the table issue_attachments.
+    '''
+    op.drop_table('issue_attachments')
@@ -0,0 +1,62 @@
+"""Add the commit_path_index table
+
+Revision ID: 1f3b7ab45a2e
+Revises: 3b441ef4e928
+Create Date: 2015-06-29 10:12:41.518203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f3b7ab45a2e'
+down_revision = '3b441ef4e928'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the table commit_path_index and the column paths_indexed to the
+    table commit_index.
+    '''
+    op.create_table(
+        'commit_path_index',
+        sa.Column(
+            'project_id',
+            sa.Integer,
+            sa.ForeignKey(
+                'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+            primary_key=True,
+        ),
+        sa.Column('commit', sa.String(40), primary_key=True),
+        sa.Column('path', sa.Text, primary_key=True),
+    )
+    op.create_index(
+        'commit_path_index_path_idx',
+        'commit_path_index',
+        ['project_id', 'path'])
+    # The commits already indexed are added to the path index by the
+    # index-commits action of pagure_admin.py
+    op.add_column(
+        'commit_index',
+        sa.Column(
+            'paths_indexed',
+            sa.Boolean,
+            nullable=False,
+            server_default='0',
+        )
+    )
+    # To find the commits not yet in the path index of a branch
+    op.create_index(
+        'commit_index_paths_indexed_idx',
+        'commit_index',
+        ['project_id', 'branch', 'paths_indexed'])
+
+
+def downgrade():
+    ''' Remove the table commit_path_index and the column paths_indexed of
+    the table commit_index.
+    '''
+    op.drop_index('commit_index_paths_indexed_idx')
+    op.drop_column('commit_index', 'paths_indexed')
+    op.drop_index('commit_path_index_path_idx')
+    op.drop_table('commit_path_index')
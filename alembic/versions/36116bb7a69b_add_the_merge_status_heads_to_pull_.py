@@ -0,0 +1,36 @@
+"""Add the merge_status_base and merge_status_head columns to pull_requests
+
+Revision ID: 36116bb7a69b
+Revises: 1cd0a853e2a5
+Create Date: 2015-06-17 14:21:08.447921
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '36116bb7a69b'
+down_revision = '1cd0a853e2a5'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the columns merge_status_base and merge_status_head to the
+    table pull_requests.
+    '''
+    op.add_column(
+        'pull_requests',
+        sa.Column('merge_status_base', sa.Text, nullable=True)
+    )
+    op.add_column(
+        'pull_requests',
+        sa.Column('merge_status_head', sa.Text, nullable=True)
+    )
+
+
+def downgrade():
+    ''' Remove the columns merge_status_base and merge_status_head from the
+    table pull_requests.
+    '''
+    op.drop_column('pull_requests', 'merge_status_head')
+    op.drop_column('pull_requests', 'merge_status_base')
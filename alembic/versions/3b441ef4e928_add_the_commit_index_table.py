@@ -0,0 +1,49 @@
+"""Add the commit_index table
+
+Revision ID: 3b441ef4e928
+Revises: 4255158a6913
+Create Date: 2015-06-22 11:03:27.904519
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b441ef4e928'
+down_revision = '4255158a6913'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the table commit_index.
+    '''
+    op.create_table(
+        'commit_index',
+        sa.Column(
+            'project_id',
+            sa.Integer,
+            sa.ForeignKey(
+                'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+            primary_key=True,
+        ),
+        sa.Column('branch', sa.String(255), primary_key=True),
+        sa.Column(
+            'position', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('commit', sa.String(40), nullable=False),
+        sa.Column('generation', sa.Integer, nullable=False),
+        sa.Column('author_name', sa.Text, nullable=False),
+        sa.Column('author_email', sa.Text, nullable=False),
+        sa.Column('commit_time', sa.Integer, nullable=False),
+        sa.Column('subject', sa.Text, nullable=False),
+    )
+    op.create_index(
+        'commit_index_commit_idx',
+        'commit_index',
+        ['project_id', 'branch', 'commit'])
+
+
+def downgrade():
+    ''' Remove the table commit_index.
+    '''
+    op.drop_index('commit_index_commit_idx')
+    op.drop_table('commit_index')
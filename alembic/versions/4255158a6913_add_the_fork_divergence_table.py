@@ -0,0 +1,40 @@
+"""Add the fork_divergence table
+
+Revision ID: 4255158a6913
+Revises: 36116bb7a69b
+Create Date: 2015-06-19 09:46:52.310716
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4255158a6913'
+down_revision = '36116bb7a69b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    ''' Add the table fork_divergence.
+    '''
+    op.create_table(
+        'fork_divergence',
+        sa.Column(
+            'project_id',
+            sa.Integer,
+            sa.ForeignKey(
+                'projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+            primary_key=True,
+        ),
+        sa.Column('fork_head', sa.String(40), nullable=False),
+        sa.Column('parent_head', sa.String(40), nullable=False),
+        sa.Column('ahead', sa.Integer, nullable=False),
+        sa.Column('behind', sa.Integer, nullable=False),
+        sa.Column('date_updated', sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    ''' Remove the table fork_divergence.
+    '''
+    op.drop_table('fork_divergence')
@@ -25,7 +25,7 @@ BuildRequires:  python-flask
 BuildRequires:  python-flask-wtf
 BuildRequires:  python-markdown
 BuildRequires:  python-psutil
-BuildRequires:  python-pygit2 >= 0.20.1
+BuildRequires:  python-pygit2 >= 0.22
 BuildRequires:  python-pygments
 BuildRequires:  python-fedora
 BuildRequires:  python-openid
@@ -55,7 +55,7 @@ Requires:  python-flask
 Requires:  python-flask-wtf
 Requires:  python-markdown
 Requires:  python-psutil
-Requires:  python-pygit2 >= 0.20.1
+Requires:  python-pygit2 >= 0.22
 Requires:  python-pygments
 Requires:  python-fedora
 Requires:  python-openid
@@ -122,6 +122,9 @@ install -m 644 files/pagure.wsgi $RPM_BUILD_ROOT/%{_datadir}/pagure/pagure.wsgi
 # Install the createdb script
 install -m 644 createdb.py $RPM_BUILD_ROOT/%{_datadir}/pagure/pagure_createdb.py
 
+# Install the admin script
+install -m 644 pagure_admin.py $RPM_BUILD_ROOT/%{_datadir}/pagure/pagure_admin.py
+
 # Install the alembic configuration file
 install -m 644 files/alembic.ini $RPM_BUILD_ROOT/%{_sysconfdir}/pagure/alembic.ini
 
@@ -17,19 +17,25 @@ __api_version__ = '0.3'
 
 
 import datetime
+import hashlib
 import logging
+import mimetypes
 import os
+import re
 import subprocess
 import urlparse
 from logging.handlers import SMTPHandler
 
+import chardet
 import flask
+import kitchen.text.converters as ktc
 import pygit2
 from flask_fas_openid import FAS
 from functools import wraps
 from sqlalchemy.exc import SQLAlchemyError
 
 import pagure.lib
+import pagure.lib.cache
 import pagure.mail_logging
 import pagure.doc_utils
 import pagure.forms
@@ -67,6 +73,22 @@ APP.logger.addHandler(handler)
 
 LOG = APP.logger
 
+# Number of bytes of a file looked at to guess its type and encoding
+RAW_SAMPLE_SIZE = 64 * 1024
+# Size of the chunks in which raw files are sent
+RAW_CHUNK_SIZE = 64 * 1024
+# Number of parts of a streamed page rendered before being sent
+STREAM_BUFFER_SIZE = 50
+
+# Lifetime in the HTTP caches of the pages and files addressed by commit hash
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+SHA1_RE = re.compile('^[a-f0-9]{40}$')
+
+# Whether blobs are binary and their encoding, keyed by blob oid
+BLOB_TYPE_CACHE = pagure.lib.cache.LRUCache(
+    size=APP.config['BLOB_TYPE_CACHE_SIZE'])
+
 
 def authenticated():
     ''' Utility function checking if the current user is logged in or not.
@@ -348,16 +370,14 @@ def __get_file_in_tree(repo_obj, tree, filepath):
     ''' Retrieve the entry corresponding to the provided filename in a
     given tree.
     '''
-    filename = filepath[0]
     if isinstance(tree, pygit2.Blob):
         return
-    for entry in tree:
-        if entry.name == filename:
-            if len(filepath) == 1:
-                return repo_obj[entry.oid]
-            else:
-                return __get_file_in_tree(
-                    repo_obj, repo_obj[entry.oid], filepath[1:])
+    # The entry is looked up directly by path instead of walking the trees
+    try:
+        entry = tree['/'.join(filepath)]
+    except KeyError:
+        return
+    return repo_obj[entry.oid]
 
 
 def get_repo_path(repo):
@@ -375,6 +395,176 @@ def get_repo_path(repo):
     return repopath
 
 
+def guess_blob_type(oid, data, filename=None):
+    """ Return the mimetype and the encoding with which to serve the
+    content of the blob with the given oid.
+
+    Only the beginning of the content is looked at and the result of the
+    detection is cached by oid, blobs never change.
+    """
+    mimetype, encoding = None, None
+    if filename:
+        mimetype, encoding = mimetypes.guess_type(filename)
+
+    detected = BLOB_TYPE_CACHE.get(oid.hex)
+    if detected is None:
+        sample = data[:RAW_SAMPLE_SIZE]
+        detected = (
+            '\0' in sample, chardet.detect(ktc.to_bytes(sample))['encoding'])
+        BLOB_TYPE_CACHE.set(oid.hex, detected)
+    binary, detected_encoding = detected
+
+    if not mimetype and data[:2] == '#!':
+        mimetype = 'text/plain'
+
+    if not mimetype:
+        if binary:
+            mimetype = 'application/octet-stream'
+        else:
+            mimetype = 'text/plain'
+
+    if mimetype.startswith('text/') and not encoding:
+        encoding = detected_encoding
+
+    return (mimetype, encoding)
+
+
+def _iter_chunks(data, start, stop):
+    """ Yield the content of data between start and stop in chunks. """
+    for offset in xrange(start, stop, RAW_CHUNK_SIZE):
+        yield data[offset:min(offset + RAW_CHUNK_SIZE, stop)]
+
+
+def is_commit_hash(identifier):
+    """ Return whether the provided identifier is a full commit hash, ie:
+    whether the content it points to can never change.
+    """
+    return bool(identifier) and SHA1_RE.match(identifier) is not None
+
+
+def _cache_control(immutable, public):
+    """ Return the Cache-Control header to send with a page or a file. """
+    if immutable:
+        policy = 'max-age=%s, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        policy = 'no-cache'
+    return '%s, %s' % ('public' if public else 'private', policy)
+
+
+def cache_git_page(repo, oid, immutable=False):
+    """ Set up the HTTP caching of a page of the provided project rendered
+    from the git object with the given oid.
+
+    The ETag is derived from the oid, from what the current user is allowed
+    to see on the project and from what else the page shows: the settings
+    and description of the project and its branches and tags. If the
+    client already has the page, the 304 response to send is returned,
+    otherwise the caching headers are added to the response of the view and
+    None is returned.
+
+    :arg immutable: whether the content can be cached forever, only for
+        raw content (such as patches) requested by commit hash. The HTML
+        pages also show the rest of the project (branches, admin links...)
+        which changes, so they are always revalidated.
+    """
+    user = flask.g.fas_user.username if authenticated() else ''
+    repopath = get_repo_path(repo)
+    etag = hashlib.sha1('%s:%s:%s:%s:%s:%s:%s' % (
+        __version__, oid.hex, user, is_repo_admin(repo),
+        (repo.description, repo._settings, repo.avatar_email),
+        pagure.lib.git.get_refs_state(repopath, 'heads'),
+        pagure.lib.git.get_refs_state(repopath, 'tags'))).hexdigest()
+    cache_control = _cache_control(immutable, public=not user)
+
+    if flask.request.if_none_match.contains_weak(etag) \
+            and not flask.session.get('_flashes'):
+        response = flask.Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Cookie')
+        return response
+
+    @flask.after_this_request
+    def add_cache_headers(response):
+        """ Add the caching headers to the page sent. """
+        if response.status_code == 200:
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Cookie')
+        return response
+
+
+def send_blob(repo_obj, oid, filename=None, immutable=False):
+    """ Return the response sending the raw content of the blob with the
+    given oid.
+
+    The oid is used as strong ETag so clients can revalidate their copy
+    cheaply and single byte range requests are supported. The content is
+    sent in chunks.
+
+    :arg immutable: whether the blob was requested by commit hash and thus
+        can be cached forever.
+    """
+    etag = oid.hex
+    cache_control = _cache_control(immutable, public=True)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    data = repo_obj[oid].data
+    if not data:
+        flask.abort(404, 'No content found')
+
+    mimetype, encoding = guess_blob_type(oid, data, filename)
+
+    length = len(data)
+    start, stop = 0, length
+    status = 200
+    content_range = None
+    byte_range = flask.request.range
+    if byte_range and len(byte_range.ranges) == 1 and (
+            'If-Range' not in flask.request.headers
+            or flask.request.if_range.etag == etag):
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            response = flask.Response(status=416)
+            response.headers['Content-Range'] = 'bytes */%s' % length
+            return response
+        start, stop = bounds
+        status = 206
+        content_range = byte_range.make_content_range(length)
+
+    headers = {
+        'Content-Type': mimetype,
+        'Content-Length': str(stop - start),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control,
+    }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+
+    response = flask.Response(
+        _iter_chunks(data, start, stop), status=status, headers=headers,
+        direct_passthrough=True)
+    response.set_etag(etag)
+    if content_range:
+        response.content_range = content_range
+    return response
+
+
+def stream_template(template_name, **context):
+    """ Return the response rendering the given template progressively,
+    the page is sent in parts as soon as they are rendered.
+    """
+    APP.update_template_context(context)
+    template = APP.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return flask.Response(flask.stream_with_context(stream))
+
+
 # Install our markdown modifications
 import pagure.pfmarkdown
 pagure.pfmarkdown.inject()
@@ -359,6 +359,9 @@ def api_error_codes():
 def api():
     ''' Display the api information page. '''
     api_git_tags_doc = load_doc(project.api_git_tags)
+    api_git_branches_doc = load_doc(project.api_git_branches)
+    api_git_commits_doc = load_doc(project.api_git_commits)
+    api_git_history_doc = load_doc(project.api_git_history)
 
     api_new_issue_doc = load_doc(issue.api_new_issue)
     api_view_issues_doc = load_doc(issue.api_view_issues)
@@ -381,6 +384,9 @@ def api():
         'api.html',
         projects=[
             api_git_tags_doc,
+            api_git_branches_doc,
+            api_git_commits_doc,
+            api_git_history_doc,
             api_new_issue_doc,
             api_view_issues_doc,
             api_pull_request_views_doc,
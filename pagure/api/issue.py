@@ -88,6 +88,7 @@ def api_new_issue(repo, username=None):
             filestream = flask.request.files.get('filestream')
             if filestream and '<!!image>' in issue.content:
                 new_filename = pagure.lib.git.add_file_to_git(
+                    session=SESSION,
                     repo=repo,
                     issue=issue,
                     ticketfolder=APP.config['TICKETS_FOLDER'],
@@ -8,12 +8,17 @@
 
 """
 
+import json
+
 import flask
+import pygit2
+from math import ceil
 
 import pagure
 import pagure.exceptions
 import pagure.lib
-from pagure import SESSION
+import pagure.lib.git
+from pagure import APP, SESSION
 from pagure.api import API, api_method, APIERROR
 
 
@@ -24,7 +29,8 @@ def api_git_tags(repo, username=None):
     """
     Project git tags
     ----------------
-    Returns the list of tags made on the git repo of the project.
+    Returns the list of tags made on the git repo of the project, the most
+    recent first.
 
     ::
 
@@ -33,12 +39,281 @@ def api_git_tags(repo, username=None):
 
     Accepts GET queries only.
 
+    :kwarg page: The page of tags to return, defaults to 1
+    :kwarg sort: Sort the tags by ``date``, the default, or by ``version``
+
+    Sample response:
+
+    ::
+
+        {
+          "page": 1,
+          "pages": 1,
+          "tags": ["2.5.5", "2.5.4"],
+          "total_tags": 2
+        }
+
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if repo is None:
+        raise pagure.exceptions.APIError(404, error_code=APIERROR.ENOPROJECT)
+
+    sort = flask.request.args.get('sort', 'date')
+    if sort not in pagure.lib.git.TAGS_SORT:
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+
+    try:
+        page = int(flask.request.args.get('page', 1))
+    except ValueError:
+        page = 0
+    if page < 1:
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+
+    limit = APP.config['ITEM_PER_PAGE']
+    start = limit * (page - 1)
+
+    tags = pagure.lib.git.get_git_tags(repo, sort=sort)
+
+    jsonout = flask.jsonify({
+        'tags': [tag.name for tag in tags[start:start + limit]],
+        'total_tags': len(tags),
+        'page': page,
+        'pages': int(ceil(len(tags) / float(limit))),
+    })
+    return jsonout
+
+
+@API.route('/<repo>/git/branches')
+@API.route('/fork/<username>/<repo>/git/branches')
+@api_method
+def api_git_branches(repo, username=None):
+    """
+    Project git branches
+    --------------------
+    Returns the list of branches of the git repo of the project, sorted by
+    name.
+
+    ::
+
+        /api/0/<repo>/git/branches
+        /api/0/fork/<username>/<repo>/git/branches
+
+    Accepts GET queries only.
+
+    :kwarg page: The page of branches to return, defaults to 1
+    :kwarg pattern: Only return the branches whose name matches this
+        pattern, ``*`` matching any sequence of characters
+
+    Sample response:
+
+    ::
+
+        {
+          "branches": ["feature/foo", "master"],
+          "page": 1,
+          "pages": 1,
+          "total_branches": 2
+        }
+
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if repo is None:
+        raise pagure.exceptions.APIError(404, error_code=APIERROR.ENOPROJECT)
+
+    try:
+        page = int(flask.request.args.get('page', 1))
+    except ValueError:
+        page = 0
+    if page < 1:
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+
+    limit = APP.config['ITEM_PER_PAGE']
+    start = limit * (page - 1)
+
+    repo_obj = pagure.lib.git.get_repo_obj(pagure.get_repo_path(repo))
+    branches = pagure.lib.git.get_branch_index(repo_obj).search(
+        flask.request.args.get('pattern', None))
+
+    jsonout = flask.jsonify({
+        'branches': [
+            branch.name for branch in branches[start:start + limit]],
+        'total_branches': len(branches),
+        'page': page,
+        'pages': int(ceil(len(branches) / float(limit))),
+    })
+    return jsonout
+
+
+@API.route('/<repo>/git/commits')
+@API.route('/fork/<username>/<repo>/git/commits')
+@api_method
+def api_git_commits(repo, username=None):
+    """
+    Project git commits
+    -------------------
+    Returns the commits of the git repo of the project, the most recent
+    first, one page at a time.
+
+    ::
+
+        /api/0/<repo>/git/commits
+        /api/0/fork/<username>/<repo>/git/commits
+
+    Accepts GET queries only.
+
+    :kwarg ref: The branch or commit hash whose history to return, defaults
+        to ``master``
+    :kwarg path: Only return the commits changing this file or folder
+    :kwarg limit: The number of commits to return, defaults to the number
+        of items per page of the instance
+    :kwarg cursor: The ``next_cursor`` returned with the previous page,
+        omit it to get the first page
+
+    ``next_cursor`` is ``null`` on the last page.
+
+    Sample response:
+
+    ::
+
+        {
+          "commits": [
+            {
+              "author": {
+                "email": "alice@authors.tld",
+                "name": "Alice Author"
+              },
+              "date": 1436797813,
+              "hash": "0fe1d0c4f4ab1c1c0e7b7cd6c1e3e98a0ac1c9a3",
+              "parents": ["a9e9c4e6f4bd9b4e8a5c1c5e1ed1e0a2d3f5b7c8"],
+              "summary": "Add sources file for testing"
+            }
+          ],
+          "next_cursor": "a9e9c4e6f4bd9b4e8a5c1c5e1ed1e0a2d3f5b7c8"
+        }
+
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if repo is None:
+        raise pagure.exceptions.APIError(404, error_code=APIERROR.ENOPROJECT)
+
+    try:
+        limit = int(flask.request.args.get(
+            'limit', APP.config['ITEM_PER_PAGE']))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+    limit = min(limit, APP.config['API_COMMITS_MAX_PER_PAGE'])
+
+    path = flask.request.args.get('path', '').strip('/') or None
+
+    repo_obj = pagure.lib.git.get_repo_obj(pagure.get_repo_path(repo))
+
+    cursor = flask.request.args.get('cursor', None)
+    if cursor is not None:
+        cursor = cursor.split(',')
+    else:
+        ref = flask.request.args.get('ref', 'master')
+        branch = pagure.lib.git.get_branch_index(repo_obj).get(ref)
+        if branch is not None:
+            cursor = [branch.commit]
+        elif pagure.is_commit_hash(ref):
+            cursor = [ref]
+        elif ref == 'master' and repo_obj.is_empty:
+            cursor = []
+        else:
+            raise pagure.exceptions.APIError(
+                400, error_code=APIERROR.EINVALIDREQ)
+
+    for commit in cursor:
+        try:
+            commit = repo_obj.get(commit) \
+                if pagure.is_commit_hash(commit) else None
+        except ValueError:
+            commit = None
+        if not isinstance(commit, pygit2.Commit):
+            raise pagure.exceptions.APIError(
+                400, error_code=APIERROR.EINVALIDREQ)
+
+    log = pagure.lib.git.CommitLog(repo_obj, cursor, path=path, limit=limit)
+
+    def generate():
+        """ Return the JSON of the page of commits piece by piece, as the
+        history is walked.
+        """
+        yield '{"commits": ['
+        for cnt, commit in enumerate(log):
+            yield (', ' if cnt else '') + json.dumps({
+                'hash': commit.hex,
+                'author': {
+                    'name': commit.author.name,
+                    'email': commit.author.email,
+                },
+                'date': commit.commit_time,
+                'summary': commit.message.split('\n', 1)[0],
+                'parents': [parent.hex for parent in commit.parents],
+            }, sort_keys=True)
+        next_cursor = None
+        if log.next_cursor:
+            next_cursor = ','.join(log.next_cursor)
+        yield '], "next_cursor": %s}' % json.dumps(next_cursor)
+
+    return flask.Response(
+        flask.stream_with_context(generate()),
+        mimetype='application/json')
+
+
+@API.route('/<repo>/git/history')
+@API.route('/fork/<username>/<repo>/git/history')
+@api_method
+def api_git_history(repo, username=None):
+    """
+    Project git history of a path
+    -----------------------------
+    Returns the commits of a branch of the git repo of the project changing
+    a file or folder, the most recent first.
+
+    ::
+
+        /api/0/<repo>/git/history
+        /api/0/fork/<username>/<repo>/git/history
+
+    Accepts GET queries only.
+
+    :kwarg path: The path of the file or folder whose history to return
+    :kwarg branch: The branch whose history to look into, defaults to
+        ``master``
+    :kwarg page: The page of commits to return, defaults to 1
+
+    ``total_commits`` and ``pages`` are ``null`` while the history of the
+    branch is not indexed and the page returned is not its last one.
+
     Sample response:
 
     ::
 
         {
-          "tags": ["2.5.4", "2.5.5"],
+          "commits": [
+            {
+              "author": {
+                "email": "alice@authors.tld",
+                "name": "Alice Author"
+              },
+              "date": 1436797813,
+              "hash": "0fe1d0c4f4ab1c1c0e7b7cd6c1e3e98a0ac1c9a3",
+              "summary": "Add sources file for testing"
+            }
+          ],
+          "page": 1,
+          "pages": 1,
+          "total_commits": 1
         }
 
     """
@@ -47,7 +322,48 @@ def api_git_tags(repo, username=None):
     if repo is None:
         raise pagure.exceptions.APIError(404, error_code=APIERROR.ENOPROJECT)
 
-    tags = pagure.lib.git.get_git_tags(repo)
+    path = flask.request.args.get('path', '').strip('/')
+    branch = flask.request.args.get('branch', 'master')
+
+    try:
+        page = int(flask.request.args.get('page', 1))
+    except ValueError:
+        page = 0
+    if not path or page < 1:
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+
+    repo_obj = pagure.lib.git.get_repo_obj(pagure.get_repo_path(repo))
+    if branch not in pagure.lib.git.get_branch_index(repo_obj):
+        raise pagure.exceptions.APIError(
+            400, error_code=APIERROR.EINVALIDREQ)
+
+    limit = APP.config['ITEM_PER_PAGE']
+    n_commits, commits = pagure.lib.git.get_path_summaries(
+        SESSION, repo, repo_obj, branch, path,
+        offset=limit * (page - 1), limit=limit)
+
+    # The number of commits is not known until the branch is indexed,
+    # there is then a next page
+    total_page = None
+    if n_commits is not None:
+        total_page = int(ceil(n_commits / float(limit)))
 
-    jsonout = flask.jsonify({'tags': tags})
+    jsonout = flask.jsonify({
+        'commits': [
+            {
+                'hash': commit.hex,
+                'author': {
+                    'name': commit.author.name,
+                    'email': commit.author.email,
+                },
+                'date': commit.commit_time,
+                'summary': commit.message.split('\n', 1)[0],
+            }
+            for commit in commits
+        ],
+        'total_commits': n_commits,
+        'page': page,
+        'pages': total_page,
+    })
     return jsonout
@@ -41,6 +41,12 @@ GIT_URL_GIT = 'git://pagure.org'
 # Number of items displayed per page
 ITEM_PER_PAGE = 50
 
+# Number of entries of a folder displayed per page when browsing the tree
+TREE_ITEM_PER_PAGE = 500
+
+# Maximum number of commits returned per page by the API
+API_COMMITS_MAX_PER_PAGE = 500
+
 # Maximum size of the uploaded content
 MAX_CONTENT_LENGTH = 4 * 1024 * 1024  # 4 megabytes
 
@@ -82,6 +88,82 @@ REQUESTS_FOLDER = os.path.join(
     'requests'
 )
 
+# Folder in which the archives of the repos are cached
+ARCHIVE_FOLDER = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    '..',
+    'archives'
+)
+
+# Size in bytes the archives are pruned to by the prune-archives action of
+# pagure_admin.py, which can be run from cron
+ARCHIVE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+# Folder in which the updates to the tickets and pull-requests git repos
+# are queued so that the changes made in a short window are committed
+# together. If None, every change is committed right away.
+GIT_QUEUE_FOLDER = None
+
+# Number of seconds during which the updates are collected in the queue
+# before being committed
+GIT_QUEUE_DELAY = 2
+
+# Number of processes used to recompute, in the background, the merge
+# status of the open pull-requests of a project when one of their branches
+# is pushed to
+MERGE_STATUS_WORKERS = 4
+
+# Number of files for which the type and encoding are kept in memory when
+# serving them raw
+BLOB_TYPE_CACHE_SIZE = 10000
+
+# Folder in which rendered content (highlighted files...) is cached. If
+# None, it is cached in memory, by process.
+CACHE_FOLDER = None
+
+# Number of entries kept by each of the in-memory caches
+CACHE_SIZE = 1000
+
+# Number of files whose diff is shown in the page of a commit or of a
+# pull-request, the diff of the others is loaded on demand
+DIFF_FILES_INLINE = 25
+
+# Files with more lines changed than this are not shown by default
+DIFF_FILE_MAX_LINES = 1000
+
+# Number of processes computing the diffs shown, if 0 the diffs are
+# computed in the process serving the request
+DIFF_WORKERS = 2
+
+# Limits of the CPU time (in seconds) and memory (in bytes) a diff can use
+# before being considered too large to be shown
+DIFF_CPU_TIME = 30
+DIFF_MEMORY = 1024 * 1024 * 1024
+
+# Number of seconds to wait for a diff, queued or computed, before giving
+# up on it for this request, a worker killed by the CPU time limit never
+# answers so this should not be longer than DIFF_CPU_TIME
+DIFF_TIMEOUT = 30
+
+# Number of diffs, and their total size in bytes, kept by the in-memory
+# cache of each process
+DIFF_CACHE_SIZE = 100
+DIFF_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# Maximum number of hunks a file can change in a commit for its blame to be
+# derived from the blame in the parent commit rather than computed again
+BLAME_INCREMENTAL_HUNKS = 10
+
+# Number of git repositories kept open by each thread
+GIT_REPO_POOL_SIZE = 20
+
+# Limits, in bytes, of the object cache of libgit2 and of the size and
+# total of the windows of the pack files it maps in memory. If None, the
+# defaults of libgit2 are used.
+GIT_OBJECT_CACHE_SIZE = None
+GIT_MWINDOW_SIZE = None
+GIT_MWINDOW_MAPPED_LIMIT = None
+
 # Configuration file for gitolite
 GITOLITE_CONFIG = os.path.join(
     os.path.abspath(os.path.dirname(__file__)),
@@ -44,3 +44,17 @@ class BranchNotFoundException(PagureException):
     found in a repository.
     '''
     pass
+
+
+class BranchMovedException(PagureException):
+    ''' Exception thrown when a branch moved while we were preparing a
+    commit to put on top of it.
+    '''
+    pass
+
+
+class DiffTooLargeException(PagureException):
+    ''' Exception thrown when a diff could not be computed within the
+    resources allowed.
+    '''
+    pass
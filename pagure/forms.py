@@ -283,6 +283,8 @@ class EditFileForm(wtf.Form):
         'Email', [wtforms.validators.Required()],
         choices=[(item, item) for item in []]
     )
+    parent = wtforms.HiddenField(
+        'Parent commit', [wtforms.validators.optional()])
 
     def __init__(self, *args, **kwargs):
         """ Calls the default constructor with the normal argument but
@@ -45,7 +45,8 @@ class BaseHook(object):
     @classmethod
     def set_up(cls, project):
         ''' Install the generic post-receive hook that allow us to call
-        multiple post-receive hooks as set per plugin.
+        multiple post-receive hooks as set per plugin, and the hook of the
+        git repo of the project that is always enabled.
         '''
         repopaths = [get_repo_path(project)]
         for folder in [
@@ -72,6 +73,13 @@ class BaseHook(object):
                     postreceive)
                 os.chmod(postreceive, 0755)
 
+        # Keep what pagure derives from the branches up to date
+        hook_path = os.path.join(
+            repopaths[0], 'hooks', 'post-receive.default')
+        if not os.path.lexists(hook_path):
+            os.symlink(
+                os.path.join(hook_files, 'default_hook.py'), hook_path)
+
     @classmethod
     def install(cls, project, dbobj):  # pragma: no cover
         ''' Method called to install the hook for a project.
@@ -0,0 +1,50 @@
+#! /usr/bin/env python2
+
+
+"""Pagure hook installed in the git repository of every project, keeping
+what pagure derives from its branches up to date when they are pushed to.
+"""
+
+import os
+import sys
+
+if 'PAGURE_CONFIG' not in os.environ \
+        and os.path.exists('/etc/pagure/pagure.cfg'):
+    os.environ['PAGURE_CONFIG'] = '/etc/pagure/pagure.cfg'
+
+
+import pagure
+import pagure.lib.git
+
+
+abspath = os.path.abspath(os.environ['GIT_DIR'])
+
+
+def run_as_post_receive_hook():
+
+    branches = []
+    for line in sys.stdin:
+        (oldrev, newrev, refname) = line.strip().split(' ', 2)
+        if refname.startswith('refs/heads/'):
+            branches.append(refname[len('refs/heads/'):])
+
+    if not branches:
+        return
+
+    project = pagure.lib.get_project(
+        pagure.SESSION,
+        pagure.lib.git.get_repo_name(abspath),
+        user=pagure.lib.git.get_username(abspath))
+    if not project:
+        return
+
+    # The work is done in the background, the push does not wait for it
+    pagure.lib.git.refresh_project_in_background(project, branches)
+
+
+def main(args):
+    run_as_post_receive_hook()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -192,7 +192,10 @@ def mergeable_request_pull():
     if not request:
         flask.abort(404, 'Pull-request not found')
 
-    if request.merge_status and not force:
+    # The merge status is only valid for the heads it was computed for
+    if request.merge_status and not force and (
+            request.merge_status_base, request.merge_status_head
+    ) == pagure.lib.git.get_merge_status_heads(request):
         return flask.jsonify({
             'code': request.merge_status,
             'short_code': MERGE_OPTIONS[request.merge_status]['short_code'],
@@ -1170,6 +1170,129 @@ def get_project(session, name, user=None):
     return query.first()
 
 
+def get_forks_network(session, project):
+    ''' Return the forks of the specified project, oldest first, with their
+    user and their divergence from the project loaded in the same query.
+    '''
+    query = session.query(
+        model.Project
+    ).filter(
+        model.Project.parent_id == project.id
+    ).options(
+        sqlalchemy.orm.joinedload('user'),
+        sqlalchemy.orm.joinedload('divergence'),
+    ).order_by(
+        model.Project.date_created
+    )
+
+    return query.all()
+
+
+def get_commit_index_head(session, project, branch):
+    ''' Return the entry of the commit index of the specified branch of the
+    specified project for its most recent commit, None if the branch has
+    not been indexed.
+    '''
+    query = session.query(
+        model.CommitIndex
+    ).filter(
+        model.CommitIndex.project_id == project.id
+    ).filter(
+        model.CommitIndex.branch == branch
+    ).order_by(
+        model.CommitIndex.position.desc()
+    )
+
+    return query.first()
+
+
+def get_commit_index(session, project, branch, offset=0, limit=None):
+    ''' Return the entries of the commit index of the specified branch of
+    the specified project, most recent first.
+
+    The entries are selected by position, so retrieving a page anywhere in
+    the history costs the same.
+    '''
+    head = get_commit_index_head(session, project, branch)
+    if head is None:
+        return []
+
+    query = session.query(
+        model.CommitIndex
+    ).filter(
+        model.CommitIndex.project_id == project.id
+    ).filter(
+        model.CommitIndex.branch == branch
+    ).filter(
+        model.CommitIndex.position <= head.position - offset
+    ).order_by(
+        model.CommitIndex.position.desc()
+    )
+
+    if limit:
+        query = query.filter(
+            model.CommitIndex.position > head.position - offset - limit
+        )
+
+    return query.all()
+
+
+def get_path_history(
+        session, project, branch, path, start=None, limit=None,
+        count=False):
+    ''' Return the entries of the commit index of the specified branch of
+    the specified project for the commits changing the specified path (file
+    or folder), most recent first.
+
+    The commits are selected through the commit path index, so no commit
+    is diffed.
+    '''
+    query = session.query(
+        model.CommitIndex
+    ).filter(
+        model.CommitIndex.project_id == project.id
+    ).filter(
+        model.CommitIndex.branch == branch
+    ).filter(
+        model.CommitPathIndex.project_id == model.CommitIndex.project_id
+    ).filter(
+        model.CommitPathIndex.commit == model.CommitIndex.commit
+    ).filter(
+        model.CommitPathIndex.path == path
+    ).order_by(
+        model.CommitIndex.position.desc()
+    )
+
+    if start is not None:
+        query = query.offset(start)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    if count:
+        return query.count()
+    else:
+        return query.all()
+
+
+def has_path_index(session, project, branch):
+    ''' Return whether the paths changed by all the commits of the commit
+    index of the specified branch of the specified project are recorded in
+    the commit path index.
+    '''
+    query = session.query(
+        model.CommitIndex.position
+    ).filter(
+        model.CommitIndex.project_id == project.id
+    ).filter(
+        model.CommitIndex.branch == branch
+    ).filter(
+        model.CommitIndex.paths_indexed.is_(False)
+    )
+
+    return query.first() is None
+
+
 def search_issues(
         session, repo, issueid=None, status=None, closed=False, tags=None,
         assignee=None, author=None, private=None, count=False):
@@ -1545,6 +1668,21 @@ def get_request_comment(session, request_uid, comment_id):
     return query.first()
 
 
+def get_issue_attachment(session, project, sha256):
+    ''' Return the file attached to a ticket of the specified project whose
+    content has the specified sha256 checksum, if there is one.
+    '''
+    query = session.query(
+        model.IssueAttachment
+    ).filter(
+        model.IssueAttachment.project_id == project.id
+    ).filter(
+        model.IssueAttachment.sha256 == sha256
+    )
+
+    return query.first()
+
+
 def get_issue_by_uid(session, issue_uid):
     ''' Return the issue corresponding to the specified unique identifier.
 
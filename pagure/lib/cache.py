@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2015 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+import collections
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+
+
+class LRUCache(object):
+    """ A thread-safe in-memory cache keeping at most ``size`` entries and
+    dropping the least recently used ones first.
+
+    Meant to cache information derived from immutable git objects, keyed
+    by their oid, in the process serving the requests.
+    """
+
+    def __init__(self, size=1000, weigh=None, max_weight=None):
+        """ Constructor.
+        :arg size: the maximum number of entries kept in the cache.
+        :kwarg weigh: a function returning the weight (for example the
+            size in bytes) of a value.
+        :kwarg max_weight: the maximum total weight of the entries kept
+            in the cache, only used with ``weigh``.
+        """
+        self.size = size
+        self.weigh = weigh
+        self.max_weight = max_weight
+        self.weight = 0
+        # The values are stored with their weight
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Return the value cached for the given key, or ``default`` if
+        there is none.
+        """
+        with self._lock:
+            try:
+                entry = self._data.pop(key)
+            except KeyError:
+                return default
+            # Re-insert the entry to mark it as the most recently used
+            self._data[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        """ Cache the given value for the given key.
+
+        A value weighing more than ``max_weight`` on its own is not
+        cached.
+        """
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.weight -= old[1]
+            if self.weigh and self.max_weight is not None \
+                    and weight > self.max_weight:
+                return
+            self._data[key] = (value, weight)
+            self.weight += weight
+            while len(self._data) > self.size or (
+                    self.weigh and self.max_weight is not None
+                    and self.weight > self.max_weight):
+                self.weight -= self._data.popitem(last=False)[1][1]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        """ Remove all the entries from the cache. """
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+
+class DiskCache(object):
+    """ A cache storing each of its entries as a file in the given folder.
+
+    Entries are never evicted by pagure, old files can be pruned from the
+    folder at any time (for example using tmpwatch).
+    """
+
+    def __init__(self, folder):
+        """ Constructor.
+        :arg folder: the folder in which the entries are stored.
+        """
+        self.folder = folder
+
+    def _get_path(self, key):
+        """ Return the path of the file storing the entry for the key. """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def get(self, key, default=None):
+        """ Return the value cached for the given key, or ``default`` if
+        there is none.
+        """
+        try:
+            with open(self._get_path(key), 'rb') as stream:
+                return cPickle.load(stream)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return default
+
+    def set(self, key, value):
+        """ Cache the given value for the given key. """
+        path = self._get_path(key)
+        folder = os.path.dirname(path)
+        try:
+            os.makedirs(folder)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+        # Write the entry aside and move it in place so that readers never
+        # see a partially written file
+        filedesc, tmppath = tempfile.mkstemp(dir=folder)
+        with os.fdopen(filedesc, 'wb') as stream:
+            cPickle.dump(value, stream, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, path)
+
+    def __contains__(self, key):
+        return os.path.exists(self._get_path(key))
+
+
+def get_cache(name, folder=None, size=1000, weigh=None, max_weight=None):
+    """ Return the cache to use for the given kind of entries.
+
+    :arg name: the name of the cache, used as sub-folder of ``folder``.
+    :kwarg folder: the folder in which to store the entries on disk, if
+        None the entries are kept in memory.
+    :kwarg size: the maximum number of entries kept in memory.
+    :kwarg weigh: a function returning the weight of a value kept in
+        memory.
+    :kwarg max_weight: the maximum total weight of the entries kept in
+        memory.
+    """
+    if folder:
+        return DiskCache(os.path.join(folder, name))
+    return LRUCache(size=size, weigh=weigh, max_weight=max_weight)
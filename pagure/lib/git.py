@@ -9,13 +9,21 @@
 """
 
 
+import atexit
 import datetime
+import fcntl
+import fnmatch
 import hashlib
 import json
+import multiprocessing
 import os
+import re
+import resource
 import shutil
+import signal
 import subprocess
 import tempfile
+import threading
 
 import pygit2
 import werkzeug
@@ -25,25 +33,126 @@ from sqlalchemy.exc import SQLAlchemyError
 import pagure
 import pagure.exceptions
 import pagure.lib
+import pagure.lib.cache
 import pagure.lib.notify
 from pagure.lib import model
 
 # pylint: disable=R0913,E1101,R0914
 
 
+# Flushes of the git queues scheduled in this process
+_QUEUE_TIMERS = {}
+_QUEUE_LOCK = threading.Lock()
+
+# Size of the chunks in which uploaded files are read
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Repositories opened by each thread, see get_repo_obj
+_REPO_POOL = threading.local()
+_LIBGIT2_CONFIGURED = False
+
+
+class CommitAuthor(object):
+    """ Name and email of the author of a commit from the commit index. """
+
+    __slots__ = ('name', 'email')
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+
+class CommitSummary(object):
+    """ Lightweight summary of a commit from the commit index, used instead
+    of a pygit2 Commit when listing the history of a branch.
+
+    ``message`` only contains the first line of the commit message.
+    """
+
+    __slots__ = (
+        'hex', 'author', 'commit_time', 'message', 'generation', 'position')
+
+    def __init__(self, entry):
+        self.hex = entry.commit
+        self.author = CommitAuthor(entry.author_name, entry.author_email)
+        self.commit_time = entry.commit_time
+        self.message = entry.subject
+        self.generation = entry.generation
+        self.position = entry.position
+
+
+def _configure_libgit2():
+    """ Apply the limits set in the configuration to the caches of libgit2,
+    they are global to the process.
+    """
+    global _LIBGIT2_CONFIGURED
+    if _LIBGIT2_CONFIGURED:
+        return
+    _LIBGIT2_CONFIGURED = True
+
+    settings = pygit2.settings
+    if pagure.APP.config['GIT_MWINDOW_SIZE']:
+        settings.mwindow_size = pagure.APP.config['GIT_MWINDOW_SIZE']
+    if pagure.APP.config['GIT_MWINDOW_MAPPED_LIMIT']:
+        settings.mwindow_mapped_limit = \
+            pagure.APP.config['GIT_MWINDOW_MAPPED_LIMIT']
+    if pagure.APP.config['GIT_OBJECT_CACHE_SIZE']:
+        if hasattr(settings, 'cache_max_size'):
+            settings.cache_max_size(pagure.APP.config['GIT_OBJECT_CACHE_SIZE'])
+        else:  # pragma: no cover
+            pagure.APP.logger.warning(
+                'This version of pygit2 cannot limit the object cache')
+
+
+def get_repo_obj(repopath):
+    """ Return the pygit2 Repository of the git repo at the given path.
+
+    The repositories are kept open in a LRU of GIT_REPO_POOL_SIZE handles
+    per thread, so their configuration, pack indexes, mapped windows and
+    object cache are reused from one request to the next.
+    libgit2 reads the references from the disk at each lookup and looks for
+    new packs when an object is not found, so the handles only need to be
+    checked against the folder of the repo, which changes when the repo is
+    deleted or re-created.
+    """
+    _configure_libgit2()
+
+    pool = getattr(_REPO_POOL, 'cache', None)
+    if pool is None or _REPO_POOL.pid != os.getpid():
+        # Handles inherited from the parent process are not shared
+        pool = _REPO_POOL.cache = pagure.lib.cache.LRUCache(
+            size=pagure.APP.config['GIT_REPO_POOL_SIZE'])
+        _REPO_POOL.pid = os.getpid()
+
+    repopath = os.path.abspath(repopath)
+    try:
+        stat = os.stat(repopath)
+    except OSError:
+        # Let pygit2 report the error
+        return pygit2.Repository(repopath)
+    token = (stat.st_ino, stat.st_mtime)
+
+    entry = pool.get(repopath)
+    if entry is None or entry[0] != token:
+        entry = (token, pygit2.Repository(repopath))
+        pool.set(repopath, entry)
+    return entry[1]
+
+
 def commit_to_patch(repo_obj, commits):
     ''' For a given commit (PyGit2 commit object) of a specified git repo,
-    returns a string representation of the changes the commit did in a
-    format that allows it to be used as patch.
+    yields the representation of the changes the commit did in a format
+    that allows it to be used as patch.
+
+    The patch is generated piece by piece, the header of each commit then
+    the patch of each file it changed, so it can be streamed without ever
+    holding the whole patch in memory.
     '''
     if not isinstance(commits, list):
         commits = [commits]
 
-    patch = ""
     for cnt, commit in enumerate(commits):
         if commit.parents:
-            diff = commit.tree.diff_to_tree()
-
             parent = repo_obj.revparse_single('%s^' % commit.oid.hex)
             diff = repo_obj.diff(parent, commit)
         else:
@@ -59,7 +168,7 @@ def commit_to_patch(repo_obj, commits):
         if len(commits) > 1:
             subject = '[PATCH %s/%s] %s' % (cnt + 1, len(commits), subject)
 
-        patch += u"""From {commit} Mon Sep 17 00:00:00 2001
+        yield u"""From {commit} Mon Sep 17 00:00:00 2001
 From: {author_name} <{author_email}>
 Date: {date}
 Subject: {subject}
@@ -67,16 +176,30 @@ Subject: {subject}
 {msg}
 ---
 
-{patch}
 """.format(commit=commit.oid.hex,
            author_name=commit.author.name,
            author_email=commit.author.email,
            date=datetime.datetime.utcfromtimestamp(
                commit.commit_time).strftime('%b %d %Y %H:%M:%S +0000'),
            subject=subject,
-           msg=message,
-           patch=diff.patch)
-    return patch
+           msg=message)
+
+        for patch in _iter_diff_patches(diff):
+            yield patch
+        yield u'\n'
+
+
+def _iter_diff_patches(diff):
+    ''' Yield the text of the patch of each file changed in the given
+    pygit2 Diff, or the patch of the whole diff at once if the version of
+    pygit2 does not give access to the text of the patch of a file.
+    '''
+    for patch in diff:
+        if not hasattr(patch, 'patch'):
+            # This is depending on the pygit2 version
+            yield diff.patch
+            return
+        yield patch.patch
 
 
 def write_gitolite_acls(session, configfile):
@@ -118,87 +241,369 @@ def write_gitolite_acls(session, configfile):
             stream.write(row + '\n')
 
 
-def update_git(obj, repo, repofolder, objtype='ticket'):
-    """ Update the given issue in its git.
+def _get_ref_target(repo_obj, refname):
+    """ Return the oid the given reference points to or None if the
+    reference does not exist (yet).
+    """
+    try:
+        return repo_obj.lookup_reference(refname).target
+    except (KeyError, ValueError):
+        return None
+
+
+def _set_ref_target(repo_obj, refname, new_oid, old_oid):
+    """ Move the given reference to ``new_oid`` if and only if it is still
+    pointing to ``old_oid`` (compare-and-swap), ``old_oid`` being None if
+    the reference must not exist yet.
 
-    This method forks the provided repo, add/edit the issue whose file name
-    is defined by the uid field of the issue and if there are additions/
-    changes commit them and push them back to the original repo.
+    The reference is moved by ``git update-ref`` which checks its current
+    value while holding the lock of the reference, as ``git receive-pack``
+    does, so a concurrent push is never overwritten.
+
+    :raise pagure.exceptions.BranchMovedException: if the reference no
+        longer points to ``old_oid`` or is being updated by someone else.
 
     """
+    old = old_oid.hex if old_oid is not None else '0' * 40
+    proc = subprocess.Popen(
+        ['git', 'update-ref', refname, new_oid.hex, old],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=repo_obj.path)
+    err = proc.communicate()[1]
+    if proc.returncode:
+        raise pagure.exceptions.BranchMovedException(
+            'Reference %s could not be moved from %s: %s' % (
+                refname, old, err.strip()))
 
-    if not repofolder:
-        return
 
-    # Get the fork
-    repopath = os.path.join(repofolder, repo.path)
+def _update_tree(repo_obj, tree, changes):
+    """ Return the oid of a copy of the given tree with the given changes
+    applied.
 
-    # Clone the repo into a temp folder
-    newpath = tempfile.mkdtemp(prefix='pagure-')
-    new_repo = pygit2.clone_repository(repopath, newpath)
+    Only the trees containing changed entries are rewritten, all the
+    other entries are re-used as they are. Changed files keep their mode,
+    new files are created as regular files.
 
-    file_path = os.path.join(newpath, obj.uid)
+    :arg repo_obj: the pygit2 Repository in which to write the trees
+    :arg tree: the pygit2 Tree to start from, can be None
+    :arg changes: a dict associating the path (relative to ``tree``) of
+        the files changed to the oid of their new blob, or to None if the
+        file is to be removed
+
+    """
+    if tree is not None:
+        builder = repo_obj.TreeBuilder(tree)
+    else:
+        builder = repo_obj.TreeBuilder()
+
+    subchanges = {}
+    for path, oid in changes.items():
+        if '/' in path:
+            name, path = path.split('/', 1)
+            subchanges.setdefault(name, {})[path] = oid
+            continue
+
+        exists = tree is not None and path in tree
+        if oid is None:
+            if exists:
+                builder.remove(path)
+        else:
+            filemode = pygit2.GIT_FILEMODE_BLOB
+            if exists and tree[path].filemode != pygit2.GIT_FILEMODE_TREE:
+                filemode = tree[path].filemode
+            builder.insert(path, oid, filemode)
+
+    for name in subchanges:
+        exists = tree is not None and name in tree
+        subtree = None
+        if exists and tree[name].filemode == pygit2.GIT_FILEMODE_TREE:
+            subtree = repo_obj[tree[name].oid]
+        oid = _update_tree(repo_obj, subtree, subchanges[name])
+        # git does not store empty folders
+        if len(repo_obj[oid]):
+            builder.insert(name, oid, pygit2.GIT_FILEMODE_TREE)
+        elif exists:
+            builder.remove(name)
+
+    return builder.write()
+
+
+def _get_path_oid(tree, path):
+    """ Return the oid of the entry at the given path in the given tree or
+    None if there is no such entry.
+    """
+    if tree is None:
+        return
+    try:
+        return tree[path].oid
+    except KeyError:
+        return
 
-    # Get the current index
-    index = new_repo.index
 
-    # Are we adding files
-    added = False
-    if not os.path.exists(file_path):
-        added = True
+def _commit_changes(
+        repo_obj, refname, changes, message, author, committer=None,
+        base=None, retries=5):
+    """ Commit the given changes on top of the given reference directly
+    in the (bare) git repository, without any clone or working tree.
+
+    :arg repo_obj: the pygit2 Repository to commit into
+    :arg refname: the full name of the reference to update, for example
+        ``refs/heads/master``
+    :arg changes: a dict associating the path of the files changed to the
+        oid of their new blob, or to None if the file is to be removed
+    :arg message: the commit message
+    :arg author: the pygit2 Signature of the author of the commit
+    :kwarg committer: the pygit2 Signature of the committer, defaults to
+        the author
+    :kwarg base: the oid of the commit the changes were made against, if
+        specified and one of the files changed was also changed in the
+        reference since then, a BranchMovedException is raised
+    :kwarg retries: the number of times to rebuild the commit if the
+        reference moved while we were building it
+    :return: the oid of the commit created or None if there was nothing
+        to commit
 
-    # Write down what changed
-    with open(file_path, 'w') as stream:
-        stream.write(json.dumps(obj.to_json()))
+    """
+    committer = committer or author
+    for _ in range(retries):
+        parent = _get_ref_target(repo_obj, refname)
+        tree = None
+        if parent is not None:
+            tree = repo_obj[parent].tree
+
+        if base is not None and parent != base:
+            base_tree = repo_obj[base].tree
+            for path in changes:
+                if _get_path_oid(tree, path) != \
+                        _get_path_oid(base_tree, path):
+                    raise pagure.exceptions.BranchMovedException(
+                        '%s was changed in %s since %s' % (
+                            path, refname, base))
+
+        new_tree = repo_obj[_update_tree(repo_obj, tree, changes)]
+
+        if tree is None and not len(new_tree):
+            return
+        elif tree is not None and new_tree.oid == tree.oid:
+            return
+
+        parents = []
+        if parent is not None:
+            parents.append(parent)
+
+        commit = repo_obj.create_commit(
+            None, author, committer, message, new_tree.oid, parents)
+        try:
+            _set_ref_target(repo_obj, refname, commit, parent)
+            return commit
+        except pagure.exceptions.BranchMovedException:
+            continue
 
-    # Retrieve the list of files that changed
-    diff = new_repo.diff()
-    files = [patch.new_file_path for patch in diff]
+    raise pagure.exceptions.BranchMovedException(
+        'Could not update %s, it keeps moving' % refname)
 
-    # Add the changes to the index
-    if added:
-        index.add(obj.uid)
-    for filename in files:
-        index.add(filename)
 
-    # If not change, return
-    if not files and not added:
-        shutil.rmtree(newpath)
+def _get_queue_folder(repopath):
+    """ Return the folder in which the updates to the given git repository
+    are queued, or None if the updates are not to be queued.
+    """
+    queue = pagure.APP.config.get('GIT_QUEUE_FOLDER')
+    if not queue:
         return
+    return os.path.join(queue, os.path.abspath(repopath).lstrip(os.sep))
+
 
-    # See if there is a parent to this commit
-    parent = None
+def _queue_git_update(queuedir, repopath, uid, content, message):
+    """ Store the new content of the file named ``uid`` in the queue of
+    the git repository. The file is written atomically and named after the
+    uid so a newer update of the same object replaces the older one.
+    """
+    if not os.path.exists(queuedir):
+        try:
+            os.makedirs(queuedir)
+        except OSError:  # pragma: no cover
+            # Concurrently created by someone else
+            pass
+
+    handle, tmppath = tempfile.mkstemp(dir=queuedir, prefix='.')
+    with os.fdopen(handle, 'w') as stream:
+        stream.write(json.dumps({
+            'repopath': repopath,
+            'uid': uid,
+            'content': content,
+            'message': message,
+        }))
+    os.rename(tmppath, os.path.join(queuedir, uid))
+
+    _schedule_git_queue_flush(queuedir)
+
+
+def _schedule_git_queue_flush(queuedir):
+    """ Schedule the flush of the given queue once the delay to collect
+    updates (``GIT_QUEUE_DELAY``) is passed, unless it is already scheduled.
+    """
+    with _QUEUE_LOCK:
+        if queuedir in _QUEUE_TIMERS:
+            return
+        timer = threading.Timer(
+            pagure.APP.config.get('GIT_QUEUE_DELAY', 2),
+            _run_git_queue_flush, [queuedir])
+        timer.daemon = True
+        _QUEUE_TIMERS[queuedir] = timer
+        timer.start()
+
+
+def _run_git_queue_flush(queuedir):
+    """ Flush the given queue, called once the delay is passed. """
+    with _QUEUE_LOCK:
+        _QUEUE_TIMERS.pop(queuedir, None)
     try:
-        parent = new_repo.head.get_object().oid
-    except pygit2.GitError:
-        pass
+        flush_git_queue(queuedir)
+    except Exception as err:  # pragma: no cover
+        pagure.APP.logger.exception(err)
 
-    parents = []
-    if parent:
-        parents.append(parent)
+
+@atexit.register
+def _flush_scheduled_git_queues():
+    """ Flush the queues still waiting for their delay when the process
+    exits, so short-lived processes (hooks, scripts) commit their changes.
+    """
+    with _QUEUE_LOCK:
+        queuedirs = list(_QUEUE_TIMERS)
+        for timer in _QUEUE_TIMERS.values():
+            timer.cancel()
+        _QUEUE_TIMERS.clear()
+    for queuedir in queuedirs:
+        try:
+            flush_git_queue(queuedir)
+        except Exception as err:  # pragma: no cover
+            pagure.APP.logger.exception(err)
+
+
+def flush_git_queue(queuedir):
+    """ Commit all the updates waiting in the given queue in a single
+    commit.
+
+    Only one process at a time flushes a given queue. The updates are
+    removed from the queue once they are committed, so if something goes
+    wrong they will be committed by the next flush.
+
+    :arg queuedir: the folder in which the updates are queued
+    :return: the oid of the commit created or None if there was nothing
+        to commit
+
+    """
+    if not os.path.isdir(queuedir):
+        return
+
+    lockfile = os.path.join(queuedir, '.lock')
+    with open(lockfile, 'w') as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        try:
+            # Left-overs of a flush that did not complete are older than
+            # the updates pending, so the latter override the former.
+            for filename in os.listdir(queuedir):
+                if filename.startswith('.') \
+                        or filename.endswith('.inflight'):
+                    continue
+                filepath = os.path.join(queuedir, filename)
+                os.rename(filepath, filepath + '.inflight')
+
+            entries = []
+            for filename in sorted(os.listdir(queuedir)):
+                if not filename.endswith('.inflight'):
+                    continue
+                filepath = os.path.join(queuedir, filename)
+                with open(filepath) as entry:
+                    entries.append((filepath, json.loads(entry.read())))
+
+            if not entries:
+                return
+
+            repo_obj = get_repo_obj(entries[0][1]['repopath'])
+            changes = {}
+            for _, entry in entries:
+                content = entry['content']
+                if content is not None:
+                    content = repo_obj.create_blob(content.encode('utf-8'))
+                changes[entry['uid']] = content
+
+            if len(entries) == 1:
+                message = entries[0][1]['message']
+            else:
+                message = 'Updated %s objects\n\n%s' % (
+                    len(entries),
+                    '\n'.join(entry['message'] for _, entry in entries))
+
+            # Author/commiter will always be this one
+            author = pygit2.Signature(name='pagure', email='pagure')
+
+            commit = _commit_changes(
+                repo_obj, 'refs/heads/master', changes, message, author)
+
+            for filepath, _ in entries:
+                os.unlink(filepath)
+
+            return commit
+        finally:
+            fcntl.flock(stream, fcntl.LOCK_UN)
+
+
+def flush_git_queues():
+    """ Flush all the queues found in the ``GIT_QUEUE_FOLDER``.
+    """
+    queue = pagure.APP.config.get('GIT_QUEUE_FOLDER')
+    if not queue or not os.path.isdir(queue):
+        return
+
+    for dirpath, _, filenames in os.walk(queue):
+        if any(not filename.startswith('.') for filename in filenames):
+            flush_git_queue(dirpath)
+
+
+def _write_to_git(repopath, uid, content, message):
+    """ Write the given content in the file named ``uid`` of the given
+    git repository, or remove that file if ``content`` is None.
+
+    If ``GIT_QUEUE_FOLDER`` is set, the change is queued and committed
+    with the other changes made to that repository in the meantime,
+    otherwise it is committed right away.
+    """
+    queuedir = _get_queue_folder(repopath)
+    if queuedir:
+        _queue_git_update(queuedir, repopath, uid, content, message)
+        return
+
+    repo_obj = get_repo_obj(repopath)
+    if content is not None:
+        content = repo_obj.create_blob(content)
 
     # Author/commiter will always be this one
     author = pygit2.Signature(name='pagure', email='pagure')
 
-    # Actually commit
-    new_repo.create_commit(
-        'refs/heads/master',
-        author,
-        author,
-        'Updated %s %s: %s' % (objtype, obj.uid, obj.title),
-        new_repo.index.write_tree(),
-        parents)
-    index.write()
+    _commit_changes(
+        repo_obj, 'refs/heads/master', {uid: content}, message, author)
+
+
+def update_git(obj, repo, repofolder, objtype='ticket'):
+    """ Update the given issue in its git.
 
-    # Push to origin
-    ori_remote = new_repo.remotes[0]
-    master_ref = new_repo.lookup_reference('HEAD').resolve()
-    refname = '%s:%s' % (master_ref.name, master_ref.name)
+    This method writes the JSON representation of the object in a file
+    named after its uid directly in the git repository and, if there are
+    changes, commits it on the master branch. No clone or working tree is
+    involved.
+
+    """
 
-    ori_remote.push(refname)
+    if not repofolder:
+        return
 
-    # Remove the clone
-    shutil.rmtree(newpath)
+    _write_to_git(
+        os.path.join(repofolder, repo.path),
+        obj.uid,
+        json.dumps(obj.to_json()),
+        'Updated %s %s: %s' % (objtype, obj.uid, obj.title))
 
 
 def clean_git(obj, repo, repofolder, objtype='ticket'):
@@ -209,64 +614,70 @@ def clean_git(obj, repo, repofolder, objtype='ticket'):
     if not repofolder:
         return
 
-    # Get the fork
-    repopath = os.path.join(repofolder, repo.path)
+    _write_to_git(
+        os.path.join(repofolder, repo.path),
+        obj.uid,
+        None,
+        'Removed %s %s: %s' % (objtype, obj.uid, obj.title))
 
-    # Clone the repo into a temp folder
-    newpath = tempfile.mkdtemp(prefix='pagure-')
-    new_repo = pygit2.clone_repository(repopath, newpath)
 
-    file_path = os.path.join(newpath, obj.uid)
+def regenerate_git_repo(session, project, repofolder, objtype='ticket'):
+    """ Write the JSON representation of all the tickets or pull-requests
+    of the given project in its git repo, in a single commit.
 
-    # Get the current index
-    index = new_repo.index
+    The objects are loaded from the database in batches and written one
+    by one, so the memory used does not depend on the number of objects.
+    Private tickets are not stored in the git repo.
 
-    # Are we adding files
-    if not os.path.exists(file_path):
-        shutil.rmtree(newpath)
-        return
-
-    # Remove the file
-    os.unlink(file_path)
+    :arg session: the session to connect to the database with.
+    :arg project: the Project object from the database
+    :arg repofolder: the folder containing the git repos of this type
+    :kwarg objtype: either `ticket` or `pull-request`
+    :return: the oid of the commit created or None if there was nothing
+        to commit
 
-    diff = new_repo.diff()
+    """
+    if not repofolder:
+        return
 
-    # Add the changes to the index
-    index.remove(obj.uid)
+    if objtype == 'ticket':
+        query = session.query(
+            model.Issue
+        ).filter(
+            model.Issue.project_id == project.id
+        ).filter(
+            model.Issue.private == False
+        ).order_by(
+            model.Issue.id
+        )
+        label = 'tickets'
+    else:
+        query = session.query(
+            model.PullRequest
+        ).filter(
+            model.PullRequest.project_id == project.id
+        ).order_by(
+            model.PullRequest.id
+        )
+        label = 'pull-requests'
 
-    # See if there is a parent to this commit
-    parent = None
-    try:
-        parent = new_repo.head.get_object().oid
-    except pygit2.GitError:
-        pass
+    repopath = os.path.join(repofolder, project.path)
+    repo_obj = get_repo_obj(repopath)
 
-    parents = []
-    if parent:
-        parents.append(parent)
+    changes = {}
+    for obj in query.yield_per(100):
+        changes[obj.uid] = repo_obj.create_blob(json.dumps(obj.to_json()))
 
     # Author/commiter will always be this one
     author = pygit2.Signature(name='pagure', email='pagure')
 
-    # Actually commit
-    new_repo.create_commit(
+    return _commit_changes(
+        repo_obj,
         'refs/heads/master',
-        author,
-        author,
-        'Removed %s %s: %s' % (objtype, obj.uid, obj.title),
-        new_repo.index.write_tree(),
-        parents)
-    index.write()
-
-    # Push to origin
-    ori_remote = new_repo.remotes[0]
-    master_ref = new_repo.lookup_reference('HEAD').resolve()
-    refname = '%s:%s' % (master_ref.name, master_ref.name)
-
-    ori_remote.push(refname)
-
-    # Remove the clone
-    shutil.rmtree(newpath)
+        changes,
+        'Regenerated the %s %s of %s' % (
+            len(changes), label, project.fullname),
+        author)
 
 
 def get_user_from_json(session, jsondata, key='user'):
@@ -549,162 +960,123 @@ def update_request_from_git(
     session.commit()
 
 
-def add_file_to_git(repo, issue, ticketfolder, user, filename, filestream):
+def add_file_to_git(
+        session, repo, issue, ticketfolder, user, filename, filestream):
     ''' Add a given file to the specified ticket git repository.
 
+    The file is streamed to disk while its sha256 checksum is computed, the
+    checksum is then looked up in the database to avoid storing the same
+    file twice and, if it is a new file, the blob is written directly in
+    the object database of the bare ticket git repository.
+
+    :arg session: the session to use to connect to the database
     :arg repo: the Project object from the database
+    :arg issue: the Issue object the file is attached to
     :arg ticketfolder: the folder on the filesystem where the git repo for
         tickets are stored
     :arg user: the user object with its username and email
     :arg filename: the name of the file to save
     :arg filestream: the actual content of the file
+    :return: the path of the file in the ticket git repository
 
     '''
 
     if not ticketfolder:
         return
 
-    # Prefix the filename with a timestamp:
-    filename = '%s-%s' % (
-        hashlib.sha256(filestream.read()).hexdigest(),
-        werkzeug.secure_filename(filename)
-    )
-
-    # Get the fork
-    repopath = os.path.join(ticketfolder, repo.path)
-
-    # Clone the repo into a temp folder
-    newpath = tempfile.mkdtemp(prefix='pagure-')
-    new_repo = pygit2.clone_repository(repopath, newpath)
-
-    folder_path = os.path.join(newpath, 'files')
-    file_path = os.path.join(folder_path, filename)
-
-    # Get the current index
-    index = new_repo.index
-
-    # Are we adding files
-    added = False
-    if not os.path.exists(file_path):
-        added = True
-    else:
-        # File exists, remove the clone and return
-        shutil.rmtree(newpath)
-        return os.path.join('files', filename)
-
-    if not os.path.exists(folder_path):
-        os.mkdir(folder_path)
-
-    # Write down what changed
-    filestream.seek(0)
-    with open(file_path, 'w') as stream:
-        stream.write(filestream.read())
-
-    # Retrieve the list of files that changed
-    diff = new_repo.diff()
-    files = [patch.new_file_path for patch in diff]
-
-    # Add the changes to the index
-    if added:
-        index.add(os.path.join('files', filename))
-    for filename in files:
-        index.add(filename)
-
-    # If not change, return
-    if not files and not added:
-        shutil.rmtree(newpath)
-        return
-
-    # See if there is a parent to this commit
-    parent = None
+    # Copy the upload to disk while computing its checksum
+    sha256 = hashlib.sha256()
+    handle, tmppath = tempfile.mkstemp(prefix='pagure-upload-')
     try:
-        parent = new_repo.head.get_object().oid
-    except pygit2.GitError:
-        pass
-
-    parents = []
-    if parent:
-        parents.append(parent)
-
-    # Author/commiter will always be this one
+        with os.fdopen(handle, 'wb') as stream:
+            while True:
+                chunk = filestream.read(_UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                stream.write(chunk)
+
+        checksum = sha256.hexdigest()
+
+        # Was this file already uploaded to this project?
+        attachment = pagure.lib.get_issue_attachment(session, repo, checksum)
+        if attachment:
+            return attachment.filename
+
+        # Prefix the filename with its checksum
+        filename = os.path.join('files', '%s-%s' % (
+            checksum, werkzeug.secure_filename(filename)))
+
+        repopath = os.path.join(ticketfolder, repo.path)
+        repo_obj = get_repo_obj(repopath)
+        blob = repo_obj.create_blob_fromdisk(tmppath)
+    finally:
+        os.unlink(tmppath)
+
+    # Author/commiter will always be this one, the API gives the User
+    # object from the database which has no email attribute
     author = pygit2.Signature(
         name=user.username,
-        email=user.email
+        email=getattr(user, 'email', None) or user.default_email
     )
 
-    # Actually commit
-    new_repo.create_commit(
-        'refs/heads/master',
-        author,
-        author,
+    _commit_changes(
+        repo_obj, 'refs/heads/master', {filename: blob},
         'Add file %s to ticket %s: %s' % (filename, issue.uid, issue.title),
-        new_repo.index.write_tree(),
-        parents)
-    index.write()
-
-    # Push to origin
-    ori_remote = new_repo.remotes[0]
-    master_ref = new_repo.lookup_reference('HEAD').resolve()
-    refname = '%s:%s' % (master_ref.name, master_ref.name)
+        author)
 
-    ori_remote.push(refname)
-
-    # Remove the clone
-    shutil.rmtree(newpath)
+    # Record the upload so we do not store it again
+    attachment = model.IssueAttachment(
+        project_id=repo.id,
+        sha256=checksum,
+        filename=filename,
+    )
+    session.add(attachment)
+    try:
+        session.commit()
+    except SQLAlchemyError:  # pragma: no cover
+        # Someone else uploaded the same file at the same time, the blob
+        # is in git either way
+        session.rollback()
 
-    return os.path.join('files', filename)
+    return filename
 
 
-def update_file_in_git(repo, branch, filename, content, message, user, email):
+def update_file_in_git(
+        repo, branch, filename, content, message, user, email, parent=None):
     ''' Update a specific file in the specified repository with the content
     given and commit the change under the user's name.
 
+    The blob and the trees leading to it are written directly in the git
+    repository and the branch is moved onto the new commit, no clone or
+    working tree is involved.
+
     :arg repo: the Project object from the database
+    :arg branch: the name of the branch to commit to
     :arg filename: the name of the file to save
     :arg content: the new content of the file
     :arg message: the message of the git commit
     :arg user: the user object with its username and email
+    :arg email: the email address to use in the commit
+    :kwarg parent: the hex of the commit the file was edited from, if the
+        file changed in the branch since that commit a BranchMovedException
+        is raised
+    :return: the oid of the commit created or None if there was nothing to
+        commit
 
     '''
 
-    # Get the fork
     repopath = pagure.get_repo_path(repo)
+    repo_obj = get_repo_obj(repopath)
 
-    # Clone the repo into a temp folder
-    newpath = tempfile.mkdtemp(prefix='pagure-')
-    new_repo = pygit2.clone_repository(repopath, newpath)
-
-    file_path = os.path.join(newpath, filename)
-
-    # Get the current index
-    index = new_repo.index
-
-    # Write down what changed
-    with open(file_path, 'w') as stream:
-        stream.write(content.replace('\r', ''))
-
-    # Retrieve the list of files that changed
-    diff = new_repo.diff()
-    files = [patch.new_file_path for patch in diff]
-
-    # Add the changes to the index
-    added = False
-    for filename in files:
-        added = True
-        index.add(filename)
-
-    # If not change, return
-    if not files and not added:
-        shutil.rmtree(newpath)
-        return
-
-    # See if there is a parent to this commit
-    branch_ref = get_branch_ref(new_repo, branch)
-    parent = branch_ref.get_object()
+    if parent is not None:
+        try:
+            parent = repo_obj.revparse_single(parent).oid
+        except (KeyError, ValueError):
+            raise pagure.exceptions.PagureException(
+                'Invalid parent commit specified: %s' % parent)
 
-    parents = []
-    if parent:
-        parents.append(parent.hex)
+    blob = repo_obj.create_blob(content.replace('\r', ''))
 
     # Author/commiter will always be this one
     author = pygit2.Signature(
@@ -712,26 +1084,17 @@ def update_file_in_git(repo, branch, filename, content, message, user, email):
         email=email
     )
 
-    # Actually commit
-    new_repo.create_commit(
-        branch_ref.name,
-        author,
-        author,
-        message.strip(),
-        new_repo.index.write_tree(),
-        parents)
-    index.write()
+    refname = 'refs/heads/%s' % branch
+    commit = _commit_changes(
+        repo_obj, refname, {filename: blob}, message.strip(), author,
+        base=parent)
 
-    # Push to origin
-    ori_remote = new_repo.remotes[0]
-    refname = '%s:refs/heads/%s' % (branch_ref.name, branch)
+    if commit is not None:
+        parents = repo_obj[commit].parents
+        _run_post_receive_hook(
+            repo_obj, refname, parents[0].oid if parents else None, commit)
 
-    ori_remote.push(refname)
-
-    # Remove the clone
-    shutil.rmtree(newpath)
-
-    return os.path.join('files', filename)
+    return commit
 
 
 def read_output(cmd, abspath, input=None, keepends=False, **kw):
@@ -834,24 +1197,363 @@ def get_branch_ref(repo, branchname):
     return branch_ref
 
 
+def _run_post_receive_hook(repo_obj, refname, oldrev, newrev):
+    """ Run the post-receive hook of the given git repository for a
+    reference that pagure moved itself, as git would have done if the
+    change had been pushed.
+    """
+    hook = os.path.join(repo_obj.path, 'hooks', 'post-receive')
+    if not os.access(hook, os.X_OK):
+        return
+
+    oldrev = oldrev.hex if oldrev is not None else '0' * 40
+    env = os.environ.copy()
+    env['GIT_DIR'] = repo_obj.path
+    proc = subprocess.Popen(
+        [hook],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=repo_obj.path,
+        env=env)
+    out = proc.communicate('%s %s %s\n' % (oldrev, newrev.hex, refname))[0]
+    if proc.returncode:
+        pagure.APP.logger.error(
+            'The post-receive hook of %s failed: %s', repo_obj.path, out)
+
+
+def _fetch_commit(repo_obj, frompath, branch, oid):
+    """ Make sure the given commit and its history are available in the
+    given git repository, fetching them from the branch of the git
+    repository at ``frompath`` if they are not.
+
+    Only the objects missing are transfered and no reference is created.
+    """
+    if oid in repo_obj:
+        return
+
+    read_git_lines(
+        ['fetch', '--quiet', '--no-tags', frompath,
+         'refs/heads/%s' % branch],
+        repo_obj.path)
+
+    if oid not in repo_obj:
+        raise pagure.exceptions.BranchMovedException(
+            'Branch %s of %s moved while being fetched' % (branch, frompath))
+
+
+def _call_with_object_union(repopaths, function, *args):
+    """ Return the result of ``function`` called with a pygit2 Repository
+    reading the objects of all the given git repositories, followed by the
+    given arguments.
+
+    The Repository is a temporary bare repo borrowing the objects of the
+    others through its alternates, so nothing is copied and the objects it
+    writes, such as the tree of an in-memory merge, are thrown away with
+    it. This is used for the checks that must not fetch a fork into its
+    parent.
+    """
+    folder = tempfile.mkdtemp(prefix='pagure-objects-')
+    try:
+        pygit2.init_repository(folder, bare=True)
+        infofolder = os.path.join(folder, 'objects', 'info')
+        if not os.path.exists(infofolder):
+            os.makedirs(infofolder)
+        with open(os.path.join(infofolder, 'alternates'), 'w') as stream:
+            for repopath in repopaths:
+                stream.write('%s\n' % os.path.join(
+                    os.path.abspath(repopath), 'objects'))
+        return function(pygit2.Repository(folder), *args)
+    finally:
+        shutil.rmtree(folder)
+
+
+def get_merge_status(repo_obj, base, head):
+    """ Return how the commit ``head`` can be merged into the commit
+    ``base``, both commits being in the given git repository.
+
+    The merge is done in memory, no working tree is needed.
+
+    :arg repo_obj: the pygit2 Repository containing both commits
+    :arg base: the oid of the commit to merge into, None if the branch to
+        merge into does not exist yet
+    :arg head: the oid of the commit to merge
+    :return: a tuple (status, tree) where status is one of ``NO_CHANGE``,
+        ``FFORWARD``, ``CONFLICTS`` or ``MERGE`` and tree is the oid of the
+        merged tree for ``MERGE``, None otherwise
+
+    """
+    if base is None:
+        return ('FFORWARD', None)
+
+    ancestor = repo_obj.merge_base(base, head)
+    if ancestor == head:
+        return ('NO_CHANGE', None)
+    elif ancestor == base:
+        return ('FFORWARD', None)
+
+    try:
+        index = repo_obj.merge_commits(base, head)
+    except pygit2.GitError:
+        return ('CONFLICTS', None)
+    if index.conflicts is not None:
+        return ('CONFLICTS', None)
+
+    return ('MERGE', index.write_tree(repo_obj))
+
+
+def get_merge_status_heads(request):
+    """ Return the current heads of the target and the source branches of
+    the given pull-request, as hex strings, the merge status of the
+    pull-request is only valid for these two commits.
+    """
+    repo_obj = get_repo_obj(pagure.get_repo_path(request.project))
+    fork_obj = get_repo_obj(pagure.get_repo_path(request.project_from))
+
+    base = _get_ref_target(repo_obj, 'refs/heads/%s' % request.branch)
+    head = _get_ref_target(fork_obj, 'refs/heads/%s' % request.branch_from)
+
+    return (
+        base.hex if base is not None else None,
+        head.hex if head is not None else None,
+    )
+
+
+def _compute_merge_status(args):
+    """ Compute the merge status of the source branch of a pull-request
+    into its target branch.
+
+    Only git is involved so this can run in a worker process.
+
+    :arg args: a tuple (parentpath, forkpath, branch, branch_from)
+    :return: a tuple (status, base, head) where base and head are the hex
+        of the commits the status was computed for, status is None if it
+        could not be computed
+
+    """
+    parentpath, forkpath, branch, branch_from = args
+    try:
+        repo_obj = get_repo_obj(parentpath)
+        fork_obj = get_repo_obj(forkpath)
+
+        base = _get_ref_target(repo_obj, 'refs/heads/%s' % branch)
+        head = _get_ref_target(fork_obj, 'refs/heads/%s' % branch_from)
+        if head is None:
+            return (None, None, None)
+
+        status = _call_with_object_union(
+            [parentpath, forkpath], get_merge_status, base, head)[0]
+    except (pygit2.GitError, pagure.exceptions.PagureException):
+        return (None, None, None)
+
+    return (status, base.hex if base is not None else None, head.hex)
+
+
+def refresh_merge_status(session, project, branch):
+    """ Recompute the merge status of all the open pull-requests having
+    the given branch of the given project as target or as source.
+
+    The statuses are computed in a pool of at most MERGE_STATUS_WORKERS
+    processes.
+
+    :return: the number of pull-requests refreshed
+
+    """
+    requests = {}
+    for request in pagure.lib.search_pull_requests(
+            session, project_id=project.id, status=True):
+        if request.branch == branch:
+            requests[request.uid] = request
+    for request in pagure.lib.search_pull_requests(
+            session, project_id_from=project.id, status=True):
+        if request.branch_from == branch and request.project_from:
+            requests[request.uid] = request
+
+    if not requests:
+        return 0
+
+    requests = requests.values()
+    args = [
+        (
+            pagure.get_repo_path(request.project),
+            pagure.get_repo_path(request.project_from),
+            request.branch,
+            request.branch_from,
+        )
+        for request in requests
+    ]
+
+    workers = min(
+        len(args), pagure.APP.config.get('MERGE_STATUS_WORKERS', 4))
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        results = pool.map(_compute_merge_status, args)
+    finally:
+        pool.close()
+        pool.join()
+
+    for request, (status, base, head) in zip(requests, results):
+        request.merge_status = status
+        request.merge_status_base = base
+        request.merge_status_head = head
+        session.add(request)
+    session.commit()
+
+    return len(requests)
+
+
+def _get_refresh_folder(project_id):
+    """ Return the folder in which the branches of the given project which
+    moved are spooled until they are refreshed.
+    """
+    return os.path.join(
+        tempfile.gettempdir(), 'pagure-refresh', str(project_id))
+
+
+def _read_refresh_spool(folder):
+    """ Return the set of the branches spooled in the given folder, removing
+    them from the spool.
+    """
+    branches = set()
+    for filename in os.listdir(folder):
+        # Skip the spool files being written
+        if filename.startswith('.'):
+            continue
+        path = os.path.join(folder, filename)
+        with open(path) as stream:
+            branches.update(line for line in stream.read().split('\n') if line)
+        os.unlink(path)
+    return branches
+
+
+def _refresh_project(project_id, branches):
+    """ Refresh what is derived from the given branches of the project with
+    the given identifier once they moved, with a new connection to the
+    database.
+    """
+    session = pagure.lib.create_session(pagure.APP.config['DB_URL'])
+    try:
+        project = session.query(model.Project).get(project_id)
+        if project is None:
+            return
+        for branch in sorted(branches):
+            try:
+                update_commit_index(session, project, branch)
+                refresh_merge_status(session, project, branch)
+            except SQLAlchemyError as err:  # pragma: no cover
+                session.rollback()
+                pagure.APP.logger.exception(err)
+        if 'master' in branches:
+            try:
+                refresh_forks_divergence(session, project)
+            except SQLAlchemyError as err:  # pragma: no cover
+                session.rollback()
+                pagure.APP.logger.exception(err)
+    finally:
+        session.remove()
+
+
+def _run_refresh_spool(project_id):
+    """ Refresh the branches spooled for the project with the given
+    identifier until there are none left.
+
+    The spool is locked without waiting for the lock: if another process
+    holds it, this process leaves the branches it spooled to it.
+    """
+    folder = _get_refresh_folder(project_id)
+    while True:
+        with open(folder + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return
+            while True:
+                branches = _read_refresh_spool(folder)
+                if not branches:
+                    break
+                _refresh_project(project_id, branches)
+        # Branches spooled by a process which could not take the lock
+        # while it was being released
+        if not [name for name in os.listdir(folder)
+                if not name.startswith('.')]:
+            return
+
+
+def refresh_project_in_background(project, branches):
+    """ Refresh, in a detached process, what pagure derives from the given
+    branches of the given project once they moved: their commit index, the
+    merge status of the open pull-requests from or to them and, if master
+    moved, how far the project and its forks diverge.
+
+    The branches are first spooled for the project, then a process is
+    double-forked with its standard streams closed, so neither the push
+    nor the web request which moved the branches waits for it. It opens
+    its own connection to the database.
+    At most one process works on a project at a time, the others exit
+    right away leaving their branches to it, so a burst of pushes does not
+    pile up processes.
+    """
+    project_id = project.id
+    folder = _get_refresh_folder(project_id)
+    try:
+        os.makedirs(folder)
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+
+    handle, tmppath = tempfile.mkstemp(dir=folder, prefix='.spool')
+    with os.fdopen(handle, 'w') as stream:
+        stream.write('\n'.join(branches))
+    os.rename(tmppath, os.path.join(folder, os.path.basename(tmppath)[1:]))
+
+    pid = os.fork()
+    if pid:
+        # The intermediate child exits right away
+        os.waitpid(pid, 0)
+        return
+
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+
+        _run_refresh_spool(project_id)
+    except Exception as err:  # pragma: no cover
+        pagure.APP.logger.exception(err)
+    finally:
+        # Never return into, nor run the exit handlers of, the caller
+        os._exit(0)
+
+
 def merge_pull_request(
-        session, request, username, request_folder, domerge=True):
+        session, request, username, request_folder, domerge=True,
+        retries=5):
     ''' Merge the specified pull-request.
+
+    The commits of the fork are fetched in the git repository of the
+    project if they are not there already, the merge is then done in
+    memory and the branch moved onto its result directly in the bare git
+    repository.
+    When only checking if the pull-request can be merged (``domerge`` is
+    False), nothing is fetched, the merge is tried on the objects of both
+    repositories.
+
     '''
     # Get the fork
     repopath = pagure.get_repo_path(request.project_from)
-    fork_obj = pygit2.Repository(repopath)
+    fork_obj = get_repo_obj(repopath)
 
     # Get the original repo
     parentpath = pagure.get_repo_path(request.project)
-
-    # Clone the original repo into a temp folder
-    newpath = tempfile.mkdtemp(prefix='pagure-pr-merge')
-    new_repo = pygit2.clone_repository(parentpath, newpath)
+    repo_obj = get_repo_obj(parentpath)
 
     # Update the start and stop commits in the DB, one last time
     diff_commits = diff_pull_request(
-        session, request, pygit2.Repository(parentpath), fork_obj,
+        session, request, repo_obj, fork_obj,
         requestfolder=request_folder, with_diff=False)[0]
 
     if request.project.settings.get(
@@ -862,47 +1564,42 @@ def merge_pull_request(
                     'This repo enforces that all commits are '
                     'signed off by their author. ')
 
-    # Checkout the correct branch
-    branch_ref = get_branch_ref(new_repo, request.branch)
+    branch_ref = get_branch_ref(repo_obj, request.branch)
     if not branch_ref:
-        shutil.rmtree(newpath)
         raise pagure.exceptions.BranchNotFoundException(
             'Branch %s could not be found in the repo %s' % (
                 request.branch, request.project.fullname
             ))
 
-    new_repo.checkout(branch_ref)
-
     branch = get_branch_ref(fork_obj, request.branch_from)
     if not branch:
-        shutil.rmtree(newpath)
         raise pagure.exceptions.BranchNotFoundException(
             'Branch %s could not be found in the repo %s' % (
                 request.branch_from, request.project_from.fullname
             ))
 
     repo_commit = fork_obj[branch.get_object().hex]
+    refname = 'refs/heads/%s' % request.branch
+
+    if not domerge:
+        # Only checking, leave the parent repo untouched
+        head = _get_ref_target(repo_obj, refname)
+        status = _call_with_object_union(
+            [parentpath, repopath], get_merge_status, head,
+            repo_commit.oid)[0]
+        request.merge_status = status
+        request.merge_status_base = head.hex if head is not None else None
+        request.merge_status_head = repo_commit.oid.hex
+        session.commit()
+        return status
 
-    ori_remote = new_repo.remotes[0]
-    # Add the fork as remote repo
-    reponame = '%s_%s' % (request.user.user, request.project_from.name)
-    remote = new_repo.create_remote(reponame, repopath)
-
-    # Fetch the commits
-    remote.fetch()
-
-    merge = new_repo.merge(repo_commit.oid)
-    if merge is None:
-        mergecode = new_repo.merge_analysis(repo_commit.oid)[0]
+    _fetch_commit(repo_obj, repopath, request.branch_from, repo_commit.oid)
 
-    refname = '%s:refs/heads/%s' % (branch_ref.name, request.branch)
-    if (
-            (merge is not None and merge.is_uptodate)
-            or
-            (merge is None and
-             mergecode & pygit2.GIT_MERGE_ANALYSIS_UP_TO_DATE)):
+    for _ in range(retries):
+        head = _get_ref_target(repo_obj, refname)
+        status, tree = get_merge_status(repo_obj, head, repo_commit.oid)
 
-        if domerge:
+        if status == 'NO_CHANGE':
             pagure.lib.close_pull_request(
                 session, request, username,
                 requestfolder=request_folder)
@@ -911,62 +1608,33 @@ def merge_pull_request(
             except SQLAlchemyError as err:  # pragma: no cover
                 session.rollback()
                 pagure.APP.logger.exception(err)
-                shutil.rmtree(newpath)
                 raise pagure.exceptions.PagureException(
                     'Could not close this pull-request')
             raise pagure.exceptions.PagureException(
                 'Nothing to do, changes were already merged')
+        elif status == 'CONFLICTS':
+            raise pagure.exceptions.PagureException('Merge conflicts!')
+        elif status == 'FFORWARD':
+            target = repo_commit.oid
         else:
-            request.merge_status = 'NO_CHANGE'
-            session.commit()
-            return 'NO_CHANGE'
-
-    elif (
-            (merge is not None and merge.is_fastforward)
-            or
-            (merge is None and
-             mergecode & pygit2.GIT_MERGE_ANALYSIS_FASTFORWARD)):
-
-        if domerge:
-            if merge is not None:
-                # This is depending on the pygit2 version
-                branch_ref.target = merge.fastforward_oid
-            elif merge is None and mergecode is not None:
-                branch_ref.set_target(repo_commit.oid.hex)
-
-            ori_remote.push(refname)
-        else:
-            request.merge_status = 'FFORWARD'
-            session.commit()
-            return 'FFORWARD'
+            target = repo_obj.create_commit(
+                None,
+                repo_commit.author,
+                repo_commit.committer,
+                'Merge #%s `%s`' % (request.id, request.title),
+                tree,
+                [head, repo_commit.oid])
 
-    else:
-        tree = None
         try:
-            tree = new_repo.index.write_tree()
-        except pygit2.GitError:
-            shutil.rmtree(newpath)
-            if domerge:
-                raise pagure.exceptions.PagureException('Merge conflicts!')
-            else:
-                request.merge_status = 'CONFLICTS'
-                session.commit()
-                return 'CONFLICTS'
+            _set_ref_target(repo_obj, refname, target, head)
+            break
+        except pagure.exceptions.BranchMovedException:
+            continue
+    else:
+        raise pagure.exceptions.BranchMovedException(
+            'Could not update %s, it keeps moving' % refname)
 
-        if not domerge:
-            request.merge_status = 'MERGE'
-            session.commit()
-            return 'MERGE'
-
-        head = new_repo.lookup_reference('HEAD').get_object()
-        new_repo.create_commit(
-            'refs/heads/%s' % request.branch,
-            repo_commit.author,
-            repo_commit.committer,
-            'Merge #%s `%s`' % (request.id, request.title),
-            tree,
-            [head.hex, repo_commit.oid.hex])
-        ori_remote.push(refname)
+    _run_post_receive_hook(repo_obj, refname, head, target)
 
     # Update status
     pagure.lib.close_pull_request(
@@ -978,14 +1646,542 @@ def merge_pull_request(
     except SQLAlchemyError as err:  # pragma: no cover
         session.rollback()
         pagure.APP.logger.exception(err)
-        shutil.rmtree(newpath)
         raise pagure.exceptions.PagureException(
             'Could not update this pull-request in the database')
-    shutil.rmtree(newpath)
 
     return 'Changes merged!'
 
 
+def _get_diff_oids(repo_obj, head, base, limit):
+    """ Return the list of the oids, newest first, of at most ``limit``
+    commits reachable from ``head`` but not from ``base``, both commits
+    being in the given git repository.
+    """
+    walker = repo_obj.walk(head, pygit2.GIT_SORT_TIME)
+    walker.hide(base)
+    oids = []
+    for commit in walker:
+        if limit is not None and len(oids) >= limit:
+            break
+        oids.append(commit.oid)
+    return oids
+
+
+def get_diff_commits(repo_obj, head, base=None, orig_repo=None, limit=None):
+    """ Yield, newest first, the commits reachable from ``head`` but not
+    from ``base``, ie: the commits a branch adds on top of another one.
+
+    The history of ``base`` is hidden from the walk, so only the commits
+    unique to ``head`` (plus the few needed to reach the merge-base) are
+    visited, whatever the size of the history they share.
+
+    :arg repo_obj: the pygit2 Repository containing ``head``
+    :arg head: the oid (or hex) of the commit to start from
+    :kwarg base: the oid (or hex) of the commit whose history is excluded,
+        if None all the history of ``head`` is returned
+    :kwarg orig_repo: the pygit2 Repository containing ``base`` if it is
+        not ``repo_obj`` (for example the parent of a fork)
+    :kwarg limit: the maximum number of commits to return
+
+    """
+    if orig_repo is None:
+        orig_repo = repo_obj
+
+    walker = repo_obj.walk(head, pygit2.GIT_SORT_TIME)
+
+    if base is not None:
+        base = orig_repo[base].oid
+        if base not in repo_obj:
+            # The base is not in this repo (the parent moved since it was
+            # forked), its history is hidden in the objects of both repos
+            for oid in _call_with_object_union(
+                    [repo_obj.path, orig_repo.path], _get_diff_oids,
+                    head, base, limit):
+                yield repo_obj[oid]
+            return
+        if repo_obj.merge_base(head, base) == repo_obj[head].oid:
+            return
+        walker.hide(base)
+
+    for cnt, commit in enumerate(walker):
+        if limit is not None and cnt >= limit:
+            break
+        yield commit
+
+
+def get_ahead_behind(repo_obj, local, upstream):
+    """ Return a tuple (ahead, behind) with the number of commits of
+    ``local`` not in ``upstream`` and of ``upstream`` not in ``local``,
+    both commits being in the given git repository.
+    """
+    if hasattr(repo_obj, 'ahead_behind'):
+        # This is depending on the pygit2 version
+        return tuple(repo_obj.ahead_behind(local, upstream))
+
+    ahead = sum(1 for _ in get_diff_commits(repo_obj, local, base=upstream))
+    behind = sum(1 for _ in get_diff_commits(repo_obj, upstream, base=local))
+    return (ahead, behind)
+
+
+def update_fork_divergence(session, fork, force=False):
+    """ Return the divergence between the master branch of the given fork
+    and the one of its parent, recomputing it only if one of the two
+    branches moved since it was last stored.
+
+    :arg session: the session to use to connect to the database
+    :arg fork: the Project object of the fork
+    :kwarg force: recompute the divergence even if the branches did not
+        move
+    :return: the ForkDivergence object or None if one of the two master
+        branches does not exist
+
+    """
+    forkpath = pagure.get_repo_path(fork)
+    fork_obj = get_repo_obj(forkpath)
+    parent_obj = get_repo_obj(pagure.get_repo_path(fork.parent))
+
+    fork_head = _get_ref_target(fork_obj, 'refs/heads/master')
+    parent_head = _get_ref_target(parent_obj, 'refs/heads/master')
+    if fork_head is None or parent_head is None:
+        return
+
+    divergence = fork.divergence
+    if not force and divergence \
+            and divergence.fork_head == fork_head.hex \
+            and divergence.parent_head == parent_head.hex:
+        return divergence
+
+    ahead, behind = _call_with_object_union(
+        [pagure.get_repo_path(fork.parent), forkpath], get_ahead_behind,
+        fork_head, parent_head)
+
+    if divergence is None:
+        divergence = model.ForkDivergence(project_id=fork.id)
+        fork.divergence = divergence
+    divergence.fork_head = fork_head.hex
+    divergence.parent_head = parent_head.hex
+    divergence.ahead = ahead
+    divergence.behind = behind
+    session.add(divergence)
+    session.commit()
+
+    return divergence
+
+
+def get_fork_divergence(session, fork):
+    """ Return the divergence of the given fork from its parent, computing
+    and storing it first if it was never stored, for instance for the forks
+    created before it was, or None if it cannot be computed.
+    """
+    if fork.divergence is None:
+        try:
+            update_fork_divergence(session, fork)
+        except (pygit2.GitError, pagure.exceptions.PagureException,
+                werkzeug.exceptions.NotFound) as err:
+            # One of the two repos or master branches does not exist
+            pagure.APP.logger.debug(err)
+        except SQLAlchemyError as err:  # pragma: no cover
+            session.rollback()
+            pagure.APP.logger.exception(err)
+    return fork.divergence
+
+
+def refresh_forks_divergence(session, project):
+    """ Update the divergence of the given project if it is a fork and of
+    all its forks, to be called when its master branch moved.
+    """
+    projects = list(project.forks)
+    if project.is_fork:
+        projects.append(project)
+
+    for fork in projects:
+        try:
+            update_fork_divergence(session, fork)
+        except (pygit2.GitError, pagure.exceptions.PagureException) as err:
+            pagure.APP.logger.exception(err)
+
+
+def _get_changed_paths(repo_obj, tree, parent_tree, prefix=''):
+    """ Return the set of the paths, files and folders, whose entry differs
+    between the two given trees, either of them being None for the empty
+    tree.
+
+    Only the folders whose tree changed are looked into, the content of
+    the files is never compared.
+    """
+    entries = {}
+    if parent_tree is not None:
+        for entry in parent_tree:
+            entries[entry.name] = entry
+
+    paths = set()
+    for entry in (tree if tree is not None else []):
+        old = entries.pop(entry.name, None)
+        if old is not None and old.oid == entry.oid \
+                and old.filemode == entry.filemode:
+            continue
+        paths.add(prefix + entry.name)
+        if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+            old_tree = None
+            if old is not None and old.filemode == pygit2.GIT_FILEMODE_TREE:
+                old_tree = repo_obj[old.oid]
+            paths.update(_get_changed_paths(
+                repo_obj, repo_obj[entry.oid], old_tree,
+                prefix + entry.name + '/'))
+
+    # The entries removed
+    for name, old in entries.items():
+        paths.add(prefix + name)
+        if old.filemode == pygit2.GIT_FILEMODE_TREE:
+            paths.update(_get_changed_paths(
+                repo_obj, None, repo_obj[old.oid], prefix + name + '/'))
+
+    return paths
+
+
+def get_commit_paths(repo_obj, commit):
+    """ Return the set of the paths, files and folders, changed by the given
+    commit, ie: the paths whose entry differs from the one of every parent
+    of the commit, as ``git log -- <path>`` does.
+    """
+    if not commit.parents:
+        return _get_changed_paths(repo_obj, commit.tree, None)
+
+    paths = None
+    for parent in commit.parents:
+        changed = _get_changed_paths(repo_obj, commit.tree, parent.tree)
+        paths = changed if paths is None else paths & changed
+    return paths
+
+
+def _index_commit_paths(session, project, repo_obj, commits):
+    """ Record in the commit path index the paths changed by the given
+    commits (hex) of the project, skipping the commits already indexed from
+    another branch.
+    """
+    indexed = set()
+    # Keep the queries under the limit of parameters of some databases
+    for idx in range(0, len(commits), 500):
+        query = session.query(
+            model.CommitPathIndex.commit
+        ).filter(
+            model.CommitPathIndex.project_id == project.id
+        ).filter(
+            model.CommitPathIndex.commit.in_(commits[idx:idx + 500])
+        ).distinct()
+        indexed.update(row.commit for row in query)
+
+    entries = []
+    for commit in commits:
+        if commit in indexed:
+            continue
+        indexed.add(commit)
+        for path in get_commit_paths(repo_obj, repo_obj[commit]):
+            entries.append({
+                'project_id': project.id,
+                'commit': commit,
+                'path': path,
+            })
+
+    if entries:
+        session.execute(model.CommitPathIndex.__table__.insert(), entries)
+
+
+def update_commit_index(session, project, branch, repo_obj=None):
+    """ Bring the commit index of the given branch of the given project up
+    to date with the git repository.
+
+    When the branch was fast-forwarded, only the new commits are indexed,
+    on top of the existing entries. Otherwise (new branch, force-push) the
+    index of the branch is rebuilt.
+    The paths changed by the commits not yet known are recorded in the
+    commit path index at the same time.
+
+    :arg session: the session to use to connect to the database
+    :arg project: the Project object from the database
+    :arg branch: the name of the branch to index
+    :kwarg repo_obj: the pygit2 Repository of the project, opened if not
+        provided
+    :return: the number of commits added to the index
+
+    """
+    if repo_obj is None:
+        repo_obj = get_repo_obj(pagure.get_repo_path(project))
+
+    head = _get_ref_target(repo_obj, 'refs/heads/%s' % branch)
+    last = pagure.lib.get_commit_index_head(session, project, branch)
+    if head is not None and last is not None and last.commit == head.hex:
+        return 0
+
+    query = session.query(
+        model.CommitIndex
+    ).filter(
+        model.CommitIndex.project_id == project.id
+    ).filter(
+        model.CommitIndex.branch == branch
+    )
+
+    walker = None
+    if head is not None:
+        walker = repo_obj.walk(
+            head,
+            pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME
+            | pygit2.GIT_SORT_REVERSE)
+
+    fast_forward = False
+    if head is not None and last is not None and last.commit in repo_obj:
+        ancestor = repo_obj.merge_base(head, last.commit)
+        fast_forward = ancestor is not None and ancestor.hex == last.commit
+
+    position = 0
+    if fast_forward:
+        # Only index the new commits
+        walker.hide(last.commit)
+        position = last.position + 1
+    else:
+        query.delete(synchronize_session=False)
+
+    if walker is None:
+        session.commit()
+        return 0
+
+    generations = {}
+    entries = []
+    for commit in walker:
+        generation = 0
+        for parent in commit.parents:
+            parent_gen = generations.get(parent.hex)
+            if parent_gen is None:
+                entry = query.filter(
+                    model.CommitIndex.commit == parent.hex).first()
+                parent_gen = entry.generation if entry else 0
+            generation = max(generation, parent_gen)
+        generations[commit.hex] = generation + 1
+
+        entries.append({
+            'project_id': project.id,
+            'branch': branch,
+            'position': position,
+            'commit': commit.hex,
+            'generation': generation + 1,
+            'author_name': commit.author.name,
+            'author_email': commit.author.email,
+            'commit_time': commit.commit_time,
+            'subject': commit.message.split('\n', 1)[0],
+            'paths_indexed': True,
+        })
+        position += 1
+
+        if len(entries) >= 1000:
+            session.execute(model.CommitIndex.__table__.insert(), entries)
+            _index_commit_paths(
+                session, project, repo_obj,
+                [entry['commit'] for entry in entries])
+            entries = []
+
+    if entries:
+        session.execute(model.CommitIndex.__table__.insert(), entries)
+        _index_commit_paths(
+            session, project, repo_obj,
+            [entry['commit'] for entry in entries])
+    session.commit()
+
+    return len(generations)
+
+
+def index_commit_paths(session, project, repo_obj=None):
+    """ Record in the commit path index the paths changed by the commits of
+    the commit index of the given project which are not there yet, the ones
+    indexed before the commit path index existed.
+
+    :arg session: the session to use to connect to the database
+    :arg project: the Project object from the database
+    :kwarg repo_obj: the pygit2 Repository of the project, opened if not
+        provided
+    :return: the number of commits added to the commit path index
+
+    """
+    if repo_obj is None:
+        repo_obj = get_repo_obj(pagure.get_repo_path(project))
+
+    cnt = 0
+    while True:
+        query = session.query(
+            model.CommitIndex.commit
+        ).filter(
+            model.CommitIndex.project_id == project.id
+        ).filter(
+            model.CommitIndex.paths_indexed.is_(False)
+        ).distinct().limit(500)
+        commits = [row.commit for row in query]
+        if not commits:
+            break
+
+        _index_commit_paths(session, project, repo_obj, commits)
+        session.query(
+            model.CommitIndex
+        ).filter(
+            model.CommitIndex.project_id == project.id
+        ).filter(
+            model.CommitIndex.commit.in_(commits)
+        ).update({'paths_indexed': True}, synchronize_session=False)
+        session.commit()
+        cnt += len(commits)
+
+    return cnt
+
+
+def get_commit_summaries(session, project, branch, offset=0, limit=None):
+    """ Return the number of commits in the history of the given branch
+    and the CommitSummary of ``limit`` of them, most recent first,
+    starting at ``offset``, as recorded in the commit index.
+    """
+    head = pagure.lib.get_commit_index_head(session, project, branch)
+    if head is None:
+        return (0, [])
+
+    entries = pagure.lib.get_commit_index(
+        session, project, branch, offset=offset, limit=limit)
+    return (head.position + 1, [CommitSummary(entry) for entry in entries])
+
+
+def get_history_page(
+        session, project, repo_obj, branch, offset=0, limit=None):
+    """ Return the number of commits in the history of the given branch
+    and ``limit`` of them, most recent first, starting at ``offset``.
+
+    The commits are read from the commit index when it is up to date with
+    the branch, this index being built by the git hook (or by the
+    ``index-commits`` action of pagure_admin.py), never here.
+    Otherwise the branch is walked up to the page requested and the number
+    of commits is only known if the walk reached its first commit, it is
+    None otherwise and there are then more commits after this page.
+    """
+    head = _get_ref_target(repo_obj, 'refs/heads/%s' % branch)
+    if head is None:
+        return (0, [])
+
+    last = pagure.lib.get_commit_index_head(session, project, branch)
+    if last is not None and last.commit == head.hex:
+        return get_commit_summaries(
+            session, project, branch, offset=offset, limit=limit)
+
+    # The index is not built yet or lags behind the branch
+    commits = []
+    total = 0
+    for commit in repo_obj.walk(head, pygit2.GIT_SORT_TIME):
+        if limit is not None and len(commits) >= limit:
+            return (None, commits)
+        total += 1
+        if total > offset:
+            commits.append(commit)
+    return (total, commits)
+
+
+def get_path_summaries(
+        session, project, repo_obj, branch, path, offset=0, limit=None):
+    """ Return the number of commits of the history of the given branch
+    changing the given path and ``limit`` of them, most recent first,
+    starting at ``offset``.
+
+    The commits are read from the commit path index when it is up to date
+    with the branch (see get_history_page). Otherwise the branch is walked
+    up to the page requested, looking for the commits changing the path,
+    and the number of commits is only known if the walk reached the first
+    commit of the branch, it is None otherwise and there are then more
+    commits after this page.
+    """
+    head = _get_ref_target(repo_obj, 'refs/heads/%s' % branch)
+    if head is None:
+        return (0, [])
+
+    last = pagure.lib.get_commit_index_head(session, project, branch)
+    if last is not None and last.commit == head.hex \
+            and pagure.lib.has_path_index(session, project, branch):
+        total = pagure.lib.get_path_history(
+            session, project, branch, path, count=True)
+        entries = pagure.lib.get_path_history(
+            session, project, branch, path, start=offset, limit=limit)
+        return (total, [CommitSummary(entry) for entry in entries])
+
+    # The index is not built yet or lags behind the branch
+    commits = []
+    total = 0
+    for commit in repo_obj.walk(head, pygit2.GIT_SORT_TIME):
+        if not _touches_path(commit, path):
+            continue
+        if limit is not None and len(commits) >= limit:
+            return (None, commits)
+        total += 1
+        if total > offset:
+            commits.append(commit)
+    return (total, commits)
+
+
+def _touches_path(commit, path):
+    """ Return whether the given commit changed the entry at the given
+    path, ie: if this entry differs from the one of every parent of the
+    commit, as ``git log -- <path>`` does.
+    """
+    oid = _get_path_oid(commit.tree, path)
+    if not commit.parents:
+        return oid is not None
+    for parent in commit.parents:
+        if _get_path_oid(parent.tree, path) == oid:
+            return False
+    return True
+
+
+class CommitLog(object):
+    """ Iterate over the history of a git repository, newest first, one
+    page at a time.
+
+    The walk starts from the commits of the ``cursor``, the hex of the
+    head of the history for the first page, and stops after ``limit``
+    commits. The commits left to walk are then available in
+    ``next_cursor``, None once the whole history has been walked, so the
+    next page is walked from there instead of from the head of the
+    history.
+    The revwalk is only sorted by time, which libgit2 does incrementally,
+    so a page costs O(limit) whatever the size of the history. When a
+    ``path`` is given, only the commits changing it are returned and the
+    commits walked in between add to the cost of the page.
+    """
+
+    def __init__(self, repo_obj, cursor, path=None, limit=None):
+        self.repo_obj = repo_obj
+        self.cursor = cursor
+        self.path = path
+        self.limit = limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        walker = None
+        for oid in self.cursor:
+            if walker is None:
+                walker = self.repo_obj.walk(oid, pygit2.GIT_SORT_TIME)
+            else:
+                walker.push(oid)
+        if walker is None:
+            return
+
+        frontier = set(self.cursor)
+        walked = set()
+        cnt = 0
+        for commit in walker:
+            if self.limit is not None and cnt >= self.limit:
+                break
+            walked.add(commit.hex)
+            frontier.discard(commit.hex)
+            frontier.update(parent.hex for parent in commit.parents)
+            if self.path is None or _touches_path(commit, self.path):
+                cnt += 1
+                yield commit
+
+        frontier.difference_update(walked)
+        self.next_cursor = sorted(frontier) or None
+
+
 def diff_pull_request(
         session, request, repo_obj, orig_repo, requestfolder,
         with_diff=True):
@@ -1002,16 +2198,10 @@ def diff_pull_request(
 
     if not repo_obj.is_empty and not orig_repo.is_empty:
         # Pull-request open
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_repo.lookup_branch(request.branch).get_object().hex,
-                pygit2.GIT_SORT_TIME)
-        ]
-        for commit in repo_obj.walk(commitid, pygit2.GIT_SORT_TIME):
-            if request.status and commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit)
+        diff_commits = list(get_diff_commits(
+            repo_obj, commitid,
+            base=orig_repo.lookup_branch(request.branch).get_object().oid,
+            orig_repo=orig_repo))
 
         if request.status and diff_commits:
             first_commit = repo_obj[diff_commits[-1].oid.hex]
@@ -1028,10 +2218,7 @@ def diff_pull_request(
                 repofolder=requestfolder)
 
         if diff_commits and with_diff:
-            diff = repo_obj.diff(
-                repo_obj.revparse_single(diff_commits[-1].parents[0].oid.hex),
-                repo_obj.revparse_single(diff_commits[0].oid.hex)
-            )
+            diff = get_diff_files(repo_obj, get_diff_range(diff_commits))
 
     elif orig_repo.is_empty and not repo_obj.is_empty:
         for commit in repo_obj.walk(commitid, pygit2.GIT_SORT_TIME):
@@ -1050,9 +2237,8 @@ def diff_pull_request(
                 request, repo=request.project,
                 repofolder=requestfolder)
 
-        repo_commit = repo_obj[request.commit_stop]
         if with_diff:
-            diff = repo_commit.tree.diff_to_tree(swap=True)
+            diff = get_diff_files(repo_obj, '..%s' % request.commit_stop)
     else:
         raise pagure.exceptions.PagureException(
             'Fork is empty, there are no commits to request pulling')
@@ -1060,29 +2246,839 @@ def diff_pull_request(
     return (diff_commits, diff)
 
 
-def get_git_tags(project):
-    """ Returns the list of tags created in the git repositorie of the
-    specified project.
+def get_diff_range(diff_commits):
+    """ Return the identifier, as understood by get_diff, of the diff
+    between the parent of the oldest and the newest of the provided
+    commits (ordered from the newest to the oldest).
     """
-    repopath = pagure.get_repo_path(project)
-    repo_obj = pygit2.Repository(repopath)
-    tags = [
-        tag.split('refs/tags/')[1]
-        for tag in repo_obj.listall_references()
-        if 'refs/tags/' in tag
-    ]
-    return tags
+    if not diff_commits:
+        return None
+
+    first_commit = diff_commits[-1]
+    base = ''
+    if first_commit.parents:
+        base = first_commit.parents[0].oid.hex
+    return '%s..%s' % (base, diff_commits[0].oid.hex)
+
+
+def _parse_diff_identifier(repo_obj, identifier):
+    """ Return the hex of the base and head commits of the diff designated
+    by the provided identifier, the base is an empty string for the empty
+    tree.
+    """
+    if '..' in identifier:
+        base, head = identifier.split('..', 1)
+    else:
+        base, head = None, identifier
+
+    try:
+        head = repo_obj.get(head)
+        if base:
+            base = repo_obj.get(base)
+    except ValueError:
+        head = None
+
+    if not isinstance(head, pygit2.Commit) or (
+            base and not isinstance(base, pygit2.Commit)):
+        raise pagure.exceptions.PagureException(
+            'Invalid diff identifier: %s' % identifier)
+
+    if base is None:
+        base = head.parents[0] if head.parents else ''
+
+    return (base.hex if base else '', head.hex)
+
+
+def get_diff(repo_obj, identifier, context_lines=3):
+    """ Return the diff corresponding to the provided identifier in the
+    given repo.
+
+    The identifier is either a commit hash, diffed against its first
+    parent, or a range of commits ``<base>..<head>`` where an empty base
+    stands for the empty tree.
+    """
+    base, head = _parse_diff_identifier(repo_obj, identifier)
+    head = repo_obj[head]
+
+    if not base:
+        # First commit in the repo
+        return head.tree.diff_to_tree(
+            context_lines=context_lines, swap=True)
+    return repo_obj.diff(
+        repo_obj[base], head, context_lines=context_lines)
+
+
+def get_diff_file(diff, filename, index=None):
+    """ Return the patch of the provided file in the given diff or None if
+    it is not part of the diff.
+
+    :kwarg index: the position (starting at 1) at which the file is
+        expected in the diff, the patches of the other files are then not
+        computed.
+    """
+    if index and 0 < index <= len(diff):
+        patch = diff[index - 1]
+        if patch.new_file_path == filename:
+            return patch
+
+    for patch in diff:
+        if patch.new_file_path == filename:
+            return patch
+
+
+class DiffHunk(object):
+    """ A hunk of the diff of a file, its lines are (origin, content)
+    tuples.
+    """
+
+    def __init__(self, hunk):
+        self.old_start = hunk.old_start
+        self.old_lines = hunk.old_lines
+        self.new_start = hunk.new_start
+        self.new_lines = hunk.new_lines
+        self.lines = [
+            line if isinstance(line, tuple) else (line.origin, line.content)
+            for line in hunk.lines
+        ]
+
+
+class DiffFile(object):
+    """ The diff of a file, holding the same information as the pygit2
+    Patch it is built from but which can be pickled.
+    """
+
+    def __init__(self, patch):
+        self.old_file_path = patch.old_file_path
+        self.new_file_path = patch.new_file_path
+        self.new_id = getattr(patch, 'new_id', None) or patch.new_oid
+        self.additions = patch.additions
+        self.deletions = patch.deletions
+        self.is_binary = patch.is_binary
+        self.hunks = [DiffHunk(hunk) for hunk in patch.hunks]
+
+
+# Result cached for the diffs which could not be computed
+DIFF_TOO_LARGE = 'too large'
+
+_DIFF_CACHE = None
+_DIFF_POOL = None
+_DIFF_POOL_PID = None
+_DIFF_POOL_LOCK = threading.Lock()
+
+
+def _stop_diff_worker(signum, frame):
+    """ Stop the diff being computed once the CPU time limit is reached.
+    """
+    raise pagure.exceptions.DiffTooLargeException('CPU time limit reached')
+
+
+def _init_diff_worker(cpu_time, memory):
+    """ Limit the resources the diff worker process can use. """
+    if cpu_time:
+        signal.signal(signal.SIGXCPU, _stop_diff_worker)
+        # Leave a second to the worker to report the failure
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+    if memory:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
 
 
-def get_git_tags_objects(project):
-    """ Returns the list of references of the tags created in the git
-    repositorie the specified project.
+def _compute_diff_files(args):
+    """ Compute the diff between the two provided commits of a repo.
+
+    Only git is involved so this can run in a worker process.
+
+    :arg args: a tuple (repopath, base, head, context_lines)
+    :return: the list of DiffFile or DIFF_TOO_LARGE if the resources of
+        the worker did not allow to compute it.
+
     """
-    repopath = pagure.get_repo_path(project)
-    repo_obj = pygit2.Repository(repopath)
-    tags = [
-        repo_obj.lookup_reference(tag)
-        for tag in repo_obj.listall_references()
-        if 'refs/tags/' in tag
+    repopath, base, head, context_lines = args
+    try:
+        repo_obj = pygit2.Repository(repopath)
+        identifier = '%s..%s' % (base, head)
+        return [
+            DiffFile(patch)
+            for patch in get_diff(
+                repo_obj, identifier, context_lines=context_lines)
+        ]
+    except (MemoryError, pagure.exceptions.DiffTooLargeException):
+        return DIFF_TOO_LARGE
+
+
+def _get_diff_pool():
+    """ Return the pool of processes computing the diffs for the current
+    process.
+
+    Each worker computes a single diff so the CPU time and memory limits
+    apply per diff.
+    """
+    global _DIFF_POOL, _DIFF_POOL_PID
+    with _DIFF_POOL_LOCK:
+        if _DIFF_POOL is None or _DIFF_POOL_PID != os.getpid():
+            _DIFF_POOL = multiprocessing.Pool(
+                processes=pagure.APP.config['DIFF_WORKERS'],
+                initializer=_init_diff_worker,
+                initargs=(
+                    pagure.APP.config['DIFF_CPU_TIME'],
+                    pagure.APP.config['DIFF_MEMORY'],
+                ),
+                maxtasksperchild=1,
+            )
+            _DIFF_POOL_PID = os.getpid()
+        return _DIFF_POOL
+
+
+def _get_diff_size(diff):
+    """ Return the approximate size, in bytes, of the given list of
+    DiffFile once in memory.
+    """
+    if diff == DIFF_TOO_LARGE:
+        return len(diff)
+    size = 0
+    for difffile in diff:
+        size += len(difffile.old_file_path or '') \
+            + len(difffile.new_file_path or '')
+        for hunk in difffile.hunks:
+            for origin, content in hunk.lines:
+                size += len(content) + 1
+    return size
+
+
+def get_diff_files(repo_obj, identifier, context_lines=3):
+    """ Return the list of DiffFile of the diff corresponding to the
+    provided identifier (see get_diff) in the given repo.
+
+    The diff is computed in a pool of DIFF_WORKERS processes whose CPU
+    time and memory are limited and the result is cached by base, head and
+    options. The diffs which could not be computed within these limits are
+    cached as such so they are not attempted again. Those not computed
+    within DIFF_TIMEOUT are not: this time includes the wait for a free
+    worker, so the diff may well be computed when the workers are idle.
+
+    :raises pagure.exceptions.DiffTooLargeException: if the diff could not
+        be computed within these limits.
+
+    """
+    global _DIFF_CACHE
+    base, head = _parse_diff_identifier(repo_obj, identifier)
+
+    if _DIFF_CACHE is None:
+        _DIFF_CACHE = pagure.lib.cache.get_cache(
+            'diff', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['DIFF_CACHE_SIZE'],
+            weigh=_get_diff_size,
+            max_weight=pagure.APP.config['DIFF_CACHE_MAX_BYTES'])
+
+    key = '%s..%s:%s' % (base, head, context_lines)
+    diff = _DIFF_CACHE.get(key)
+    if diff is None:
+        args = (repo_obj.path, base, head, context_lines)
+        if not pagure.APP.config['DIFF_WORKERS']:
+            diff = _compute_diff_files(args)
+        else:
+            result = _get_diff_pool().apply_async(_compute_diff_files, (args,))
+            try:
+                diff = result.get(timeout=pagure.APP.config['DIFF_TIMEOUT'])
+            except multiprocessing.TimeoutError:
+                raise pagure.exceptions.DiffTooLargeException(
+                    'The diff could not be computed in time')
+        _DIFF_CACHE.set(key, diff)
+
+    if diff == DIFF_TOO_LARGE:
+        raise pagure.exceptions.DiffTooLargeException(
+            'The diff is too large to be shown')
+    return diff
+
+
+_LAST_COMMITS_CACHE = None
+
+
+def _get_subtree(repo_obj, tree, path):
+    """ Return the tree found at the given path of the provided tree or
+    None if there is no tree there.
+    """
+    if not path:
+        return tree
+    try:
+        entry = tree[path]
+    except KeyError:
+        return None
+    if entry.filemode != pygit2.GIT_FILEMODE_TREE:
+        return None
+    return repo_obj[entry.oid]
+
+
+def get_last_commits(repo_obj, commit, path, names):
+    """ Return a dict associating the provided names of entries of the
+    tree found at ``path`` in the given commit to the hex of the last
+    commit which changed them.
+
+    The history is walked from the commit until all the entries are found,
+    as ``git log`` does a commit is considered to change an entry only if
+    the entry differs from the one of all its parents.
+    The results are cached by commit and path and reused when reaching a
+    commit whose last commits are already known, so browsing the tree of
+    a branch after a push only walks the new commits.
+    """
+    global _LAST_COMMITS_CACHE
+    if _LAST_COMMITS_CACHE is None:
+        _LAST_COMMITS_CACHE = pagure.lib.cache.get_cache(
+            'last_commits', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['CACHE_SIZE'])
+
+    path = path.strip('/')
+    key = '%s:%s' % (commit.oid.hex, path)
+    last_commits = dict(_LAST_COMMITS_CACHE.get(key) or {})
+
+    tree = _get_subtree(repo_obj, commit.tree, path)
+    targets = {}
+    if tree is not None:
+        for name in names:
+            if name not in last_commits and name in tree:
+                targets[name] = tree[name].oid
+
+    if targets:
+        for current in repo_obj.walk(commit.oid, pygit2.GIT_SORT_TIME):
+            tree = _get_subtree(repo_obj, current.tree, path)
+            if tree is None:
+                continue
+
+            if current.oid != commit.oid:
+                known = _LAST_COMMITS_CACHE.get(
+                    '%s:%s' % (current.oid.hex, path)) or {}
+                for name in list(targets):
+                    if name in known and name in tree \
+                            and tree[name].oid == targets[name]:
+                        last_commits[name] = known[name]
+                        del targets[name]
+
+            parents = [
+                _get_subtree(repo_obj, parent.tree, path)
+                for parent in current.parents
+            ]
+            parents = [parent for parent in parents if parent is not None]
+            # Nothing changed in the folder compared to one of the parents
+            if any(parent.oid == tree.oid for parent in parents):
+                continue
+
+            for name in list(targets):
+                if name not in tree or tree[name].oid != targets[name]:
+                    continue
+                if any(
+                        name in parent and parent[name].oid == targets[name]
+                        for parent in parents):
+                    continue
+                last_commits[name] = current.oid.hex
+                del targets[name]
+
+            if not targets:
+                break
+
+        _LAST_COMMITS_CACHE.set(key, last_commits)
+
+    return dict(
+        (name, last_commits[name]) for name in names if name in last_commits)
+
+
+_BLAME_CACHE = None
+
+
+def _count_lines(data):
+    """ Return the number of lines of the given content, as git counts
+    them.
+    """
+    count = data.count('\n')
+    if data and not data.endswith('\n'):
+        count += 1
+    return count
+
+
+def _derive_blame(blame, patch, commitid):
+    """ Return the blame of a file from the blame of its previous version
+    and the patch between the two versions, the lines added by the patch
+    are attributed to the commit with the given hex.
+    """
+    old_lines = []
+    for hunk_commit, count in blame:
+        old_lines.extend([hunk_commit] * count)
+
+    lines = []
+    position = 0
+    for hunk in patch.hunks:
+        start = hunk.old_start if hunk.old_lines else hunk.old_start + 1
+        lines.extend(old_lines[position:start - 1])
+        position = start - 1
+        for line in hunk.lines:
+            origin = line[0] if isinstance(line, tuple) else line.origin
+            if origin == ' ':
+                lines.append(old_lines[position])
+                position += 1
+            elif origin == '-':
+                position += 1
+            elif origin == '+':
+                lines.append(commitid)
+    lines.extend(old_lines[position:])
+
+    output = []
+    for line in lines:
+        if output and output[-1][0] == line:
+            output[-1] = (line, output[-1][1] + 1)
+        else:
+            output.append((line, 1))
+    return output
+
+
+def get_blame(repo_obj, commit, path):
+    """ Return the blame of the file at the given path in the provided
+    commit, as a list of (commit hex, number of lines) tuples covering the
+    lines of the file in order.
+
+    The blames are cached by commit and path. When the blame of the only
+    parent of the commit is known and the file changed in at most
+    BLAME_INCREMENTAL_HUNKS hunks, the blame is derived from the one of the
+    parent instead of walking the history again.
+
+    :raises pagure.exceptions.PagureException: if there is no file at this
+        path in the commit.
+
+    """
+    global _BLAME_CACHE
+    if _BLAME_CACHE is None:
+        _BLAME_CACHE = pagure.lib.cache.get_cache(
+            'blame', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['CACHE_SIZE'])
+
+    path = path.strip('/')
+    key = '%s:%s' % (commit.oid.hex, path)
+    blame = _BLAME_CACHE.get(key)
+    if blame is not None:
+        return blame
+
+    try:
+        entry = commit.tree[path]
+    except KeyError:
+        entry = None
+    if entry is None or entry.filemode == pygit2.GIT_FILEMODE_TREE:
+        raise pagure.exceptions.PagureException(
+            'No file %s found in %s' % (path, commit.oid.hex))
+    blob = repo_obj[entry.oid]
+
+    if len(commit.parents) == 1:
+        parent = commit.parents[0]
+        parent_blame = _BLAME_CACHE.get('%s:%s' % (parent.oid.hex, path))
+        try:
+            parent_entry = parent.tree[path]
+        except KeyError:
+            parent_entry = None
+
+        if parent_blame is None or parent_entry is None:
+            pass
+        elif parent_entry.oid == entry.oid:
+            blame = parent_blame
+        else:
+            patch = repo_obj[parent_entry.oid].diff(blob)
+            if len(patch.hunks) <= \
+                    pagure.APP.config['BLAME_INCREMENTAL_HUNKS']:
+                try:
+                    blame = _derive_blame(
+                        parent_blame, patch, commit.oid.hex)
+                except IndexError:
+                    blame = None
+                # Fallback to the full blame if the patch was not understood
+                if blame is not None and \
+                        sum(count for _, count in blame) != \
+                        _count_lines(blob.data):
+                    blame = None
+
+    if blame is None:
+        blame = [
+            (hunk.final_commit_id.hex, hunk.lines_in_hunk)
+            for hunk in repo_obj.blame(path, newest_commit=commit.oid)
+        ]
+
+    _BLAME_CACHE.set(key, blame)
+    return blame
+
+
+# Formats in which git can archive a tree and the mimetype of the archives
+ARCHIVE_FORMATS = {
+    'tar.gz': 'application/x-gzip',
+    'zip': 'application/zip',
+}
+
+
+def _lock_archive(path):
+    """ Return the opened lock file of the archive at the given path, once
+    this process holds it.
+
+    The lock file is removed once the archive is generated, so a lock
+    obtained on a file which is not there anymore is not used.
+    """
+    lockpath = path + '.lock'
+    while True:
+        stream = open(lockpath, 'a')
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        try:
+            if os.fstat(stream.fileno()).st_ino == os.stat(lockpath).st_ino:
+                return stream
+        except OSError:
+            pass
+        stream.close()
+
+
+def _unlock_archive(path, stream):
+    """ Remove and release the lock file of the archive at the given path.
+    """
+    try:
+        os.unlink(path + '.lock')
+    except OSError:
+        pass
+    stream.close()
+
+
+def get_archive(tree, prefix, archive_format):
+    """ Return the path to the archive of the given tree, in which all the
+    files are placed in the ``prefix`` folder, if it is in the
+    ARCHIVE_FOLDER, None otherwise.
+
+    The archives are keyed by the oid of the tree, the modification time of
+    the archive returned is updated so the archives used the least recently
+    are the ones pruned (see prune_archives).
+
+    :arg archive_format: one of the ARCHIVE_FORMATS
+
+    """
+    path = os.path.join(
+        pagure.APP.config['ARCHIVE_FOLDER'], tree.hex[:2], tree.hex,
+        '%s.%s' % (prefix, archive_format))
+    try:
+        os.utime(path, None)
+    except OSError:
+        return None
+    return path
+
+
+def generate_archive(repo_obj, tree, prefix, archive_format):
+    """ Generate the archive of the given tree, in which all the files are
+    placed in the ``prefix`` folder, yielding its content while it is
+    written to the ARCHIVE_FOLDER.
+
+    When several requests ask for an archive which is not there yet, one
+    generates it while the others wait for it and then read it.
+
+    :arg archive_format: one of the ARCHIVE_FORMATS
+    :raises pagure.exceptions.PagureException: if git failed to generate
+        the archive, part of it may have been yielded already.
+
+    """
+    folder = os.path.join(
+        pagure.APP.config['ARCHIVE_FOLDER'], tree.hex[:2], tree.hex)
+    path = os.path.join(folder, '%s.%s' % (prefix, archive_format))
+
+    try:
+        os.makedirs(folder)
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+
+    lock = _lock_archive(path)
+    if os.path.exists(path):
+        # Generated while waiting for the lock
+        _unlock_archive(path, lock)
+        with open(path, 'rb') as archive:
+            for chunk in iter(lambda: archive.read(_UPLOAD_CHUNK_SIZE), ''):
+                yield chunk
+        return
+
+    try:
+        errors = tempfile.TemporaryFile()
+        proc = subprocess.Popen(
+            [
+                'git', 'archive', '--format=%s' % archive_format,
+                '--prefix=%s/' % prefix, tree.hex,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=errors,
+            cwd=repo_obj.path)
+        tmppath = None
+        try:
+            tmpfd, tmppath = tempfile.mkstemp(dir=folder, prefix='.archive')
+            with os.fdopen(tmpfd, 'wb') as archive:
+                for chunk in iter(
+                        lambda: proc.stdout.read(_UPLOAD_CHUNK_SIZE), ''):
+                    archive.write(chunk)
+                    yield chunk
+            if proc.wait():
+                errors.seek(0)
+                raise pagure.exceptions.PagureException(
+                    'Could not generate the archive of %s: %s' % (
+                        tree.hex, errors.read()))
+            os.chmod(tmppath, 0o644)
+            os.rename(tmppath, path)
+        finally:
+            # The client went away or git failed
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+            errors.close()
+            if tmppath and os.path.exists(tmppath):
+                os.unlink(tmppath)
+    finally:
+        _unlock_archive(path, lock)
+
+
+def prune_archives(max_size):
+    """ Remove the archives of the ARCHIVE_FOLDER used the least recently
+    until they take at most ``max_size`` bytes, return the number of
+    archives removed.
+    """
+    archives = []
+    total = 0
+    for root, _, filenames in os.walk(pagure.APP.config['ARCHIVE_FOLDER']):
+        for filename in filenames:
+            # Skip the lock files and the archives being generated
+            if filename.startswith('.') or filename.endswith('.lock'):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            archives.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    cnt = 0
+    for _, size, path in sorted(archives):
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        cnt += 1
+    return cnt
+
+
+class GitBranch(object):
+    """ A branch of a git repo, ``commit`` is the hex of its head and
+    ``date`` the timestamp at which this commit was made.
+    """
+
+    def __init__(self, name, commit, date):
+        self.name = name
+        self.commit = commit
+        self.date = date
+
+
+class BranchIndex(object):
+    """ The GitBranch of the branches of a git repo, sorted by name and
+    indexed by name.
+    """
+
+    def __init__(self, branches):
+        self.branches = sorted(branches, key=lambda branch: branch.name)
+        self._index = dict((branch.name, branch) for branch in branches)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self.branches)
+
+    def __len__(self):
+        return len(self.branches)
+
+    def get(self, name):
+        """ Return the GitBranch of the given name or None. """
+        return self._index.get(name)
+
+    def names(self):
+        """ Return the names of the branches. """
+        return [branch.name for branch in self.branches]
+
+    def search(self, pattern=None):
+        """ Return the GitBranch whose name matches the given pattern, in
+        which ``*`` matches any sequence of characters.
+        """
+        if not pattern:
+            return self.branches
+        return [
+            branch for branch in self.branches
+            if fnmatch.fnmatchcase(branch.name, pattern)
+        ]
+
+
+_BRANCHES_CACHE = None
+_BRANCHES_MEMORY_CACHE = None
+_DIVERGENCE_CACHE = None
+
+
+def get_branch_index(repo_obj):
+    """ Return the BranchIndex of the given git repository.
+
+    The branches are listed by a single call to ``git for-each-ref`` and
+    the index is cached until the packed references or the folders of the
+    branches change, so checking if a branch exists does not list all the
+    references of the repo. The indexes are also kept in memory in front
+    of the CACHE_FOLDER, so they are not read from disk at every call.
+    """
+    global _BRANCHES_CACHE, _BRANCHES_MEMORY_CACHE
+    if _BRANCHES_CACHE is None:
+        _BRANCHES_CACHE = pagure.lib.cache.get_cache(
+            'branches', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['CACHE_SIZE'])
+        _BRANCHES_MEMORY_CACHE = _BRANCHES_CACHE
+        if pagure.APP.config['CACHE_FOLDER']:
+            _BRANCHES_MEMORY_CACHE = pagure.lib.cache.get_cache(
+                'branches', size=pagure.APP.config['CACHE_SIZE'])
+
+    repopath = repo_obj.path
+    key = '%s:%s' % (repopath, get_refs_state(repopath, 'heads'))
+
+    index = _BRANCHES_MEMORY_CACHE.get(key)
+    if index is not None:
+        return index
+
+    index = _BRANCHES_CACHE.get(key)
+    if index is None:
+        index = BranchIndex([
+            GitBranch(
+                name=refname[len('refs/heads/'):],
+                commit=commit,
+                date=int(date.split()[0]) if date else 0,
+            )
+            for refname, commit, date in _for_each_ref(
+                repopath, 'heads',
+                ['refname', 'objectname', 'committerdate:raw'])
+        ])
+        _BRANCHES_CACHE.set(key, index)
+    _BRANCHES_MEMORY_CACHE.set(key, index)
+    return index
+
+
+def get_branch_divergence(repo_obj, branch, base):
+    """ Return a tuple (ahead, behind) with the number of commits of the
+    given GitBranch not in the ``base`` commit and of the ``base`` commit
+    not in the branch, cached by commits.
+    """
+    global _DIVERGENCE_CACHE
+    if _DIVERGENCE_CACHE is None:
+        _DIVERGENCE_CACHE = pagure.lib.cache.get_cache(
+            'divergence', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['CACHE_SIZE'])
+
+    key = '%s..%s' % (base, branch.commit)
+    divergence = _DIVERGENCE_CACHE.get(key)
+    if divergence is None:
+        divergence = get_ahead_behind(
+            repo_obj, pygit2.Oid(hex=branch.commit), pygit2.Oid(hex=base))
+        _DIVERGENCE_CACHE.set(key, divergence)
+    return divergence
+
+
+class GitTag(object):
+    """ A tag of a git repo.
+
+    ``target`` is the hex of the object the tag points to and ``commit``
+    the hex of the object it designates once peeled, they differ for the
+    annotated tags. ``date`` is the timestamp at which the annotated tags
+    were made and the one of the commit for the others.
+    """
+
+    def __init__(self, name, target, commit, date):
+        self.name = name
+        self.target = target
+        self.commit = commit
+        self.date = date
+
+
+_TAGS_CACHE = None
+
+# Ways the tags can be sorted
+TAGS_SORT = ('date', 'version')
+
+
+def get_refs_state(repopath, namespace):
+    """ Return a value which changes whenever a reference of the given
+    namespace (``tags``, ``heads``...) of the git repo at the given path is
+    added, removed or moved.
+    """
+    state = []
+    packed = os.path.join(repopath, 'packed-refs')
+    if os.path.exists(packed):
+        stat = os.stat(packed)
+        state.append((packed, stat.st_mtime, stat.st_size))
+    for root, _, _ in os.walk(os.path.join(repopath, 'refs', namespace)):
+        state.append((root, os.stat(root).st_mtime))
+    return tuple(state)
+
+
+def _for_each_ref(repopath, namespace, fields):
+    """ Yield, for each reference of the given namespace of the git repo at
+    the given path, the list of the values of the given ``git for-each-ref``
+    fields.
+    """
+    out = subprocess.Popen(
+        [
+            'git', 'for-each-ref',
+            '--format=%s' % '%00'.join('%%(%s)' % field for field in fields),
+            'refs/%s/' % namespace,
+        ],
+        stdout=subprocess.PIPE,
+        cwd=repopath
+    ).communicate()[0]
+    for line in out.splitlines():
+        yield line.split('\0')
+
+
+def _version_key(name):
+    """ Return the key sorting the provided tag names as versions,
+    comparing their numbers as numbers.
+    """
+    return [
+        (0, int(part)) if part.isdigit() else (1, part)
+        for part in re.split(r'(\d+)', name)
     ]
-    return tags
+
+
+def get_git_tags(project, sort='date'):
+    """ Returns the list of GitTag of the tags created in the git
+    repositorie of the specified project, the most recent first.
+
+    Only the ``refs/tags/`` namespace is listed, by a single call to
+    ``git for-each-ref`` which also peels the annotated tags. The list is
+    cached until the packed references or the tags folder change.
+
+    :kwarg sort: either ``date`` or ``version``
+
+    """
+    global _TAGS_CACHE
+    if _TAGS_CACHE is None:
+        _TAGS_CACHE = pagure.lib.cache.get_cache(
+            'tags', folder=pagure.APP.config['CACHE_FOLDER'],
+            size=pagure.APP.config['CACHE_SIZE'])
+
+    repopath = get_repo_obj(pagure.get_repo_path(project)).path
+    key = '%s:%s' % (repopath, get_refs_state(repopath, 'tags'))
+
+    tags = _TAGS_CACHE.get(key)
+    if tags is None:
+        tags = [
+            GitTag(
+                name=refname[len('refs/tags/'):],
+                target=target,
+                commit=peeled or target,
+                date=int(date.split()[0]) if date else 0,
+            )
+            for refname, target, peeled, date in _for_each_ref(
+                repopath, 'tags',
+                ['refname', 'objectname', '*objectname', 'creatordate:raw'])
+        ]
+        _TAGS_CACHE.set(key, tags)
+
+    if sort == 'version':
+        return sorted(
+            tags, key=lambda tag: _version_key(tag.name), reverse=True)
+    return sorted(tags, key=lambda tag: (tag.date, tag.name), reverse=True)
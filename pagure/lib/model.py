@@ -378,6 +378,90 @@ class Project(BASE):
         return output
 
 
+class ForkDivergence(BASE):
+    """ Stores how far the master branch of a fork is ahead and behind the
+    master branch of its parent, for the heads of these two branches.
+
+    Table -- fork_divergence
+    """
+
+    __tablename__ = 'fork_divergence'
+
+    project_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True)
+    fork_head = sa.Column(sa.String(40), nullable=False)
+    parent_head = sa.Column(sa.String(40), nullable=False)
+    ahead = sa.Column(sa.Integer, nullable=False)
+    behind = sa.Column(sa.Integer, nullable=False)
+
+    date_updated = sa.Column(sa.DateTime, nullable=False,
+                             default=datetime.datetime.utcnow,
+                             onupdate=datetime.datetime.utcnow)
+
+    project = relation(
+        'Project', foreign_keys=[project_id], remote_side=[Project.id],
+        backref=backref(
+            'divergence', uselist=False, cascade="delete, delete-orphan",
+            single_parent=True)
+    )
+
+
+class CommitIndex(BASE):
+    """ Stores, for each branch of a project, the position of the commits
+    in its history (0 being the oldest), their generation number and a
+    summary of them, so that the history can be paginated without walking
+    the git repository.
+
+    Table -- commit_index
+    """
+
+    __tablename__ = 'commit_index'
+    __table_args__ = (
+        sa.Index('commit_index_commit_idx', 'project_id', 'branch', 'commit'),
+        sa.Index(
+            'commit_index_paths_indexed_idx',
+            'project_id', 'branch', 'paths_indexed'),
+    )
+
+    project_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True)
+    branch = sa.Column(sa.String(255), primary_key=True)
+    position = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    commit = sa.Column(sa.String(40), nullable=False)
+    generation = sa.Column(sa.Integer, nullable=False)
+    author_name = sa.Column(sa.Text, nullable=False)
+    author_email = sa.Column(sa.Text, nullable=False)
+    commit_time = sa.Column(sa.Integer, nullable=False)
+    subject = sa.Column(sa.Text, nullable=False)
+    # Whether the paths changed by the commit are in the commit path index
+    paths_indexed = sa.Column(sa.Boolean, nullable=False, default=False)
+
+
+class CommitPathIndex(BASE):
+    """ Stores, for each commit of a project, the paths (files and folders)
+    it changed compared to its parents, so that the history of a path can
+    be retrieved without diffing the commits.
+
+    Table -- commit_path_index
+    """
+
+    __tablename__ = 'commit_path_index'
+    __table_args__ = (
+        sa.Index('commit_path_index_path_idx', 'project_id', 'path'),
+    )
+
+    project_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True)
+    commit = sa.Column(sa.String(40), primary_key=True)
+    path = sa.Column(sa.Text, primary_key=True)
+
+
 class ProjectUser(BASE):
     """ Stores the user of a projects.
 
@@ -597,6 +681,37 @@ class IssueComment(BASE):
         return self.issue
 
 
+class IssueAttachment(BASE):
+    """ Stores the files attached to the tickets of a project, indexed by
+    the sha256 checksum of their content.
+
+    Table -- issue_attachments
+    """
+
+    __tablename__ = 'issue_attachments'
+    __table_args__ = (
+        sa.UniqueConstraint('project_id', 'sha256'),
+    )
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    project_id = sa.Column(
+        sa.Integer,
+        sa.ForeignKey('projects.id', ondelete='CASCADE', onupdate='CASCADE'),
+        nullable=False)
+    sha256 = sa.Column(sa.String(64), nullable=False)
+    filename = sa.Column(sa.Text, nullable=False)
+
+    date_created = sa.Column(sa.DateTime, nullable=False,
+                             default=datetime.datetime.utcnow)
+
+    project = relation(
+        'Project', foreign_keys=[project_id], remote_side=[Project.id],
+        backref=backref(
+            'issue_attachments', cascade="delete, delete-orphan",
+            single_parent=True)
+    )
+
+
 class Tag(BASE):
     """ Stores the tags.
 
@@ -691,6 +806,14 @@ class PullRequest(BASE):
             'NO_CHANGE', 'FFORWARD', 'CONFLICTS', 'MERGE',
             name='merge_status_enum'),
         nullable=True)
+    # Heads of the target and source branches the merge_status was
+    # computed for
+    merge_status_base = sa.Column(
+        sa.Text(),
+        nullable=True)
+    merge_status_head = sa.Column(
+        sa.Text(),
+        nullable=True)
 
     status = sa.Column(
         sa.Text,
@@ -17,6 +17,7 @@ import pagure.exceptions
 import pagure.lib
 import pagure.forms
 import pagure.ui.filters
+from pagure.hooks import BaseHook
 from pagure import (APP, SESSION, cla_required,
                     generate_gitolite_acls, generate_gitolite_key,
                     generate_authorized_key_file, authenticated,
@@ -246,6 +247,8 @@ def new_project():
                 requestfolder=APP.config['REQUESTS_FOLDER'],
             )
             SESSION.commit()
+            BaseHook.set_up(
+                pagure.lib.get_project(SESSION, name))
             generate_gitolite_acls()
             flask.flash(message)
             return flask.redirect(flask.url_for('view_repo', repo=name))
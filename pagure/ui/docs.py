@@ -16,6 +16,7 @@ import pygit2
 import pagure.doc_utils
 import pagure.exceptions
 import pagure.lib
+import pagure.lib.git
 import pagure.forms
 from pagure import APP, SESSION
 
@@ -103,9 +104,9 @@ def view_docs(repo, username=None, branchname=None, filename=None):
         return flask.redirect(flask.url_for(
             'view_repo', repo=repo.name, username=username))
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
-    if branchname in repo_obj.listall_branches():
+    if branchname in pagure.lib.git.get_branch_index(repo_obj):
         branch = repo_obj.lookup_branch(branchname)
         commit = branch.get_object()
     else:
@@ -8,6 +8,7 @@
 
 """
 
+import collections
 import datetime
 import textwrap
 
@@ -15,10 +16,6 @@ import flask
 import arrow
 import markdown
 
-from pygments import highlight
-from pygments.lexers.text import DiffLexer
-from pygments.formatters import HtmlFormatter
-
 import pagure.exceptions
 import pagure.lib
 import pagure.forms
@@ -51,6 +48,100 @@ def format_ts(string):
     return dattime.strftime('%b %d %Y %H:%M:%S')
 
 
+def _get_inline_comments(prequest):
+    """ Return the inline comments of the provided pull-request indexed by
+    (commit, filename, line) and sorted by date.
+
+    The index is built once per request and shared by all the files of the
+    pull-request rendered.
+    """
+    indexes = getattr(flask.g, 'inline_comments', None)
+    if indexes is None:
+        indexes = flask.g.inline_comments = {}
+
+    if prequest.uid not in indexes:
+        comments = collections.defaultdict(list)
+        for com in prequest.comments:
+            if com.commit_id:
+                comments[(com.commit_id, com.filename, com.line)].append(com)
+        for key in comments:
+            comments[key].sort(key=lambda obj: obj.date_created)
+        indexes[prequest.uid] = comments
+
+    return indexes[prequest.uid]
+
+
+def _format_comment(comment, repo_admin):
+    """ Return the row of the table of a file showing the provided inline
+    comment.
+    """
+    templ_delete = ''
+    if authenticated() and (
+            (comment.parent.status is True
+             and comment.user.user == flask.g.fas_user.username)
+            or repo_admin):
+        templ_delete = '<button type="submit" name="drop_comment" ' \
+            'value="%(commentid)s"' \
+            'onclick="return confirm(\'Do you really want to remove' \
+            ' this comment?\');"' \
+            'title="Remove comment">' \
+            '<span class="icon icon-remove blue"></span>' \
+            '</button>' % ({'commentid': comment.id})
+
+    return '<tr><td></td>' \
+        '<td colspan="2"><table style="width:100%%"><tr>' \
+        '<td><a href="%(url)s">%(user)s</a></td>' \
+        '<td class="right">' \
+        '%(date)s%(templ_delete)s' \
+        '</td>' \
+        '</tr>' \
+        '<tr><td colspan="2" class="pr_comment">%(comment)s' \
+        '</td></tr>' \
+        '</table></td></tr>' % (
+            {
+                'url': flask.url_for(
+                    'view_user', username=comment.user.user),
+                'templ_delete': templ_delete,
+                'user': comment.user.user,
+                'date': comment.date_created.strftime(
+                    '%b %d %Y %H:%M:%S'),
+                'comment': markdown_filter(comment.comment),
+            }
+        )
+
+
+def _format_row(cnt, index, line, commit=None, filename=None, img=None):
+    """ Return the row of the table of a file showing the provided line. """
+    if filename and commit:
+        return '<tr><td class="cell1">' \
+            '<a id="%(cnt)s" href="#%(cnt)s">%(cnt_lbl)s</a></td>' \
+            '<td class="prc" data-row="%(cnt_lbl)s"' \
+            ' data-filename="%(filename)s" data-commit="%(commit)s">' \
+            '<p>' \
+            '<img src="%(img)s" alt="Add comment" title="Add comment"/>' \
+            '</p>' \
+            '</td><td class="cell2"><pre>%(line)s</pre></td></tr>' % (
+                {
+                    'cnt': '%s_%s' % (index, cnt),
+                    'cnt_lbl': cnt,
+                    'img': img,
+                    'filename': filename,
+                    'commit': commit,
+                    'line': line,
+                }
+            )
+    else:
+        return '<tr><td class="cell1">' \
+            '<a id="%(cnt)s" href="#%(cnt)s">%(cnt_lbl)s</a></td>' \
+            '<td class="cell2"><pre>%(line)s</pre></td></tr>' % (
+                {
+                    'cnt': '%s_%s' % (index, cnt),
+                    'cnt_lbl': cnt,
+                    'line': line,
+                }
+            )
+
+
 @APP.template_filter('format_loc')
 def format_loc(loc, commit=None, filename=None, prequest=None, index=None):
     """ Template filter putting the provided lines of code into a table
@@ -64,111 +155,117 @@ def format_loc(loc, commit=None, filename=None, prequest=None, index=None):
     ]
 
     comments = {}
+    repo_admin = False
     if prequest and not isinstance(prequest, flask.wrappers.Request):
-        for com in prequest.comments:
-            if commit and com.commit_id == commit \
-                    and com.filename == filename:
-                if com.line in comments:
-                    comments[com.line].append(com)
-                else:
-                    comments[com.line] = [com]
-    for key in comments:
-        comments[key] = sorted(
-            comments[key], key=lambda obj: obj.date_created)
+        comments = _get_inline_comments(prequest)
+        repo_admin = is_repo_admin(prequest.project)
 
     if not index:
         index = ''
 
-    cnt = 1
-    for line in loc.split('\n'):
-        if filename and commit:
-            output.append(
-                '<tr><td class="cell1">'
-                '<a id="%(cnt)s" href="#%(cnt)s">%(cnt_lbl)s</a></td>'
-                '<td class="prc" data-row="%(cnt_lbl)s"'
-                ' data-filename="%(filename)s" data-commit="%(commit)s">'
-                '<p>'
-                '<img src="%(img)s" alt="Add comment" title="Add comment"/>'
-                '</p>'
-                '</td>' % (
-                    {
-                        'cnt': '%s_%s' % (index, cnt),
-                        'cnt_lbl': cnt,
-                        'img': flask.url_for('static', filename='users.png'),
-                        'filename': filename,
-                        'commit': commit,
-                    }
-                )
-            )
-        else:
-            output.append(
-                '<tr><td class="cell1">'
-                '<a id="%(cnt)s" href="#%(cnt)s">%(cnt_lbl)s</a></td>'
-                % (
-                    {
-                        'cnt': '%s_%s' % (index, cnt),
-                        'cnt_lbl': cnt,
-                    }
-                )
-            )
+    img = flask.url_for('static', filename='users.png')
+    lines = loc.split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
 
-        cnt += 1
-        if not line:
-            output.append(line)
-            continue
+    cnt = 1
+    for line in lines:
         if line == '</pre></div>':
             continue
         if line.startswith('<div'):
-            line = line.split('<pre style="line-height: 125%">')[1]
-        output.append('<td class="cell2"><pre>%s</pre></td>' % line)
-        output.append('</tr>')
+            # Drop the opening of the container and of the <pre> block
+            line = line.split('<pre', 1)[1].split('>', 1)[1]
+        output.append(_format_row(cnt, index, line, commit, filename, img))
 
-        tpl_delete = '<button type="submit" name="drop_comment" ' \
-            'value="%(commentid)s"' \
-            'onclick="return confirm(\'Do you really want to remove' \
-            ' this comment?\');"' \
-            'title="Remove comment">' \
-            '<span class="icon icon-remove blue"></span>' \
-            '</button>'
-
-        if cnt - 1 in comments:
-            for comment in comments[cnt - 1]:
-
-                templ_delete = ''
-                if authenticated() and (
-                        (comment.parent.status is True
-                         and comment.user.user == flask.g.fas_user.username)
-                        or is_repo_admin(comment.parent.project)):
-                    templ_delete = tpl_delete % ({'commentid': comment.id})
-
-                output.append(
-                    '<tr><td></td>'
-                    '<td colspan="2"><table style="width:100%%"><tr>'
-                    '<td><a href="%(url)s">%(user)s</a></td>'
-                    '<td class="right">'
-                    '%(date)s%(templ_delete)s'
-                    '</td>'
-                    '</tr>'
-                    '<tr><td colspan="2" class="pr_comment">%(comment)s'
-                    '</td></tr>'
-                    '</table></td></tr>' % (
-                        {
-                            'url': flask.url_for(
-                                'view_user', username=comment.user.user),
-                            'templ_delete': templ_delete,
-                            'user': comment.user.user,
-                            'date': comment.date_created.strftime(
-                                '%b %d %Y %H:%M:%S'),
-                            'comment': markdown_filter(comment.comment),
-                        }
-                    )
-                )
+        for comment in comments.get((commit, filename, cnt), []):
+            output.append(_format_comment(comment, repo_admin))
+        cnt += 1
 
     output.append('</table></div>')
 
     return '\n'.join(output)
 
 
+# Css class of the lines of a diff according to their origin, as set by
+# pygments' DiffLexer
+DIFF_LINE_CLASSES = {
+    '+': 'gi',
+    '-': 'gd',
+}
+
+
+# Origin of the lines noting the absence of new line at the end of a file
+DIFF_EOFNL_ORIGINS = ('=', '>', '<')
+
+
+def _get_hunk_line(line):
+    """ Return the origin and the content of the provided line of a hunk,
+    older pygit2 return them as a tuple.
+    """
+    if isinstance(line, tuple):
+        origin, content = line
+    else:
+        origin, content = line.origin, line.content
+    if isinstance(content, str):
+        content = content.decode('utf-8', 'replace')
+    return origin, content.strip('\n')
+
+
+@APP.template_filter('diff_to_html')
+def diff_to_html(patch, commit=None, prequest=None, index=None):
+    """ Template filter rendering the provided patch into a table, with
+    one row per line of the diff and the inline comments of the
+    pull-request, if any, below the line they are about.
+    """
+    if patch is None:
+        return
+
+    filename = patch.new_file_path
+    comments = {}
+    repo_admin = False
+    if prequest and not isinstance(prequest, flask.wrappers.Request):
+        comments = _get_inline_comments(prequest)
+        repo_admin = is_repo_admin(prequest.project)
+
+    if not index:
+        index = ''
+
+    img = flask.url_for('static', filename='users.png')
+    output = [
+        '<div class="highlight">',
+        '<table class="code_table">'
+    ]
+
+    cnt = 1
+    for hunk in patch.hunks:
+        lines = [
+            '<span class="gu">@@ -%i,%i +%i,%i @@</span>' % (
+                hunk.old_start, hunk.old_lines,
+                hunk.new_start, hunk.new_lines)
+        ]
+        for line in hunk.lines:
+            origin, content = _get_hunk_line(line)
+            if origin in DIFF_EOFNL_ORIGINS:
+                content = flask.escape(content)
+            else:
+                content = flask.escape(u'%s %s' % (origin, content))
+            if origin in DIFF_LINE_CLASSES:
+                content = u'<span class="%s">%s</span>' % (
+                    DIFF_LINE_CLASSES[origin], content)
+            lines.append(content)
+
+        for line in lines:
+            output.append(
+                _format_row(cnt, index, line, commit, filename, img))
+            for comment in comments.get((commit, filename, cnt), []):
+                output.append(_format_comment(comment, repo_admin))
+            cnt += 1
+
+    output.append('</table></div>')
+
+    return u'\n'.join(output)
+
+
 @APP.template_filter('wraps')
 def text_wraps(text, size=10):
     """ Template filter to wrap text at a specified size
@@ -229,32 +326,6 @@ def markdown_filter(text):
     return ''
 
 
-@APP.template_filter('html_diff')
-def html_diff(diff):
-    """Display diff as HTML"""
-    if diff is None:
-        return
-    return highlight(
-        diff,
-        DiffLexer(),
-        HtmlFormatter(
-            noclasses=True,
-            style="tango",)
-    )
-
-
-@APP.template_filter('patch_to_diff')
-def patch_to_diff(patch):
-    """Render a hunk as a diff"""
-    content = ""
-    for hunk in patch.hunks:
-        content = content + "@@ -%i,%i +%i,%i @@\n" % (
-            hunk.old_start, hunk.old_lines, hunk.new_start, hunk.new_lines)
-        for line in hunk.lines:
-            content = content + ' '.join(line)
-    return content
-
-
 @APP.template_filter('author2user')
 def author_to_user(author, size=16):
     """ Template filter transforming a pygit2 Author object into a text
@@ -20,6 +20,7 @@ import pagure.exceptions
 import pagure.lib
 import pagure.lib.git
 import pagure.forms
+from pagure.hooks import BaseHook
 from pagure import (APP, SESSION, LOG, cla_required,
                     is_repo_admin, generate_gitolite_acls)
 
@@ -126,13 +127,12 @@ def request_pull(repo, requestid, username=None):
 
     repo_from = request.project_from
     repopath = pagure.get_repo_path(repo_from)
-    repo_obj = pygit2.Repository(repopath)
+    repo_obj = pagure.lib.git.get_repo_obj(repopath)
 
     parentpath = _get_parent_repo_path(repo_from)
-    orig_repo = pygit2.Repository(parentpath)
+    orig_repo = pagure.lib.git.get_repo_obj(parentpath)
 
     diff_commits = []
-    diff = None
     # Closed pull-request
     if request.status != 'Open':
         commitid = request.commit_stop
@@ -140,17 +140,12 @@ def request_pull(repo, requestid, username=None):
             diff_commits.append(commit)
             if commit.oid.hex == request.commit_start:
                 break
-
-        if diff_commits:
-            diff = repo_obj.diff(
-                repo_obj.revparse_single(diff_commits[-1].parents[0].oid.hex),
-                repo_obj.revparse_single(diff_commits[0].oid.hex)
-            )
     else:
         try:
-            diff_commits, diff = pagure.lib.git.diff_pull_request(
+            diff_commits = pagure.lib.git.diff_pull_request(
                 SESSION, request, repo_obj, orig_repo,
-                requestfolder=APP.config['REQUESTS_FOLDER'])
+                requestfolder=APP.config['REQUESTS_FOLDER'],
+                with_diff=False)[0]
         except pagure.exceptions.PagureException as err:
             flask.flash(err.message, 'error')
             return flask.redirect(flask.url_for(
@@ -162,6 +157,15 @@ def request_pull(repo, requestid, username=None):
                 'Could not update this pull-request in the database',
                 'error')
 
+    diff = None
+    diff_too_large = False
+    diff_range = pagure.lib.git.get_diff_range(diff_commits)
+    if diff_range:
+        try:
+            diff = pagure.lib.git.get_diff_files(repo_obj, diff_range)
+        except pagure.exceptions.DiffTooLargeException:
+            diff_too_large = True
+
     form = pagure.forms.ConfirmationForm()
 
     return flask.render_template(
@@ -174,6 +178,9 @@ def request_pull(repo, requestid, username=None):
         repo_admin=is_repo_admin(request.project),
         diff_commits=diff_commits,
         diff=diff,
+        diff_project=repo_from,
+        diff_range=diff_range,
+        diff_too_large=diff_too_large,
         mergeform=form,
     )
 
@@ -200,10 +207,10 @@ def request_pull_patch(repo, requestid, username=None):
 
     repo_from = request.project_from
     repopath = pagure.get_repo_path(repo_from)
-    repo_obj = pygit2.Repository(repopath)
+    repo_obj = pagure.lib.git.get_repo_obj(repopath)
 
     parentpath = _get_parent_repo_path(repo_from)
-    orig_repo = pygit2.Repository(parentpath)
+    orig_repo = pagure.lib.git.get_repo_obj(parentpath)
 
     branch = repo_obj.lookup_branch(request.branch_from)
     commitid = None
@@ -581,6 +588,10 @@ def fork_project(repo, username=None):
             user=flask.g.fas_user.username)
 
         SESSION.commit()
+        fork = pagure.lib.get_project(
+            SESSION, repo.name, user=flask.g.fas_user.username)
+        BaseHook.set_up(fork)
+        pagure.lib.git.get_fork_divergence(SESSION, fork)
         generate_gitolite_acls()
         flask.flash(message)
         return flask.redirect(
@@ -622,10 +633,10 @@ def new_request_pull(repo, branch_to, branch_from, username=None):
         flask.abort(404, 'No pull-requests found for this project')
 
     repopath = pagure.get_repo_path(repo)
-    repo_obj = pygit2.Repository(repopath)
+    repo_obj = pagure.lib.git.get_repo_obj(repopath)
 
     parentpath = _get_parent_repo_path(repo)
-    orig_repo = pygit2.Repository(parentpath)
+    orig_repo = pagure.lib.git.get_repo_obj(parentpath)
 
     frombranch = repo_obj.lookup_branch(branch_from)
     if not frombranch and not repo_obj.is_empty:
@@ -645,35 +656,16 @@ def new_request_pull(repo, branch_to, branch_from, username=None):
         commitid = branch.get_object().hex
 
     diff_commits = []
-    diff = None
     if not repo_obj.is_empty and not orig_repo.is_empty:
         orig_commit = orig_repo[
             orig_repo.lookup_branch(branch_to).get_object().hex]
 
-        master_commits = [
-            commit.oid.hex
-            for commit in orig_repo.walk(
-                orig_commit.oid.hex, pygit2.GIT_SORT_TIME)
-        ]
-
-        repo_commit = repo_obj[commitid]
-
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit)
-
-        if diff_commits:
-            first_commit = repo_obj[diff_commits[-1].oid.hex]
-            diff = repo_obj.diff(
-                repo_obj.revparse_single(first_commit.parents[0].oid.hex),
-                repo_obj.revparse_single(diff_commits[0].oid.hex)
-            )
+        diff_commits = list(pagure.lib.git.get_diff_commits(
+            repo_obj, commitid, base=orig_commit.oid, orig_repo=orig_repo))
 
     elif orig_repo.is_empty and not repo_obj.is_empty:
         orig_commit = None
-        if 'master' in repo_obj.listall_branches():
+        if 'master' in pagure.lib.git.get_branch_index(repo_obj):
             repo_commit = repo_obj[repo_obj.head.target]
         else:
             branch = repo_obj.lookup_branch(branch_from)
@@ -682,8 +674,6 @@ def new_request_pull(repo, branch_to, branch_from, username=None):
         for commit in repo_obj.walk(
                 repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
             diff_commits.append(commit)
-
-        diff = repo_commit.tree.diff_to_tree(swap=True)
     else:
         flask.flash(
             'Fork is empty, there are no commits to request pulling',
@@ -691,6 +681,15 @@ def new_request_pull(repo, branch_to, branch_from, username=None):
         return flask.redirect(flask.url_for(
             'view_repo', username=username, repo=repo.name))
 
+    diff = None
+    diff_too_large = False
+    diff_range = pagure.lib.git.get_diff_range(diff_commits)
+    if diff_range:
+        try:
+            diff = pagure.lib.git.get_diff_files(repo_obj, diff_range)
+        except pagure.exceptions.DiffTooLargeException:
+            diff_too_large = True
+
     repo_admin=is_repo_admin(repo)
 
     form = pagure.forms.RequestPullForm()
@@ -762,8 +761,11 @@ def new_request_pull(repo, branch_to, branch_from, username=None):
         orig_repo=orig_repo,
         diff_commits=diff_commits,
         diff=diff,
+        diff_project=repo,
+        diff_range=diff_range,
+        diff_too_large=diff_too_large,
         form=form,
-        branches=sorted(orig_repo.listall_branches()),
+        branches=pagure.lib.git.get_branch_index(orig_repo).names(),
         branch_to=branch_to,
         branch_from=branch_from,
         repo_admin=repo_admin,
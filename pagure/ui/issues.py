@@ -14,12 +14,9 @@ import os
 import pygit2
 from sqlalchemy.exc import SQLAlchemyError
 
-import chardet
-import kitchen.text.converters as ktc
-import mimetypes
-
 import pagure.doc_utils
 import pagure.lib
+import pagure.lib.git
 import pagure.forms
 from pagure import (APP, SESSION, LOG, __get_file_in_tree, cla_required,
                     is_repo_admin, authenticated)
@@ -412,6 +409,7 @@ def new_issue(repo, username=None):
             filestream = flask.request.files.get('filestream')
             if filestream and '<!!image>' in issue.content:
                 new_filename = pagure.lib.git.add_file_to_git(
+                    session=SESSION,
                     repo=repo,
                     issue=issue,
                     ticketfolder=APP.config['TICKETS_FOLDER'],
@@ -642,6 +640,7 @@ def upload_issue(repo, issueid, username=None):
     if form.validate_on_submit():
         filestream = flask.request.files['filestream']
         new_filename = pagure.lib.git.add_file_to_git(
+            session=SESSION,
             repo=repo,
             issue=issue,
             ticketfolder=APP.config['TICKETS_FOLDER'],
@@ -679,7 +678,7 @@ def view_issue_raw_file(repo, filename=None, username=None):
 
     reponame = os.path.join(APP.config['TICKETS_FOLDER'], repo.path)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     if repo_obj.is_empty:
         flask.abort(404, 'Empty repo cannot have a file')
@@ -687,34 +686,9 @@ def view_issue_raw_file(repo, filename=None, username=None):
     branch = repo_obj.lookup_branch('master')
     commit = branch.get_object()
 
-    mimetype = None
-    encoding = None
-
     content = __get_file_in_tree(
         repo_obj, commit.tree, filename.split('/'))
     if not content or isinstance(content, pygit2.Tree):
         flask.abort(404, 'File not found')
 
-    mimetype, encoding = mimetypes.guess_type(filename)
-    data = repo_obj[content.oid].data
-
-    if not data:
-        flask.abort(404, 'No content found')
-
-    if not mimetype and data[:2] == '#!':
-        mimetype = 'text/plain'
-
-    if not mimetype:
-        if '\0' in data:
-            mimetype = 'application/octet-stream'
-        else:
-            mimetype = 'text/plain'
-
-    if mimetype.startswith('text/') and not encoding:
-        encoding = chardet.detect(ktc.to_bytes(data))['encoding']
-
-    headers = {'Content-Type': mimetype}
-    if encoding:
-        headers['Content-Encoding'] = encoding
-
-    return (data, 200, headers)
+    return pagure.send_blob(repo_obj, content.oid, filename)
@@ -20,18 +20,19 @@ import werkzeug
 
 from cStringIO import StringIO
 from PIL import Image
+import pygments
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
-from pygments.lexers import guess_lexer_for_filename
+from pygments.lexers import get_lexer_for_filename, guess_lexer
 from pygments.lexers.special import TextLexer
 from pygments.util import ClassNotFound
 from sqlalchemy.exc import SQLAlchemyError
 
-import mimetypes
 import chardet
 
 import pagure.exceptions
 import pagure.lib
+import pagure.lib.cache
 import pagure.lib.git
 import pagure.forms
 import pagure
@@ -56,7 +57,7 @@ def view_repo(repo, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     cnt = 0
     last_commits = []
@@ -85,38 +86,28 @@ def view_repo(repo, username=None):
                     'view_raw_file', username=username,
                     repo=repo.name, identifier='master', filename=''))
 
+    # Only a fork can have commits that are not in the main repo, the
+    # divergence stored by the git hook tells us if there are any
     diff_commits = []
+    divergence = None
     if repo.is_fork:
-        parentname = os.path.join(
-            APP.config['GIT_FOLDER'], repo.parent.path)
-        if repo.parent.is_fork:
-            parentname = os.path.join(
-                APP.config['FORK_FOLDER'], repo.parent.path)
-    else:
-        parentname = os.path.join(APP.config['GIT_FOLDER'], repo.path)
-
-    orig_repo = pygit2.Repository(parentname)
-
-    if not repo_obj.is_empty and not orig_repo.is_empty:
-
-        orig_branch = orig_repo.lookup_branch('master')
-        branch = repo_obj.lookup_branch('master')
-        if orig_branch and branch:
-
-            master_commits = [
+        divergence = pagure.lib.git.get_fork_divergence(SESSION, repo)
+    if divergence and divergence.ahead and last_commits:
+        orig_repo = pagure.lib.git.get_repo_obj(
+            pagure.get_repo_path(repo.parent))
+        # The branches may have been rewritten since it was stored
+        if divergence.fork_head in repo_obj \
+                and divergence.parent_head in orig_repo:
+            diff_commits = [
                 commit.oid.hex
-                for commit in orig_repo.walk(
-                    orig_branch.get_object().hex,
-                    pygit2.GIT_SORT_TIME)
+                for commit in pagure.lib.git.get_diff_commits(
+                    repo_obj, divergence.fork_head,
+                    base=divergence.parent_head,
+                    orig_repo=orig_repo,
+                    limit=len(last_commits))
             ]
 
-            repo_commit = repo_obj[branch.get_object().hex]
-
-            for commit in repo_obj.walk(
-                    repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-                if commit.oid.hex in master_commits:
-                    break
-                diff_commits.append(commit.oid.hex)
+    branches = pagure.lib.git.get_branch_index(repo_obj)
 
     return flask.render_template(
         'repo_info.html',
@@ -126,7 +117,8 @@ def view_repo(repo, username=None):
         username=username,
         readme=readme,
         safe=safe,
-        branches=sorted(repo_obj.listall_branches()),
+        branches=branches.names()[:APP.config['ITEM_PER_PAGE']],
+        total_branches=len(branches),
         branchname='master',
         last_commits=last_commits,
         tree=tree,
@@ -147,9 +139,9 @@ def view_repo_branch(repo, branchname, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
-    if branchname not in repo_obj.listall_branches():
+    if branchname not in pagure.lib.git.get_branch_index(repo_obj):
         flask.abort(404, 'Branch no found')
 
     branch = repo_obj.lookup_branch(branchname)
@@ -172,35 +164,31 @@ def view_repo_branch(repo, branchname, username=None):
     else:
         parentname = os.path.join(APP.config['GIT_FOLDER'], repo.path)
 
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = pagure.lib.git.get_repo_obj(parentname)
 
     if not repo_obj.is_empty and not orig_repo.is_empty:
 
         master_branch = orig_repo.lookup_branch('master')
-        master_commits = []
-
+        base = None
         if master_branch:
-            master_commits = [
-                commit.oid.hex
-                for commit in orig_repo.walk(
-                    master_branch.get_object().hex,
-                    pygit2.GIT_SORT_TIME)
-            ]
+            base = master_branch.get_object().oid
 
-        repo_commit = repo_obj[branch.get_object().hex]
+        diff_commits = [
+            commit.oid.hex
+            for commit in pagure.lib.git.get_diff_commits(
+                repo_obj, branch.get_object().oid, base=base,
+                orig_repo=orig_repo)
+        ]
 
-        for commit in repo_obj.walk(
-                repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-            if commit.oid.hex in master_commits:
-                break
-            diff_commits.append(commit.oid.hex)
+    branches = pagure.lib.git.get_branch_index(repo_obj)
 
     return flask.render_template(
         'repo_info.html',
         select='overview',
         repo=repo,
         username=username,
-        branches=sorted(repo_obj.listall_branches()),
+        branches=branches.names()[:APP.config['ITEM_PER_PAGE']],
+        total_branches=len(branches),
         branchname=branchname,
         last_commits=last_commits,
         tree=sorted(last_commits[0].tree, key=lambda x: x.filemode),
@@ -209,6 +197,60 @@ def view_repo_branch(repo, branchname, username=None):
     )
 
 
+@APP.route('/<repo>/branches/')
+@APP.route('/<repo>/branches')
+@APP.route('/fork/<username>/<repo>/branches/')
+@APP.route('/fork/<username>/<repo>/branches')
+def view_branches(repo, username=None):
+    """ Presents the branches of the project, with how far they are from
+    the master branch.
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if not repo:
+        flask.abort(404, 'Project not found')
+
+    reponame = pagure.get_repo_path(repo)
+
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
+
+    pattern = flask.request.args.get('pattern', None)
+
+    try:
+        page = max(int(flask.request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    limit = APP.config['ITEM_PER_PAGE']
+    start = limit * (page - 1)
+
+    index = pagure.lib.git.get_branch_index(repo_obj)
+    branches = index.search(pattern)
+    total_page = int(ceil(len(branches) / float(limit)))
+    branches = branches[start:start + limit]
+
+    divergences = {}
+    master = index.get('master')
+    if master:
+        for branch in branches:
+            divergences[branch.name] = \
+                pagure.lib.git.get_branch_divergence(
+                    repo_obj, branch, master.commit)
+
+    return flask.render_template(
+        'branches.html',
+        select='overview',
+        repo=repo,
+        username=username,
+        branches=branches,
+        divergences=divergences,
+        pattern=pattern,
+        page=page,
+        total_page=total_page,
+        repo_admin=is_repo_admin(repo),
+    )
+
+
 @APP.route('/<repo>/commits/')
 @APP.route('/<repo>/commits')
 @APP.route('/<repo>/commits/<path:branchname>')
@@ -225,9 +267,10 @@ def view_commits(repo, branchname=None, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
-    if branchname and branchname not in repo_obj.listall_branches():
+    if branchname and \
+            branchname not in pagure.lib.git.get_branch_index(repo_obj):
         flask.abort(404, 'Branch no found')
 
     if branchname:
@@ -242,18 +285,19 @@ def view_commits(repo, branchname=None, username=None):
 
     limit = APP.config['ITEM_PER_PAGE']
     start = limit * (page - 1)
-    end = limit * page
 
     n_commits = 0
     last_commits = []
     if branch:
-        for commit in repo_obj.walk(
-                branch.get_object().hex, pygit2.GIT_SORT_TIME):
-            if n_commits >= start and n_commits <= end:
-                last_commits.append(commit)
-            n_commits += 1
+        n_commits, last_commits = pagure.lib.git.get_history_page(
+            SESSION, repo, repo_obj, branchname or 'master', offset=start,
+            limit=limit)
 
-    total_page = int(ceil(n_commits / float(limit)))
+    # The number of commits is not known until the branch is indexed,
+    # there is then a next page
+    total_page = None
+    if n_commits is not None:
+        total_page = int(ceil(n_commits / float(limit)))
 
     diff_commits = []
     if repo.is_fork:
@@ -265,33 +309,27 @@ def view_commits(repo, branchname=None, username=None):
     else:
         parentname = os.path.join(APP.config['GIT_FOLDER'], repo.path)
 
-    orig_repo = pygit2.Repository(parentname)
+    orig_repo = pagure.lib.git.get_repo_obj(parentname)
 
-    if not repo_obj.is_empty and not orig_repo.is_empty \
-            and repo_obj.listall_branches() > 1:
+    if not repo_obj.is_empty and not orig_repo.is_empty:
 
         master_branch = orig_repo.lookup_branch('master')
-        master_commits = []
-
+        base = None
         if master_branch:
-            master_commits = [
-                commit.oid.hex
-                for commit in orig_repo.walk(
-                    master_branch.get_object().hex,
-                    pygit2.GIT_SORT_TIME)
-            ]
+            base = master_branch.get_object().oid
 
         if branch:
-            repo_commit = repo_obj[branch.get_object().hex]
-
-            for commit in repo_obj.walk(
-                    repo_commit.oid.hex, pygit2.GIT_SORT_TIME):
-                if commit.oid.hex in master_commits:
-                    break
-                diff_commits.append(commit.oid.hex)
+            diff_commits = [
+                commit.oid.hex
+                for commit in pagure.lib.git.get_diff_commits(
+                    repo_obj, branch.get_object().oid, base=base,
+                    orig_repo=orig_repo)
+            ]
 
     origin = 'view_commits'
 
+    branches = pagure.lib.git.get_branch_index(repo_obj)
+
     return flask.render_template(
         'repo_info.html',
         select='logs',
@@ -299,7 +337,8 @@ def view_commits(repo, branchname=None, username=None):
         repo_obj=repo_obj,
         repo=repo,
         username=username,
-        branches=sorted(repo_obj.listall_branches()),
+        branches=branches.names()[:APP.config['ITEM_PER_PAGE']],
+        total_branches=len(branches),
         branchname=branchname,
         last_commits=last_commits,
         diff_commits=diff_commits,
@@ -309,6 +348,79 @@ def view_commits(repo, branchname=None, username=None):
     )
 
 
+# Files highlighted, keyed by blob, lexer and formatter options
+HIGHLIGHT_CACHE = pagure.lib.cache.get_cache(
+    'highlight', folder=APP.config['CACHE_FOLDER'],
+    size=APP.config['CACHE_SIZE'])
+
+# The files are highlighted using css classes, defined in pygments.css
+HIGHLIGHT_OPTIONS = {'cssclass': 'highlight'}
+
+# The blank lines at the beginning and the end of the files are kept so the
+# lines highlighted match the lines of the files
+LEXER_OPTIONS = {'stripnl': False}
+
+
+def _get_lexer(filename, data):
+    """ Return the lexer to use to highlight the provided file.
+
+    The lexer is found using the name of the file, the content is only
+    looked at for scripts that do not have a known extension.
+    """
+    try:
+        return get_lexer_for_filename(filename, **LEXER_OPTIONS)
+    except ClassNotFound:
+        pass
+
+    if data.startswith('#!'):
+        try:
+            return guess_lexer(data.split('\n', 1)[0], **LEXER_OPTIONS)
+        except ClassNotFound:
+            pass
+
+    return TextLexer(**LEXER_OPTIONS)
+
+
+def _highlight_blob(blob, filename):
+    """ Return the provided blob highlighted as HTML. """
+    lexer = _get_lexer(filename, blob.data)
+    key = '%s:%s:%s:%s:%s' % (
+        blob.hex, lexer.name, sorted(LEXER_OPTIONS.items()),
+        sorted(HIGHLIGHT_OPTIONS.items()), pygments.__version__)
+
+    content = HIGHLIGHT_CACHE.get(key)
+    if content is None:
+        content = highlight(
+            blob.data, lexer, HtmlFormatter(**HIGHLIGHT_OPTIONS))
+        HIGHLIGHT_CACHE.set(key, content)
+    return content
+
+
+def _get_tree_page(repo_obj, commit, tree, path):
+    """ Return the entries of the provided tree shown in the current page,
+    the last commit which changed each of them, the page and the total
+    number of pages.
+    """
+    try:
+        page = max(int(flask.request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    limit = APP.config['TREE_ITEM_PER_PAGE']
+    start = limit * (page - 1)
+    total_page = int(ceil(len(tree) / float(limit)))
+
+    entries = sorted(tree, key=lambda x: x.filemode)[start:start + limit]
+    last_commits = pagure.lib.git.get_last_commits(
+        repo_obj, commit, path, [entry.name for entry in entries])
+    last_commits = dict(
+        (name, repo_obj[commitid])
+        for name, commitid in last_commits.items()
+    )
+
+    return (entries, last_commits, page, total_page)
+
+
 @APP.route('/<repo>/blob/<path:identifier>/f/<path:filename>')
 @APP.route('/fork/<username>/<repo>/blob/<path:identifier>/f/<path:filename>')
 def view_file(repo, identifier, filename, username=None):
@@ -321,12 +433,13 @@ def view_file(repo, identifier, filename, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     if repo_obj.is_empty:
         flask.abort(404, 'Empty repo cannot have a file')
 
-    if identifier in repo_obj.listall_branches():
+    branches = pagure.lib.git.get_branch_index(repo_obj)
+    if identifier in branches:
         branchname = identifier
         branch = repo_obj.lookup_branch(identifier)
         commit = branch.get_object()
@@ -335,12 +448,17 @@ def view_file(repo, identifier, filename, username=None):
             commit = repo_obj.get(identifier)
             branchname = identifier
         except ValueError:
-            if 'master' not in repo_obj.listall_branches():
+            if 'master' not in branches:
                 flask.abort(404, 'Branch no found')
             # If it's not a commit id then it's part of the filename
             commit = repo_obj[repo_obj.head.target]
             branchname = 'master'
 
+    if commit:
+        not_modified = pagure.cache_git_page(repo, commit.oid)
+        if not_modified:
+            return not_modified
+
     if commit and not isinstance(commit, pygit2.Blob):
         content = __get_file_in_tree(
             repo_obj, commit.tree, filename.split('/'))
@@ -350,6 +468,8 @@ def view_file(repo, identifier, filename, username=None):
     else:
         content = commit
 
+    last_commits = {}
+    page = total_page = None
     if isinstance(content, pygit2.Blob):
         if content.is_binary:
             ext = filename[filename.rfind('.'):]
@@ -367,24 +487,11 @@ def view_file(repo, identifier, filename, username=None):
             else:
                 output_type = 'binary'
         else:
-            try:
-                lexer = guess_lexer_for_filename(
-                    filename,
-                    content.data
-                )
-            except ClassNotFound:
-                lexer = TextLexer()
-
-            content = highlight(
-                content.data,
-                lexer,
-                HtmlFormatter(
-                    noclasses=True,
-                    style="tango",)
-            )
+            content = _highlight_blob(content, filename)
             output_type = 'file'
     else:
-        content = sorted(content, key=lambda x: x.filemode)
+        content, last_commits, page, total_page = _get_tree_page(
+            repo_obj, commit, content, filename)
         output_type = 'tree'
 
     return flask.render_template(
@@ -393,9 +500,13 @@ def view_file(repo, identifier, filename, username=None):
         repo=repo,
         username=username,
         branchname=branchname,
+        is_branch=branchname in branches,
         filename=filename,
         content=content,
         output_type=output_type,
+        last_commits=last_commits,
+        page=page,
+        total_page=total_page,
         repo_admin=is_repo_admin(repo),
     )
 
@@ -415,19 +526,22 @@ def view_raw_file(repo, identifier, filename=None, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     if repo_obj.is_empty:
         flask.abort(404, 'Empty repo cannot have a file')
 
-    if identifier in repo_obj.listall_branches():
+    immutable = False
+    branches = pagure.lib.git.get_branch_index(repo_obj)
+    if identifier in branches:
         branch = repo_obj.lookup_branch(identifier)
         commit = branch.get_object()
     else:
         try:
             commit = repo_obj.get(identifier)
+            immutable = pagure.is_commit_hash(identifier)
         except ValueError:
-            if 'master' not in repo_obj.listall_branches():
+            if 'master' not in branches:
                 flask.abort(404, 'Branch no found')
             # If it's not a commit id then it's part of the filename
             commit = repo_obj[repo_obj.head.target]
@@ -435,44 +549,42 @@ def view_raw_file(repo, identifier, filename=None, username=None):
     if not commit:
         flask.abort(400, 'Commit %s not found' % (identifier))
 
-    mimetype = None
-    encoding = None
     if filename:
         content = __get_file_in_tree(
             repo_obj, commit.tree, filename.split('/'))
         if not content or isinstance(content, pygit2.Tree):
             flask.abort(404, 'File not found')
 
-        mimetype, encoding = mimetypes.guess_type(filename)
-        data = repo_obj[content.oid].data
-    else:
-        if commit.parents:
-            diff = commit.tree.diff_to_tree()
+        return pagure.send_blob(
+            repo_obj, content.oid, filename, immutable=immutable)
 
-            try:
-                parent = repo_obj.revparse_single('%s^' % identifier)
-                diff = repo_obj.diff(parent, commit)
-            except (KeyError, ValueError):
-                flask.abort(404, 'Identifier not found')
-        else:
-            # First commit in the repo
-            diff = commit.tree.diff_to_tree(swap=True)
-        data = diff.patch
+    not_modified = pagure.cache_git_page(repo, commit.oid, immutable)
+    if not_modified:
+        return not_modified
+
+    if commit.parents:
+        diff = commit.tree.diff_to_tree()
+
+        try:
+            parent = repo_obj.revparse_single('%s^' % identifier)
+            diff = repo_obj.diff(parent, commit)
+        except (KeyError, ValueError):
+            flask.abort(404, 'Identifier not found')
+    else:
+        # First commit in the repo
+        diff = commit.tree.diff_to_tree(swap=True)
+    data = diff.patch
 
     if not data:
         flask.abort(404, 'No content found')
 
-    if not mimetype and data[:2] == '#!':
+    encoding = None
+    if '\0' in data[:pagure.RAW_SAMPLE_SIZE]:
+        mimetype = 'application/octet-stream'
+    else:
         mimetype = 'text/plain'
-
-    if not mimetype:
-        if '\0' in data:
-            mimetype = 'application/octet-stream'
-        else:
-            mimetype = 'text/plain'
-
-    if mimetype.startswith('text/') and not encoding:
-        encoding = chardet.detect(ktc.to_bytes(data))['encoding']
+        encoding = chardet.detect(
+            ktc.to_bytes(data[:pagure.RAW_SAMPLE_SIZE]))['encoding']
 
     headers = {'Content-Type': mimetype}
     if encoding:
@@ -481,6 +593,220 @@ def view_raw_file(repo, identifier, filename=None, username=None):
     return (data, 200, headers)
 
 
+def _iter_blame_rows(repo_obj, commit, filename, content):
+    """ Yield the rows of the blame of a file, as tuples (commit, line
+    number, line) where the commit is only given on the first line of each
+    hunk.
+
+    The blame is computed, and the file highlighted, once the first row is
+    asked for so the top of the page is sent beforehand. libgit2 only
+    returns a blame once it is complete, so no row is sent before then.
+    """
+    blame = pagure.lib.git.get_blame(repo_obj, commit, filename)
+
+    lines = _highlight_blob(content, filename).split('\n')
+    if lines and lines[0].startswith('<div'):
+        # Drop the opening of the container and of the <pre> block
+        lines[0] = lines[0].split('<pre', 1)[1].split('>', 1)[1]
+
+    cnt = 0
+    for commitid, count in blame:
+        commit = repo_obj[commitid]
+        for idx in range(count):
+            line = lines[cnt] if cnt < len(lines) else ''
+            cnt += 1
+            yield (commit if idx == 0 else None, cnt, line)
+
+
+@APP.route('/<repo>/blame/<path:identifier>/f/<path:filename>')
+@APP.route('/fork/<username>/<repo>/blame/<path:identifier>/f/<path:filename>')
+def view_blame_file(repo, identifier, filename, username=None):
+    """ Displays the blame of a file for the specified repo.
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if not repo:
+        flask.abort(404, 'Project not found')
+
+    reponame = pagure.get_repo_path(repo)
+
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
+
+    if repo_obj.is_empty:
+        flask.abort(404, 'Empty repo cannot have a file')
+
+    if identifier in pagure.lib.git.get_branch_index(repo_obj):
+        branchname = identifier
+        branch = repo_obj.lookup_branch(identifier)
+        commit = branch.get_object()
+    else:
+        try:
+            commit = repo_obj.get(identifier)
+            branchname = identifier
+        except ValueError:
+            commit = None
+
+    if not isinstance(commit, pygit2.Commit):
+        flask.abort(404, 'Commit %s not found' % identifier)
+
+    not_modified = pagure.cache_git_page(repo, commit.oid)
+    if not_modified:
+        return not_modified
+
+    content = __get_file_in_tree(repo_obj, commit.tree, filename.split('/'))
+    if not content or isinstance(content, pygit2.Tree):
+        flask.abort(404, 'File not found')
+    if content.is_binary:
+        flask.abort(400, 'Binary files cannot be blamed')
+
+    return pagure.stream_template(
+        'blame.html',
+        select='tree',
+        repo=repo,
+        username=username,
+        branchname=branchname,
+        filename=filename,
+        rows=_iter_blame_rows(repo_obj, commit, filename, content),
+        repo_admin=is_repo_admin(repo),
+    )
+
+
+@APP.route('/<repo>/history/<path:branchname>/f/<path:filename>')
+@APP.route(
+    '/fork/<username>/<repo>/history/<path:branchname>/f/<path:filename>')
+def view_history(repo, branchname, filename, username=None):
+    """ Displays the commits of the specified branch changing the specified
+    file or folder.
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if not repo:
+        flask.abort(404, 'Project not found')
+
+    reponame = pagure.get_repo_path(repo)
+
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
+
+    if branchname not in pagure.lib.git.get_branch_index(repo_obj):
+        flask.abort(404, 'Branch no found')
+
+    try:
+        page = max(int(flask.request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    limit = APP.config['ITEM_PER_PAGE']
+    start = limit * (page - 1)
+
+    filename = filename.strip('/')
+    n_commits, commits = pagure.lib.git.get_path_summaries(
+        SESSION, repo, repo_obj, branchname, filename,
+        offset=start, limit=limit)
+
+    if n_commits == 0:
+        flask.abort(404, 'File not found')
+
+    # The number of commits is not known until the branch is indexed,
+    # there is then a next page
+    total_page = None
+    if n_commits is not None:
+        total_page = int(ceil(n_commits / float(limit)))
+
+    return flask.render_template(
+        'history.html',
+        select='tree',
+        repo=repo,
+        username=username,
+        branchname=branchname,
+        filename=filename,
+        commits=commits,
+        page=page,
+        total_page=total_page,
+        repo_admin=is_repo_admin(repo),
+    )
+
+
+def _stream_archive(repo_obj, tree, prefix, archive_format):
+    """ Yield the content of the archive of the given tree while it is
+    generated.
+    """
+    try:
+        for chunk in pagure.lib.git.generate_archive(
+                repo_obj, tree, prefix, archive_format):
+            yield chunk
+    except pagure.exceptions.PagureException as err:
+        # The download has started already and is left incomplete
+        APP.logger.exception(err)
+
+
+@APP.route('/<repo>/archive/<path:ref>.tar.gz',
+           defaults={'archive_format': 'tar.gz'})
+@APP.route('/<repo>/archive/<path:ref>.zip',
+           defaults={'archive_format': 'zip'})
+@APP.route('/fork/<username>/<repo>/archive/<path:ref>.tar.gz',
+           defaults={'archive_format': 'tar.gz'})
+@APP.route('/fork/<username>/<repo>/archive/<path:ref>.zip',
+           defaults={'archive_format': 'zip'})
+def view_archive(repo, ref, archive_format, username=None):
+    """ Sends the archive of the tree of the specified repo at the given
+    branch, tag or commit.
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if not repo:
+        flask.abort(404, 'Project not found')
+
+    reponame = pagure.get_repo_path(repo)
+
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
+
+    if repo_obj.is_empty:
+        flask.abort(404, 'Empty repo cannot be archived')
+
+    try:
+        commit = repo_obj.revparse_single(ref)
+    except (KeyError, ValueError):
+        flask.abort(404, 'Reference %s not found' % ref)
+
+    if isinstance(commit, pygit2.Tag):
+        commit = repo_obj[commit.target]
+    if not isinstance(commit, pygit2.Commit):
+        flask.abort(404, 'Reference %s not found' % ref)
+
+    immutable = pagure.is_commit_hash(ref)
+    prefix = werkzeug.secure_filename('%s-%s' % (repo.name, ref))
+    filename = '%s.%s' % (prefix, archive_format)
+
+    etag = '%s-%s' % (commit.tree.hex, filename)
+    cache_control = pagure._cache_control(immutable, public=True)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    mimetype = pagure.lib.git.ARCHIVE_FORMATS[archive_format]
+    path = pagure.lib.git.get_archive(commit.tree, prefix, archive_format)
+    if path:
+        response = flask.send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            attachment_filename=filename,
+            add_etags=False,
+        )
+    else:
+        # Sent while it is generated
+        response = flask.Response(
+            _stream_archive(repo_obj, commit.tree, prefix, archive_format),
+            mimetype=mimetype)
+        response.headers.add(
+            'Content-Disposition', 'attachment', filename=filename)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
 @APP.route('/<repo>/<commitid>/')
 @APP.route('/<repo>/<commitid>')
 @APP.route('/fork/<username>/<repo>/<commitid>/')
@@ -495,7 +821,7 @@ def view_commit(repo, commitid, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     try:
         commit = repo_obj.get(commitid)
@@ -505,14 +831,18 @@ def view_commit(repo, commitid, username=None):
     if commit is None:
         flask.abort(404, 'Commit not found')
 
-    if commit.parents:
-        diff = commit.tree.diff_to_tree()
+    not_modified = pagure.cache_git_page(repo, commit.oid)
+    if not_modified:
+        return not_modified
 
-        parent = repo_obj.revparse_single('%s^' % commitid)
-        diff = repo_obj.diff(parent, commit)
-    else:
-        # First commit in the repo
-        diff = commit.tree.diff_to_tree(swap=True)
+    diff = None
+    diff_too_large = False
+    try:
+        diff = pagure.lib.git.get_diff_files(repo_obj, commit.oid.hex)
+    except pagure.exceptions.DiffTooLargeException:
+        diff_too_large = True
+    except pagure.exceptions.PagureException:
+        flask.abort(404, 'Commit not found')
 
     return flask.render_template(
         'commit.html',
@@ -522,6 +852,7 @@ def view_commit(repo, commitid, username=None):
         commitid=commitid,
         commit=commit,
         diff=diff,
+        diff_too_large=diff_too_large,
     )
 
 
@@ -537,7 +868,7 @@ def view_commit_patch(repo, commitid, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     try:
         commit = repo_obj.get(commitid)
@@ -547,11 +878,63 @@ def view_commit_patch(repo, commitid, username=None):
     if commit is None:
         flask.abort(404, 'Commit not found')
 
+    not_modified = pagure.cache_git_page(
+        repo, commit.oid, pagure.is_commit_hash(commitid))
+    if not_modified:
+        return not_modified
+
     patch = pagure.lib.git.commit_to_patch(repo_obj, commit)
 
     return flask.Response(patch, content_type="text/plain;charset=UTF-8")
 
 
+@APP.route('/<repo>/diff/<path:identifier>/f/<path:filename>')
+@APP.route('/fork/<username>/<repo>/diff/<path:identifier>/f/<path:filename>')
+def view_diff_file(repo, identifier, filename, username=None):
+    """ Render the diff of a single file of a commit or of a range of
+    commits (<base>..<head>).
+    """
+    repo = pagure.lib.get_project(SESSION, repo, user=username)
+
+    if not repo:
+        flask.abort(404, 'Project not found')
+
+    reponame = pagure.get_repo_path(repo)
+
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
+
+    try:
+        diff = pagure.lib.git.get_diff_files(repo_obj, identifier)
+    except pagure.exceptions.DiffTooLargeException as err:
+        return flask.render_template('diff_file.html', error=err.message)
+    except pagure.exceptions.PagureException:
+        flask.abort(404, 'Commit not found')
+
+    request = None
+    requestid = flask.request.args.get('requestid', None)
+    if requestid:
+        request = pagure.lib.get_request_by_uid(SESSION, requestid)
+        if not request or repo.id not in (
+                request.project_id, request.project_id_from):
+            flask.abort(404, 'Pull-request not found')
+
+    try:
+        index = int(flask.request.args.get('index', 0))
+    except ValueError:
+        index = 0
+
+    patch = pagure.lib.git.get_diff_file(diff, filename, index=index)
+    if patch is None:
+        flask.abort(404, 'File not found')
+
+    return flask.render_template(
+        'diff_file.html',
+        patch=patch,
+        index=index,
+        pull_request=request,
+    )
+
+
 @APP.route('/<repo>/tree/')
 @APP.route('/<repo>/tree')
 @APP.route('/<repo>/tree/<path:identifier>')
@@ -568,14 +951,17 @@ def view_tree(repo, identifier=None, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     branchname = None
     content = None
     output_type = None
     commit = None
+    last_commits = {}
+    page = total_page = None
     if not repo_obj.is_empty:
-        if identifier in repo_obj.listall_branches():
+        branches = pagure.lib.git.get_branch_index(repo_obj)
+        if identifier in branches:
             branchname = identifier
             branch = repo_obj.lookup_branch(identifier)
             commit = branch.get_object()
@@ -585,12 +971,16 @@ def view_tree(repo, identifier=None, username=None):
                 branchname = identifier
             except (ValueError, TypeError):
                 # If it's not a commit id then it's part of the filename
-                if 'master' in repo_obj.listall_branches():
+                if 'master' in branches:
                     commit = repo_obj[repo_obj.head.target]
                     branchname = 'master'
 
         if commit:
-            content = sorted(commit.tree, key=lambda x: x.filemode)
+            not_modified = pagure.cache_git_page(repo, commit.oid)
+            if not_modified:
+                return not_modified
+            content, last_commits, page, total_page = _get_tree_page(
+                repo_obj, commit, commit.tree, '')
         output_type = 'tree'
 
     return flask.render_template(
@@ -603,6 +993,9 @@ def view_tree(repo, identifier=None, username=None):
         filename='',
         content=content,
         output_type=output_type,
+        last_commits=last_commits,
+        page=page,
+        total_page=total_page,
     )
 
 
@@ -618,11 +1011,19 @@ def view_forks(repo, username=None):
     if not repo:
         flask.abort(404, 'Project not found')
 
+    # The divergence of the forks is kept up to date by the git hook, so
+    # the network is read from the database here, only the forks whose
+    # divergence was never stored have it computed
+    forks = pagure.lib.get_forks_network(SESSION, repo)
+    for fork in forks:
+        pagure.lib.git.get_fork_divergence(SESSION, fork)
+
     return flask.render_template(
         'forks.html',
         select='forks',
         username=username,
         repo=repo,
+        forks=forks,
     )
 
 
@@ -638,14 +1039,30 @@ def view_tags(repo, username=None):
     if not repo:
         flask.abort(404, 'Project not found')
 
-    tags = pagure.lib.git.get_git_tags_objects(repo)
+    sort = flask.request.args.get('sort', 'date')
+    if sort not in pagure.lib.git.TAGS_SORT:
+        sort = 'date'
+
+    try:
+        page = max(int(flask.request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    limit = APP.config['ITEM_PER_PAGE']
+    start = limit * (page - 1)
+
+    tags = pagure.lib.git.get_git_tags(repo, sort=sort)
+    total_page = int(ceil(len(tags) / float(limit)))
 
     return flask.render_template(
         'tags.html',
         select='tags',
         username=username,
         repo=repo,
-        tags=tags,
+        tags=tags[start:start + limit],
+        sort=sort,
+        page=page,
+        total_page=total_page,
         repo_admin=is_repo_admin(repo),
     )
 
@@ -1068,19 +1485,16 @@ def regenerate_git(repo, username=None):
     form = pagure.forms.ConfirmationForm()
     if form.validate_on_submit():
         if regenerate.lower() == 'requests':
-            for request in repo.requests:
-                pagure.lib.git.update_git(
-                    request, repo=repo,
-                    repofolder=APP.config['REQUESTS_FOLDER'])
+            pagure.lib.git.regenerate_git_repo(
+                SESSION, repo,
+                repofolder=APP.config['REQUESTS_FOLDER'],
+                objtype='pull-request')
             flask.flash('Requests git repo updated')
         elif regenerate.lower() == 'tickets':
-            for ticket in repo.issues:
-                # Do not store private issues in the git
-                if ticket.private:
-                    continue
-                pagure.lib.git.update_git(
-                    ticket, repo=repo,
-                    repofolder=APP.config['TICKETS_FOLDER'])
+            pagure.lib.git.regenerate_git_repo(
+                SESSION, repo,
+                repofolder=APP.config['TICKETS_FOLDER'],
+                objtype='ticket')
             flask.flash('Tickets git repo updated')
 
     return flask.redirect(
@@ -1214,13 +1628,13 @@ def edit_file(repo, branchname, filename, username=None):
 
     reponame = pagure.get_repo_path(repo)
 
-    repo_obj = pygit2.Repository(reponame)
+    repo_obj = pagure.lib.git.get_repo_obj(reponame)
 
     if repo_obj.is_empty:
         flask.abort(404, 'Empty repo cannot have a file')
 
     branch = None
-    if branchname in repo_obj.listall_branches():
+    if branchname in pagure.lib.git.get_branch_index(repo_obj):
         branch = repo_obj.lookup_branch(branchname)
         commit = branch.get_object()
     else:
@@ -1240,6 +1654,7 @@ def edit_file(repo, branchname, filename, username=None):
                 ),
                 user=flask.g.fas_user,
                 email=form.email.data,
+                parent=form.parent.data or None,
             )
             flask.flash('Changes committed')
             return flask.redirect(
@@ -1247,6 +1662,13 @@ def edit_file(repo, branchname, filename, username=None):
                     '.view_file', repo=repo.name, username=username,
                     identifier=branchname, filename=filename)
             )
+        except pagure.exceptions.BranchMovedException:
+            flask.flash(
+                'This file was changed on the branch while you were editing'
+                ' it, committing again will overwrite these changes',
+                'error')
+            form.parent.data = commit.oid.hex
+            data = form.content.data
         except pagure.exceptions.PagureException as err:  # pragma: no cover
             APP.logger.exception(err)
             flask.flash('Commit could not be done', 'error')
@@ -1259,6 +1681,7 @@ def edit_file(repo, branchname, filename, username=None):
         if content.is_binary:
             flask.abort(400, 'Cannot edit binary files')
         data = repo_obj[content.oid].data
+        form.parent.data = commit.oid.hex
     else:
         data = form.content.data
 
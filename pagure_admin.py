@@ -0,0 +1,265 @@
+#!/usr/bin/env python2
+
+"""
+ (c) 2015 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+Administrative tasks of pagure.
+
+"""
+
+# These two lines are needed to run on EL6
+__requires__ = ['SQLAlchemy >= 0.8', 'jinja2 >= 2.4']
+import pkg_resources
+
+import argparse
+import multiprocessing
+import sys
+
+import pagure
+import pagure.lib
+import pagure.lib.git
+from pagure.hooks import BaseHook
+from pagure.lib import model
+
+
+def do_flush_queue(args):
+    """ Commit all the updates waiting in the git queues. """
+    pagure.lib.git.flush_git_queues()
+
+
+def _init_worker():
+    """ Do not share the database connections of the parent process with
+    the workers.
+    """
+    pagure.SESSION.remove()
+    pagure.SESSION.bind.dispose()
+
+
+def _regenerate(args):
+    """ Regenerate the tickets and/or requests git repos of the project
+    specified, ran in a worker of the pool.
+    """
+    name, objtypes = args
+    username = None
+    if '/' in name:
+        username, name = name.split('/', 1)
+
+    try:
+        project = pagure.lib.get_project(pagure.SESSION, name, user=username)
+        if project is None:
+            return '%s: project not found' % name
+
+        for objtype in objtypes:
+            if objtype == 'ticket':
+                folder = pagure.APP.config['TICKETS_FOLDER']
+            else:
+                folder = pagure.APP.config['REQUESTS_FOLDER']
+            pagure.lib.git.regenerate_git_repo(
+                pagure.SESSION, project, folder, objtype=objtype)
+        return '%s: regenerated' % project.fullname
+    except Exception as err:
+        return '%s: failed - %s' % (name, err)
+    finally:
+        pagure.SESSION.remove()
+
+
+def do_regenerate(args):
+    """ Regenerate the tickets and/or requests git repos of the projects
+    specified (or of all the projects), in a pool of processes.
+    """
+    objtypes = []
+    if args.tickets:
+        objtypes.append('ticket')
+    if args.requests:
+        objtypes.append('pull-request')
+    if not objtypes:
+        objtypes = ['ticket', 'pull-request']
+
+    projects = args.projects
+    if not projects:
+        projects = [
+            project.fullname
+            for project in pagure.SESSION.query(model.Project).all()
+        ]
+        pagure.SESSION.remove()
+
+    pool = multiprocessing.Pool(args.processes, initializer=_init_worker)
+    try:
+        for output in pool.imap_unordered(
+                _regenerate, [(project, objtypes) for project in projects]):
+            print output
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _index_commits(name):
+    """ Bring the commit index of all the branches of the project specified,
+    and its commit path index, up to date, ran in a worker of the pool.
+    """
+    username = None
+    if '/' in name:
+        username, name = name.split('/', 1)
+
+    try:
+        project = pagure.lib.get_project(pagure.SESSION, name, user=username)
+        if project is None:
+            return '%s: project not found' % name
+
+        repo_obj = pagure.lib.git.get_repo_obj(
+            pagure.get_repo_path(project))
+        cnt = 0
+        for branch in pagure.lib.git.get_branch_index(repo_obj):
+            cnt += pagure.lib.git.update_commit_index(
+                pagure.SESSION, project, branch.name, repo_obj=repo_obj)
+        # The commits indexed before the commit path index existed
+        paths = pagure.lib.git.index_commit_paths(
+            pagure.SESSION, project, repo_obj=repo_obj)
+        return '%s: %s commits indexed, paths of %s commits indexed' % (
+            project.fullname, cnt, paths)
+    except Exception as err:
+        return '%s: failed - %s' % (name, err)
+    finally:
+        pagure.SESSION.remove()
+
+
+def do_index_commits(args):
+    """ Bring the commit indexes of the projects specified (or of all the
+    projects) up to date, in a pool of processes.
+    """
+    projects = args.projects
+    if not projects:
+        projects = [
+            project.fullname
+            for project in pagure.SESSION.query(model.Project).all()
+        ]
+        pagure.SESSION.remove()
+
+    pool = multiprocessing.Pool(args.processes, initializer=_init_worker)
+    try:
+        for output in pool.imap_unordered(_index_commits, projects):
+            print output
+    finally:
+        pool.close()
+        pool.join()
+
+
+def do_prune_archives(args):
+    """ Remove the archives used the least recently until they fit in
+    ARCHIVE_MAX_SIZE.
+    """
+    max_size = args.max_size
+    if max_size is None:
+        max_size = pagure.APP.config['ARCHIVE_MAX_SIZE']
+    cnt = pagure.lib.git.prune_archives(max_size)
+    print '%s archives removed' % cnt
+
+
+def do_set_up_hooks(args):
+    """ Install the git hooks every project has in the git repos of the
+    projects specified (or of all the projects), for the projects created
+    before these hooks existed.
+    """
+    projects = args.projects
+    if not projects:
+        projects = [
+            project.fullname
+            for project in pagure.SESSION.query(model.Project).all()
+        ]
+
+    for name in projects:
+        username = None
+        if '/' in name:
+            username, name = name.split('/', 1)
+        project = pagure.lib.get_project(pagure.SESSION, name, user=username)
+        if project is None:
+            print '%s: project not found' % name
+            continue
+        try:
+            BaseHook.set_up(project)
+            print '%s: hooks set up' % project.fullname
+        except Exception as err:
+            print '%s: failed - %s' % (project.fullname, err)
+    pagure.SESSION.remove()
+
+
+def parse_arguments():
+    """ Set-up the argument parsing. """
+    parser = argparse.ArgumentParser(
+        description='Administrative tasks of pagure')
+    subparsers = parser.add_subparsers(title='actions')
+
+    parser_flush = subparsers.add_parser(
+        'flush-queue',
+        help='Commit the updates waiting in the tickets and pull-requests '
+        'git queues (see GIT_QUEUE_FOLDER)')
+    parser_flush.set_defaults(func=do_flush_queue)
+
+    parser_regen = subparsers.add_parser(
+        'regenerate',
+        help='Regenerate the tickets and/or pull-requests git repos from '
+        'the database, one commit per repo')
+    parser_regen.add_argument(
+        'projects', nargs='*',
+        help='Projects to regenerate (<project> or <user>/<project> for '
+        'forks), defaults to all the projects')
+    parser_regen.add_argument(
+        '--tickets', action='store_true', default=False,
+        help='Regenerate the tickets git repos')
+    parser_regen.add_argument(
+        '--requests', action='store_true', default=False,
+        help='Regenerate the pull-requests git repos')
+    parser_regen.add_argument(
+        '--processes', type=int, default=multiprocessing.cpu_count(),
+        help='Number of projects to regenerate in parallel')
+    parser_regen.set_defaults(func=do_regenerate)
+
+    parser_index = subparsers.add_parser(
+        'index-commits',
+        help='Index the commits, and the paths they change, the git hook '
+        'did not index yet, for example the ones pushed before the indexes '
+        'existed')
+    parser_index.add_argument(
+        'projects', nargs='*',
+        help='Projects to index (<project> or <user>/<project> for '
+        'forks), defaults to all the projects')
+    parser_index.add_argument(
+        '--processes', type=int, default=multiprocessing.cpu_count(),
+        help='Number of projects to index in parallel')
+    parser_index.set_defaults(func=do_index_commits)
+
+    parser_prune = subparsers.add_parser(
+        'prune-archives',
+        help='Remove the archives of the repos used the least recently '
+        'until they fit in ARCHIVE_MAX_SIZE')
+    parser_prune.add_argument(
+        '--max-size', type=int, default=None,
+        help='Size in bytes to prune the archives to, defaults to '
+        'ARCHIVE_MAX_SIZE')
+    parser_prune.set_defaults(func=do_prune_archives)
+
+    parser_hooks = subparsers.add_parser(
+        'set-up-hooks',
+        help='Install the git hooks every project has, for the projects '
+        'created before they existed')
+    parser_hooks.add_argument(
+        'projects', nargs='*',
+        help='Projects to set up (<project> or <user>/<project> for '
+        'forks), defaults to all the projects')
+    parser_hooks.set_defaults(func=do_set_up_hooks)
+
+    return parser.parse_args()
+
+
+def main():
+    """ Main function. """
+    args = parse_arguments()
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,7 @@ import sys
 import os
 
 import json
+import pygit2
 from mock import patch
 
 sys.path.insert(0, os.path.join(os.path.dirname(
@@ -125,6 +126,47 @@ class PagureFlaskApiIssuetests(tests.Modeltests):
             {'message': 'Issue created'}
         )
 
+    def test_api_new_issue_w_file(self):
+        """ Test the api_new_issue method of the flask api with a file
+        attached. """
+        tests.create_projects(self.session)
+        tests.create_projects_git(
+            os.path.join(tests.HERE, 'tickets'), bare=True)
+        tests.create_tokens(self.session)
+        tests.create_acls(self.session)
+        tests.create_tokens_acl(self.session)
+        pagure.APP.config['TICKETS_FOLDER'] = os.path.join(
+            tests.HERE, 'tickets')
+
+        headers = {'Authorization': 'token aaabbbcccddd'}
+
+        with open(os.path.join(tests.HERE, 'placebo.png'), 'rb') as stream:
+            data = {
+                'title': 'test issue',
+                'issue_content': 'This issue needs attention\n<!!image>',
+                'status': 'Open',
+                'filestream': stream,
+            }
+            output = self.app.post(
+                '/api/0/test/new_issue', data=data, headers=headers)
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertDictEqual(data, {'message': 'Issue created'})
+
+        repo = pagure.lib.get_project(self.session, 'test')
+        issue = pagure.lib.search_issues(self.session, repo, issueid=1)
+        self.assertFalse('<!!image>' in issue.content)
+        self.assertTrue('/test/issue/raw/files/' in issue.content)
+        self.assertTrue('placebo.png' in issue.content)
+
+        # The file is in the tickets git repo
+        repo_obj = pygit2.Repository(
+            os.path.join(tests.HERE, 'tickets', 'test.git'))
+        files = repo_obj[repo_obj.head.target].tree['files']
+        self.assertEqual(
+            [entry.name.split('-', 1)[1] for entry in repo_obj[files.oid]],
+            ['placebo.png'])
+
     def test_api_view_issues(self):
         """ Test the api_view_issues method of the flask api. """
         self.test_api_new_issue()
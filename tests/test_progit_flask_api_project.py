@@ -99,9 +99,249 @@ class PagureFlaskApiProjecttests(tests.Modeltests):
         data = json.loads(output.data)
         self.assertDictEqual(
             data,
-            {'tags': ['0.0.1']}
+            {'tags': ['0.0.1'], 'total_tags': 1, 'page': 1, 'pages': 1}
         )
 
+        # Add a lightweight tag, dated by its commit
+        repo.create_reference('refs/tags/0.0.0', first_commit.oid)
+
+        output = self.app.get('/api/0/test/git/tags')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['tags'], ['0.0.0', '0.0.1'])
+        self.assertEqual(data['total_tags'], 2)
+
+        output = self.app.get('/api/0/test/git/tags?sort=version')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['tags'], ['0.0.1', '0.0.0'])
+
+        # Paginated
+        pagure.APP.config['ITEM_PER_PAGE'] = 1
+        try:
+            output = self.app.get('/api/0/test/git/tags?page=2')
+            self.assertEqual(output.status_code, 200)
+            data = json.loads(output.data)
+            self.assertDictEqual(
+                data,
+                {'tags': ['0.0.1'], 'total_tags': 2, 'page': 2, 'pages': 2}
+            )
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+        output = self.app.get('/api/0/test/git/tags?page=0')
+        self.assertEqual(output.status_code, 400)
+        output = self.app.get('/api/0/test/git/tags?sort=name')
+        self.assertEqual(output.status_code, 400)
+
+    def test_api_git_branches(self):
+        """ Test the api_git_branches method of the flask api. """
+        output = self.app.get('/api/0/test/git/branches')
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+
+        # Create a git repo to play with
+        gitrepo = os.path.join(tests.HERE, 'repos', 'test.git')
+        tests.add_content_git_repo(gitrepo)
+        repo = pygit2.Repository(gitrepo)
+        commit = repo.revparse_single('HEAD')
+        repo.create_branch('feature', commit)
+        repo.create_branch('fix/typo', commit)
+
+        output = self.app.get('/api/0/test/git/branches')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertDictEqual(
+            data,
+            {
+                'branches': ['feature', 'fix/typo', 'master'],
+                'total_branches': 3,
+                'page': 1,
+                'pages': 1,
+            }
+        )
+
+        output = self.app.get('/api/0/test/git/branches?pattern=f*')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(data['branches'], ['feature', 'fix/typo'])
+        self.assertEqual(data['total_branches'], 2)
+
+        # Paginated
+        pagure.APP.config['ITEM_PER_PAGE'] = 2
+        try:
+            output = self.app.get('/api/0/test/git/branches?page=2')
+            self.assertEqual(output.status_code, 200)
+            data = json.loads(output.data)
+            self.assertDictEqual(
+                data,
+                {
+                    'branches': ['master'],
+                    'total_branches': 3,
+                    'page': 2,
+                    'pages': 2,
+                }
+            )
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+        output = self.app.get('/api/0/test/git/branches?page=foo')
+        self.assertEqual(output.status_code, 400)
+
+    def test_api_git_commits(self):
+        """ Test the api_git_commits method of the flask api. """
+        output = self.app.get('/api/0/test/git/commits')
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+
+        # Create a git repo to play with
+        gitrepo = os.path.join(tests.HERE, 'repos', 'test.git')
+        tests.add_content_git_repo(gitrepo)
+        tests.add_commit_git_repo(gitrepo, ncommits=3)
+        repo = pygit2.Repository(gitrepo)
+        history = [
+            commit.oid.hex
+            for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TIME)]
+        self.assertEqual(len(history), 5)
+
+        output = self.app.get('/api/0/test/git/commits')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.mimetype, 'application/json')
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], history)
+        self.assertEqual(data['next_cursor'], None)
+        self.assertDictEqual(
+            data['commits'][0],
+            {
+                'hash': history[0],
+                'author': {
+                    'name': 'Alice Author',
+                    'email': 'alice@authors.tld',
+                },
+                'date': repo[history[0]].commit_time,
+                'summary': 'Add row 2 to sources file',
+                'parents': [history[1]],
+            }
+        )
+
+        # Paginated by cursor
+        output = self.app.get('/api/0/test/git/commits?ref=master&limit=2')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], history[:2])
+        self.assertEqual(data['next_cursor'], history[2])
+
+        output = self.app.get(
+            '/api/0/test/git/commits?limit=2&cursor=%s' % data['next_cursor'])
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], history[2:4])
+        self.assertEqual(data['next_cursor'], history[4])
+
+        # Only the commits changing the path
+        output = self.app.get('/api/0/test/git/commits?path=folder1/')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], [history[3]])
+
+        # From a given commit
+        output = self.app.get('/api/0/test/git/commits?ref=%s' % history[3])
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], history[3:])
+
+        output = self.app.get('/api/0/test/git/commits?ref=foo')
+        self.assertEqual(output.status_code, 400)
+        output = self.app.get('/api/0/test/git/commits?cursor=foo')
+        self.assertEqual(output.status_code, 400)
+        output = self.app.get('/api/0/test/git/commits?limit=0')
+        self.assertEqual(output.status_code, 400)
+
+    def test_api_git_history(self):
+        """ Test the api_git_history method of the flask api. """
+        output = self.app.get('/api/0/test/git/history?path=sources')
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+
+        # Create a git repo to play with
+        gitrepo = os.path.join(tests.HERE, 'repos', 'test.git')
+        tests.add_content_git_repo(gitrepo)
+        tests.add_commit_git_repo(gitrepo, ncommits=2)
+        repo = pygit2.Repository(gitrepo)
+        history = [
+            commit.oid.hex
+            for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TIME)]
+
+        # The index is only read, the git repo is walked until it is built
+        with patch('pagure.lib.git.update_commit_index') as update:
+            output = self.app.get('/api/0/test/git/history?path=sources')
+            self.assertFalse(update.called)
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']],
+            [history[0], history[1], history[3]])
+        self.assertEqual(data['total_commits'], 3)
+        self.assertDictEqual(
+            data['commits'][0],
+            {
+                'hash': history[0],
+                'author': {
+                    'name': 'Alice Author',
+                    'email': 'alice@authors.tld',
+                },
+                'date': repo[history[0]].commit_time,
+                'summary': 'Add row 1 to sources file',
+            }
+        )
+
+        output = self.app.get(
+            '/api/0/test/git/history?path=folder1/folder2&branch=master')
+        self.assertEqual(output.status_code, 200)
+        data = json.loads(output.data)
+        self.assertEqual(
+            [commit['hash'] for commit in data['commits']], [history[2]])
+
+        # Paginated
+        pagure.APP.config['ITEM_PER_PAGE'] = 2
+        try:
+            # The number of commits is unknown until the last page
+            output = self.app.get('/api/0/test/git/history?path=sources')
+            self.assertEqual(output.status_code, 200)
+            data = json.loads(output.data)
+            self.assertEqual(
+                [commit['hash'] for commit in data['commits']],
+                [history[0], history[1]])
+            self.assertEqual(data['total_commits'], None)
+            self.assertEqual(data['pages'], None)
+
+            output = self.app.get(
+                '/api/0/test/git/history?path=sources&page=2')
+            self.assertEqual(output.status_code, 200)
+            data = json.loads(output.data)
+            self.assertEqual(
+                [commit['hash'] for commit in data['commits']],
+                [history[3]])
+            self.assertEqual(data['page'], 2)
+            self.assertEqual(data['total_commits'], 3)
+            self.assertEqual(data['pages'], 2)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+        output = self.app.get('/api/0/test/git/history')
+        self.assertEqual(output.status_code, 400)
+        output = self.app.get(
+            '/api/0/test/git/history?path=sources&branch=foo')
+        self.assertEqual(output.status_code, 400)
+
 
 if __name__ == '__main__':
     SUITE = unittest.TestLoader().loadTestsFromTestCase(
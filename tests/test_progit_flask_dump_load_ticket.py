@@ -172,7 +172,7 @@ class PagureFlaskDumpLoadTicketTests(tests.Modeltests):
         self.assertEqual(cnt, 10)
 
         last_commit = repo.revparse_single('HEAD')
-        patch = pagure.lib.git.commit_to_patch(repo, last_commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(repo, last_commit))
         for line in patch.split('\n'):
             if line.startswith('--- a/'):
                 fileid = line.split('--- a/')[1]
@@ -671,6 +671,39 @@ class PagureFlaskInternaltests(tests.Modeltests):
             js_data = json.loads(output.data)
             self.assertDictEqual(js_data, exp)
 
+            # The status is cached for the current heads of the branches
+            master = repo.lookup_branch('master').get_object().oid
+            feature = repo.lookup_branch('feature').get_object().oid
+            request = pagure.lib.get_request_by_uid(
+                self.session, project.requests[0].uid)
+            self.assertEqual(request.merge_status, 'MERGE')
+            self.assertEqual(request.merge_status_base, master.hex)
+            self.assertEqual(request.merge_status_head, feature.hex)
+
+            # The target branch moved, the cached status is not used
+            repo.create_reference('refs/heads/master', feature, force=True)
+            output = self.app.post('/pv/pull-request/merge', data=data)
+            self.assertEqual(output.status_code, 200)
+            js_data = json.loads(output.data)
+            self.assertEqual(js_data['code'], 'NO_CHANGE')
+
+        # Refreshing after a push recomputes the status
+        repo.create_reference('refs/heads/master', master, force=True)
+        project = pagure.lib.get_project(self.session, 'test')
+        self.assertEqual(
+            pagure.lib.git.refresh_merge_status(
+                self.session, project, 'master'),
+            1)
+        self.assertEqual(
+            pagure.lib.git.refresh_merge_status(
+                self.session, project, 'unknown'),
+            0)
+        request = pagure.lib.get_request_by_uid(
+            self.session, project.requests[0].uid)
+        self.assertEqual(request.merge_status, 'MERGE')
+        self.assertEqual(request.merge_status_base, master.hex)
+        self.assertEqual(request.merge_status_head, feature.hex)
+
     @patch('pagure.lib.notify.send_email')
     def test_mergeable_request_pull_conflicts(self, send_email):
         """ Test the mergeable_request_pull endpoint when the changes cannot
@@ -233,6 +233,43 @@ class PagureFlaskForktests(tests.Modeltests):
             '<title>Pull request #1 - test - Pagure</title>', output.data)
         self.assertIn(
             'title="View file as of 2a552b">View</a>', output.data)
+        self.assertIn(
+            '<td class="cell2"><pre><span class="gu">@@ -1,2 +1,4 @@'
+            '</span></pre></td></tr>', output.data)
+
+    @patch('pagure.lib.notify.send_email')
+    def test_request_pull_inline_comment(self, send_email):
+        """ Test the request_pull endpoint with inline comments. """
+        send_email.return_value = True
+
+        self.test_request_pull()
+
+        output = self.app.get('/test/pull-request/1')
+        self.assertEqual(output.status_code, 200)
+        commit = output.data.split('data-commit="')[1].split('"')[0]
+
+        # Inline comments are shown below the line they are about
+        project = pagure.lib.get_project(self.session, 'test')
+        request = project.requests[0]
+        msg = pagure.lib.add_pull_request_comment(
+            session=self.session,
+            request=request,
+            commit=commit,
+            filename='sources',
+            row=2,
+            comment='This line is great',
+            user='pingou',
+            requestfolder=None,
+        )
+        self.assertEqual(msg, 'Comment added')
+        self.session.commit()
+
+        output = self.app.get('/test/pull-request/1')
+        self.assertEqual(output.status_code, 200)
+        row = output.data.split('<a id="1_2" href="#1_2">2</a>')[1]
+        row = row.split('<a id="1_3" href="#1_3">3</a>')[0]
+        self.assertIn('<pre>  foo</pre>', row)
+        self.assertIn('This line is great', row)
 
     @patch('pagure.lib.notify.send_email')
     def test_merge_request_pull_FF(self, send_email):
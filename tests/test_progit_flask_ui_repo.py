@@ -14,9 +14,12 @@ import pkg_resources
 import json
 import unittest
 import shutil
+import StringIO
 import sys
+import tarfile
 import tempfile
 import os
+import zipfile
 
 import pygit2
 from mock import patch
@@ -533,13 +536,17 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.session.add(item)
         self.session.commit()
 
-        tests.add_content_git_repo(
-            os.path.join(tests.HERE, 'forks', 'pingou', 'test3.git'))
-        tests.add_readme_git_repo(
-            os.path.join(tests.HERE, 'forks', 'pingou', 'test3.git'))
+        # The fork gets 10 commits of its own, its parent one
+        pygit2.clone_repository(
+            os.path.join(tests.HERE, 'forks', 'pingou', 'test.git'),
+            os.path.join(tests.HERE, 'forks', 'pingou', 'test3.git'),
+            bare=True)
         tests.add_commit_git_repo(
             os.path.join(tests.HERE, 'forks', 'pingou', 'test3.git'),
             ncommits=10)
+        tests.add_commit_git_repo(
+            os.path.join(tests.HERE, 'forks', 'pingou', 'test.git'),
+            ncommits=1)
 
         output = self.app.get('/fork/pingou/test3')
         self.assertEqual(output.status_code, 200)
@@ -548,6 +555,27 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertTrue('Forked from' in output.data)
         self.assertEqual(
             output.data.count('<span class="commitid">'), 3)
+        # The divergence never stored by the git hook is computed
+        self.assertTrue('(10 commits ahead,' in output.data)
+        self.assertTrue('1 commits behind)' in output.data)
+        self.assertEqual(output.data.count('class="new_commit"'), 3)
+
+        # And stored
+        repo = pagure.lib.get_project(self.session, 'test3', user='pingou')
+        self.assertEqual(repo.divergence.ahead, 10)
+        self.assertEqual(repo.divergence.behind, 1)
+
+        output = self.app.get('/fork/pingou/test3')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('(10 commits ahead,' in output.data)
+        self.assertTrue('1 commits behind)' in output.data)
+        self.assertEqual(output.data.count('class="new_commit"'), 3)
+
+        # And is shown in the forks network of the parent
+        output = self.app.get('/fork/pingou/test/forks')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(
+            '<td>%s</td>' % repo.divergence.ahead in output.data)
 
     def test_view_repo_empty(self):
         """ Test the view_repo endpoint on a repo w/o master branch. """
@@ -674,6 +702,60 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertEqual(
             output.data.count('<span class="commitid">'), 10)
 
+    def test_view_branches(self):
+        """ Test the view_branches endpoint. """
+        output = self.app.get('/foo/branches')
+        # No project registered in the DB
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+
+        output = self.app.get('/test/branches')
+        # No git repo associated
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects_git(tests.HERE, bare=True)
+
+        output = self.app.get('/test/branches')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('No branches found.', output.data)
+
+        # Branch out and move master forward
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        commit = repo.revparse_single('HEAD')
+        repo.create_branch('feature', commit)
+        repo.create_branch('fix/typo', commit)
+        tests.add_commit_git_repo(
+            os.path.join(tests.HERE, 'test.git'), ncommits=2)
+
+        output = self.app.get('/test/branches')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('feature', output.data)
+        self.assertIn('fix/typo', output.data)
+        self.assertIn('0 ahead, 2 behind master', output.data)
+        self.assertIn('0 ahead, 0 behind master', output.data)
+
+        output = self.app.get('/test/branches?pattern=fix/*')
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('fix/typo', output.data)
+        self.assertNotIn('/test/branch/feature', output.data)
+
+        pagure.APP.config['ITEM_PER_PAGE'] = 1
+        try:
+            output = self.app.get('/test/branches?page=2')
+            self.assertEqual(output.status_code, 200)
+            self.assertIn('/test/branch/fix/typo', output.data)
+            self.assertNotIn('/test/branch/feature', output.data)
+            self.assertIn('<td>2 / 3</td>', output.data)
+
+            # The overview only lists the first page of branches
+            output = self.app.get('/test')
+            self.assertEqual(output.status_code, 200)
+            self.assertIn('All the 3 branches', output.data)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
     def test_view_commits(self):
         """ Test the view_commits endpoint. """
         output = self.app.get('/foo/commits')
@@ -713,6 +795,26 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertEqual(
             output.data.count('<span class="commitid">'), 3)
 
+        # Without the commit index, the number of pages is only known on
+        # the last one, there is a next page until then
+        pagure.APP.config['ITEM_PER_PAGE'] = 2
+        try:
+            output = self.app.get('/test/commits')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(
+                output.data.count('<span class="commitid">'), 2)
+            self.assertIn('<td>1</td>', output.data)
+            self.assertIn('?page=2', output.data)
+
+            output = self.app.get('/test/commits?page=2')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(
+                output.data.count('<span class="commitid">'), 1)
+            self.assertIn('<td>2 / 2</td>', output.data)
+            self.assertNotIn('?page=3', output.data)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
         # Turn that repo into a fork
         repo = pagure.lib.get_project(self.session, 'test')
         repo.parent_id = 2
@@ -804,6 +906,15 @@ class PagureFlaskRepotests(tests.Modeltests):
             in output.data)
         self.assertTrue(
             '<td class="cell2"><pre> bar</pre></td>' in output.data)
+        self.assertTrue('/static/pygments.css' in output.data)
+
+        # The highlighted file is cached
+        with patch('pagure.ui.repo.highlight') as highlight:
+            output = self.app.get('/test/blob/master/f/sources')
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse(highlight.called)
+            self.assertTrue(
+                '<td class="cell2"><pre> bar</pre></td>' in output.data)
 
         # View what's supposed to be an image
         output = self.app.get('/test/blob/master/f/test.jpg')
@@ -880,6 +991,84 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertTrue(
             '<td class="cell2"><pre> barRow 0</pre></td>' in output.data)
 
+    def test_view_blame_file(self):
+        """ Test the view_blame_file endpoint. """
+        output = self.app.get('/foo/blame/master/f/sources')
+        # No project registered in the DB
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+        tests.create_projects_git(tests.HERE, bare=True)
+
+        output = self.app.get('/test/blame/master/f/sources')
+        self.assertEqual(output.status_code, 404)
+
+        # Add some content to the git repo
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        tests.add_binary_git_repo(
+            os.path.join(tests.HERE, 'test.git'), 'test_binary')
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        commit = repo.revparse_single('HEAD^^')
+
+        output = self.app.get('/test/blame/foo/f/sources')
+        self.assertEqual(output.status_code, 404)
+        output = self.app.get('/test/blame/master/f/foofile')
+        self.assertEqual(output.status_code, 404)
+        output = self.app.get('/test/blame/master/f/folder1')
+        self.assertEqual(output.status_code, 404)
+        output = self.app.get('/test/blame/master/f/test_binary')
+        self.assertEqual(output.status_code, 400)
+
+        # The file view links to the blame
+        output = self.app.get('/test/blob/master/f/sources')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(
+            '<a class="button blob" href="/test/blame/master/f/sources"'
+            in output.data)
+
+        output = self.app.get('/test/blame/master/f/sources')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('<title>Blame - sources - test' in output.data)
+        self.assertEqual(output.data.count('<tr class="blame_hunk">'), 1)
+        self.assertTrue(
+            'title="Add sources file for testing">%s</a>' % commit.hex[:6]
+            in output.data)
+        self.assertTrue('Alice Author' in output.data)
+        self.assertTrue(
+            '<td class="cell1"><a id="_2" href="#_2">2</a></td>'
+            in output.data)
+        self.assertTrue(
+            '<td class="cell2"><pre> bar</pre></td>' in output.data)
+
+        # The blame is cached
+        with patch('pygit2.Repository.blame') as blame:
+            output = self.app.get('/test/blame/master/f/sources')
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse(blame.called)
+
+        # Blame by commit in a fork
+        forkedgit = os.path.join(tests.HERE, 'forks', 'pingou', 'test3.git')
+        tests.add_content_git_repo(forkedgit)
+        item = pagure.lib.model.Project(
+            user_id=1,  # pingou
+            name='test3',
+            description='test project #3',
+            parent_id=1,
+            hook_token='aaabbbfff',
+        )
+        self.session.add(item)
+        self.session.commit()
+        repo = pygit2.Repository(forkedgit)
+        commit = repo.revparse_single('HEAD')
+
+        output = self.app.get(
+            '/fork/pingou/test3/blame/%s/f/folder1/folder2/file'
+            % commit.hex)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data.count('<tr class="blame_hunk">'), 1)
+        self.assertTrue(
+            '<td class="cell2"><pre>baz</pre></td>' in output.data)
+
     def test_view_raw_file(self):
         """ Test the view_raw_file endpoint. """
         output = self.app.get('/foo/raw/foo/sources')
@@ -919,6 +1108,38 @@ class PagureFlaskRepotests(tests.Modeltests):
         output = self.app.get('/test/raw/master/f/sources')
         self.assertEqual(output.status_code, 200)
         self.assertTrue('foo\n bar' in output.data)
+        self.assertEqual(output.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(output.headers['Cache-Control'], 'public, no-cache')
+        etag = output.headers['ETag']
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        self.assertEqual(
+            etag, '"%s"' % repo.revparse_single('master:sources').oid.hex)
+
+        # Revalidate the file
+        output = self.app.get(
+            '/test/raw/master/f/sources', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.data, '')
+
+        # Request part of the file
+        output = self.app.get(
+            '/test/raw/master/f/sources', headers={'Range': 'bytes=0-2'})
+        self.assertEqual(output.status_code, 206)
+        self.assertEqual(output.data, 'foo')
+        self.assertEqual(output.headers['Content-Length'], '3')
+        self.assertTrue(
+            output.headers['Content-Range'].startswith('bytes 0-2/'))
+
+        output = self.app.get(
+            '/test/raw/master/f/sources',
+            headers={'Range': 'bytes=0-2', 'If-Range': '"foo"'})
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('foo\n bar' in output.data)
+
+        output = self.app.get(
+            '/test/raw/master/f/sources',
+            headers={'Range': 'bytes=10000-'})
+        self.assertEqual(output.status_code, 416)
 
         # View what's supposed to be an image
         output = self.app.get('/test/raw/master/f/test.jpg')
@@ -932,6 +1153,9 @@ class PagureFlaskRepotests(tests.Modeltests):
         output = self.app.get('/test/raw/%s/f/test.jpg' % commit.oid.hex)
         self.assertEqual(output.status_code, 200)
         self.assertTrue(output.data.startswith('<89>PNG^M'))
+        self.assertEqual(
+            output.headers['Cache-Control'],
+            'public, max-age=31536000, immutable')
 
         # View by image name -- somehow we support this
         output = self.app.get('/test/raw/sources/f/test.jpg')
@@ -1018,9 +1242,9 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertTrue('<th>Author</th>' in output.data)
         self.assertTrue('<th>Committer</th>' in output.data)
         self.assertTrue(
-            '<span style="color: #00A000">+ Pagure</span>' in output.data)
+            '<span class="gi">+ Pagure</span>' in output.data)
         self.assertTrue(
-            '<span style="color: #00A000">+ ======</span>' in output.data)
+            '<span class="gi">+ ======</span>' in output.data)
 
         # Add some content to the git repo
         tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
@@ -1035,10 +1259,56 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertTrue('<th>Author</th>' in output.data)
         self.assertTrue('<th>Committer</th>' in output.data)
         self.assertTrue(
-            '<div class="highlight" style="background: #f8f8f8">'
-            '<pre style="line-height: 125%">'
-            '<span style="color: #800080; font-weight: bold">'
-            '@@ -0,0 +1,3 @@</span>' in output.data)
+            '<tr><td class="cell1"><a id="1_1" href="#1_1">1</a></td>'
+            '<td class="cell2"><pre><span class="gu">'
+            '@@ -0,0 +1,3 @@</span></pre></td></tr>' in output.data)
+
+        # Even addressed by commit hash, the pages have to be revalidated
+        self.assertEqual(output.headers['Cache-Control'], 'public, no-cache')
+        etag = output.headers['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+
+        output = self.app.get(
+            '/test/%s' % commit.oid.hex, headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+        self.assertEqual(output.data, '')
+        self.assertEqual(output.headers['Cache-Control'], 'public, no-cache')
+        self.assertEqual(output.headers['Vary'], 'Cookie')
+
+        # Unlike the patch of the commit
+        output = self.app.get('/test/%s.patch' % commit.oid.hex)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(
+            output.headers['Cache-Control'],
+            'public, max-age=31536000, immutable')
+
+        # The page is different for a logged in user
+        user = tests.FakeUser(username='pingou')
+        with tests.user_set(pagure.APP, user):
+            output = self.app.get(
+                '/test/%s' % commit.oid.hex, headers={'If-None-Match': etag})
+            self.assertEqual(output.status_code, 200)
+            self.assertNotEqual(output.headers['ETag'], etag)
+            self.assertEqual(
+                output.headers['Cache-Control'], 'private, no-cache')
+
+        # Or once the branches of the project changed
+        repo.create_branch('feature', commit)
+        output = self.app.get(
+            '/test/%s' % commit.oid.hex, headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertNotEqual(output.headers['ETag'], etag)
+        etag = output.headers['ETag']
+
+        # Or the project itself
+        project = pagure.lib.get_project(self.session, 'test')
+        project.description = 'test project #1, renamed'
+        self.session.add(project)
+        self.session.commit()
+        output = self.app.get(
+            '/test/%s' % commit.oid.hex, headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertNotEqual(output.headers['ETag'], etag)
 
         # Add a fork of a fork
         item = pagure.lib.model.Project(
@@ -1070,9 +1340,74 @@ class PagureFlaskRepotests(tests.Modeltests):
         self.assertTrue('<th>Author</th>' in output.data)
         self.assertTrue('<th>Committer</th>' in output.data)
         self.assertTrue(
-            '<span style="color: #00A000">+ Pagure</span>' in output.data)
+            '<span class="gi">+ Pagure</span>' in output.data)
         self.assertTrue(
-            '<span style="color: #00A000">+ ======</span>' in output.data)
+            '<span class="gi">+ ======</span>' in output.data)
+
+    def test_view_diff_file(self):
+        """ Test the view_diff_file endpoint. """
+        output = self.app.get('/foo/diff/abc/f/sources')
+        # No project registered in the DB
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+        tests.create_projects_git(tests.HERE, bare=True)
+
+        tests.add_readme_git_repo(os.path.join(tests.HERE, 'test.git'))
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        first_commit = repo.revparse_single('HEAD')
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        commit = repo.revparse_single('HEAD')
+
+        # Invalid identifier
+        output = self.app.get('/test/diff/foo/f/sources')
+        self.assertEqual(output.status_code, 404)
+
+        # File not changed in this commit
+        output = self.app.get('/test/diff/%s/f/sources' % commit.oid.hex)
+        self.assertEqual(output.status_code, 404)
+
+        output = self.app.get(
+            '/test/diff/%s/f/folder1/folder2/file?index=1' % commit.oid.hex)
+        self.assertEqual(output.status_code, 200)
+        self.assertIn(
+            '<tr><td class="cell1"><a id="1_1" href="#1_1">1</a></td>',
+            output.data)
+        self.assertIn('<span class="gi">+ baz</span>', output.data)
+
+        # Range of commits, with a wrong index
+        output = self.app.get(
+            '/test/diff/%s..%s/f/sources?index=3' % (
+                first_commit.oid.hex, commit.oid.hex))
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('<a id="3_1" href="#3_1">1</a>', output.data)
+        self.assertIn('<span class="gi">+ foo</span>', output.data)
+
+        # Range starting from the empty tree
+        output = self.app.get(
+            '/test/diff/..%s/f/README.rst' % commit.oid.hex)
+        self.assertEqual(output.status_code, 200)
+        self.assertIn('<span class="gi">+ Pagure</span>', output.data)
+
+        # Unknown pull-request
+        output = self.app.get(
+            '/test/diff/%s/f/folder1/folder2/file?requestid=foo'
+            % commit.oid.hex)
+        self.assertEqual(output.status_code, 404)
+
+        # The diffs not shown in the commit page are loaded on demand
+        pagure.APP.config['DIFF_FILES_INLINE'] = 0
+        try:
+            output = self.app.get('/test/%s' % commit.oid.hex)
+        finally:
+            pagure.APP.config['DIFF_FILES_INLINE'] = 25
+        self.assertEqual(output.status_code, 200)
+        self.assertIn(
+            '<a href="#diff_file_1">folder1/folder2/file</a>', output.data)
+        self.assertIn(
+            'data-url="/test/diff/%s/f/folder1/folder2/file?index=1"'
+            % commit.oid.hex, output.data)
+        self.assertNotIn('<span class="gi">+ baz</span>', output.data)
 
     def test_view_commit_patch(self):
         """ Test the view_commit_patch endpoint. """
@@ -1240,6 +1575,44 @@ index 0000000..fb7093d
         self.assertTrue('README.rst' in output.data)
         self.assertFalse(
             'No content found in this repository' in output.data)
+        # With the last commit which changed each entry
+        self.assertTrue(
+            '<a href="/test/%s"\n          title="%s">Add a README file</a>'
+            % (commit.oid.hex, commit.oid.hex) in output.data)
+        self.assertFalse('Next &gt;' in output.data)
+
+        # Pages addressed by branch name have to be revalidated
+        self.assertEqual(output.headers['Cache-Control'], 'public, no-cache')
+        etag = output.headers['ETag']
+        output = self.app.get(
+            '/test/tree/master', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+
+        # Until the branch moves
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        output = self.app.get(
+            '/test/tree/master', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 200)
+        self.assertNotEqual(output.headers['ETag'], etag)
+
+        # Large folders are paginated
+        pagure.APP.config['TREE_ITEM_PER_PAGE'] = 2
+        try:
+            output = self.app.get('/test/tree/master')
+            self.assertEqual(output.status_code, 200)
+            self.assertTrue('folder1' in output.data)
+            self.assertTrue('README.rst' in output.data)
+            self.assertFalse('Add sources file for testing' in output.data)
+            self.assertTrue('<td>1 / 2</td>' in output.data)
+            self.assertTrue('/test/tree/master?page=2' in output.data)
+
+            output = self.app.get('/test/tree/master?page=2')
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse('README.rst' in output.data)
+            self.assertTrue('Add sources file for testing' in output.data)
+            self.assertTrue('<td>2 / 2</td>' in output.data)
+        finally:
+            pagure.APP.config['TREE_ITEM_PER_PAGE'] = 500
 
         # Add a fork of a fork
         item = pagure.lib.model.Project(
@@ -1524,7 +1897,7 @@ index 0000000..fb7093d
         self.assertNotEqual(repo.hook_token, 'aaabbbccc')
 
     @patch('pagure.ui.repo.admin_session_timedout')
-    @patch('pagure.lib.git.update_git')
+    @patch('pagure.lib.git.regenerate_git_repo')
     def test_regenerate_git(self, upgit, ast):
         """ Test the regenerate_git endpoint. """
         ast.return_value = False
@@ -1613,6 +1986,177 @@ index 0000000..fb7093d
         self.assertIn('0.0.1', output.data)
         self.assertIn('<span class="tagid">', output.data)
         self.assertTrue(output.data.count('tagid'), 1)
+        self.assertIn('href="/test/archive/0.0.1.tar.gz"', output.data)
+        self.assertIn('href="/test/archive/0.0.1.zip"', output.data)
+
+        # Sorted by date or version and paginated
+        repo.create_reference('refs/tags/0.0.0', first_commit.oid)
+        pagure.APP.config['ITEM_PER_PAGE'] = 1
+        try:
+            output = self.app.get('/test/tags')
+            self.assertEqual(output.status_code, 200)
+            self.assertIn('0.0.0', output.data)
+            self.assertNotIn('0.0.1', output.data)
+            self.assertIn('<td>1 / 2</td>', output.data)
+            self.assertIn('page=2', output.data)
+
+            output = self.app.get('/test/tags?sort=version')
+            self.assertEqual(output.status_code, 200)
+            self.assertIn('0.0.1', output.data)
+            self.assertNotIn('0.0.0', output.data)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+    def test_view_history(self):
+        """ Test the view_history endpoint. """
+        output = self.app.get('/foo/history/master/f/sources')
+        # No project registered in the DB
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+        tests.create_projects_git(tests.HERE, bare=True)
+
+        output = self.app.get('/test/history/master/f/sources')
+        self.assertEqual(output.status_code, 404)
+
+        # Add some content to the git repo
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        tests.add_commit_git_repo(
+            os.path.join(tests.HERE, 'test.git'), ncommits=2)
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        history = [
+            commit.oid.hex
+            for commit in repo.walk(repo.head.target, pygit2.GIT_SORT_TIME)]
+
+        output = self.app.get('/test/history/foo/f/sources')
+        self.assertEqual(output.status_code, 404)
+        output = self.app.get('/test/history/master/f/foofile')
+        self.assertEqual(output.status_code, 404)
+
+        # The file view links to the history
+        output = self.app.get('/test/blob/master/f/sources')
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue(
+            '<a class="button blob" href="/test/history/master/f/sources"'
+            in output.data)
+        output = self.app.get('/test/blob/%s/f/sources' % history[0])
+        self.assertEqual(output.status_code, 200)
+        self.assertFalse('/test/history/' in output.data)
+
+        # The index is only read, the git repo is walked until it is built
+        with patch('pagure.lib.git.update_commit_index') as update:
+            output = self.app.get('/test/history/master/f/sources')
+            self.assertFalse(update.called)
+        self.assertEqual(output.status_code, 200)
+        self.assertTrue('<title>History - sources - test' in output.data)
+        self.assertEqual(output.data.count('<span class="commitid">'), 3)
+        self.assertTrue('Add row 1 to sources file' in output.data)
+        self.assertTrue('Add sources file for testing' in output.data)
+        self.assertFalse('Add some directory' in output.data)
+
+        # There is a next page until the number of commits is known
+        pagure.APP.config['ITEM_PER_PAGE'] = 2
+        try:
+            output = self.app.get('/test/history/master/f/sources')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(
+                output.data.count('<span class="commitid">'), 2)
+            self.assertTrue('<td>1</td>' in output.data)
+            self.assertTrue('page=2' in output.data)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+        # As indexed by the git hook
+        project = pagure.lib.get_project(self.session, 'test')
+        pagure.lib.git.update_commit_index(self.session, project, 'master')
+        with patch('pagure.lib.git._touches_path') as touches:
+            output = self.app.get('/test/history/master/f/sources')
+            self.assertFalse(touches.called)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data.count('<span class="commitid">'), 3)
+        self.assertTrue('Add row 1 to sources file' in output.data)
+
+        output = self.app.get('/test/history/master/f/folder1/')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.data.count('<span class="commitid">'), 1)
+        self.assertTrue('Add some directory' in output.data)
+
+        pagure.APP.config['ITEM_PER_PAGE'] = 2
+        try:
+            output = self.app.get('/test/history/master/f/sources?page=2')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(
+                output.data.count('<span class="commitid">'), 1)
+            self.assertTrue('Add sources file for testing' in output.data)
+            self.assertTrue('<td>2 / 2</td>' in output.data)
+        finally:
+            pagure.APP.config['ITEM_PER_PAGE'] = 50
+
+    def test_view_archive(self):
+        """ Test the view_archive endpoint. """
+        pagure.APP.config['ARCHIVE_FOLDER'] = os.path.join(
+            self.path, 'archives')
+
+        output = self.app.get('/foo/archive/master.tar.gz')
+        # No project registered in the DB
+        self.assertEqual(output.status_code, 404)
+
+        tests.create_projects(self.session)
+        tests.create_projects_git(tests.HERE, bare=True)
+
+        output = self.app.get('/test/archive/master.tar.gz')
+        self.assertEqual(output.status_code, 404)
+
+        tests.add_content_git_repo(os.path.join(tests.HERE, 'test.git'))
+        repo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+        commit = repo.revparse_single('HEAD')
+
+        output = self.app.get('/test/archive/foo.tar.gz')
+        self.assertEqual(output.status_code, 404)
+
+        output = self.app.get('/test/archive/master.tar.gz')
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.headers['Content-Type'], 'application/x-gzip')
+        self.assertEqual(
+            output.headers['Content-Disposition'],
+            'attachment; filename=test-master.tar.gz')
+        self.assertEqual(output.headers['Cache-Control'], 'public, no-cache')
+        archive = tarfile.open(
+            fileobj=StringIO.StringIO(output.data), mode='r:gz')
+        self.assertEqual(
+            sorted(archive.getnames()),
+            ['test-master', 'test-master/folder1',
+             'test-master/folder1/folder2',
+             'test-master/folder1/folder2/file', 'test-master/sources'])
+        self.assertEqual(
+            archive.extractfile('test-master/sources').read(), 'foo\n bar')
+        etag = output.headers['ETag']
+
+        # The archive is generated once
+        with patch('subprocess.Popen') as popen:
+            output = self.app.get('/test/archive/master.tar.gz')
+            self.assertEqual(output.status_code, 200)
+            self.assertFalse(popen.called)
+        self.assertEqual(
+            len(os.listdir(os.path.join(
+                self.path, 'archives', commit.tree.hex[:2],
+                commit.tree.hex))), 1)
+
+        output = self.app.get(
+            '/test/archive/master.tar.gz', headers={'If-None-Match': etag})
+        self.assertEqual(output.status_code, 304)
+
+        # By commit, as zip
+        output = self.app.get('/test/archive/%s.zip' % commit.oid.hex)
+        self.assertEqual(output.status_code, 200)
+        self.assertEqual(output.headers['Content-Type'], 'application/zip')
+        self.assertTrue(
+            output.headers['Cache-Control'].startswith(
+                'public, max-age='))
+        archive = zipfile.ZipFile(StringIO.StringIO(output.data))
+        prefix = 'test-%s/' % commit.oid.hex
+        self.assertEqual(
+            archive.read(prefix + 'folder1/folder2/file'), 'foo\n bar\nbaz')
 
     def test_edit_file(self):
         """ Test the edit_file endpoint. """
@@ -1708,7 +2252,10 @@ index 0000000..fb7093d
                 '<title>Edit - test - Pagure</title>', output.data)
 
             # Works
+            gitrepo = pygit2.Repository(os.path.join(tests.HERE, 'test.git'))
+            parent = gitrepo.lookup_branch('master').get_object().oid.hex
             data['email'] = 'bar@pingou.com'
+            data['parent'] = parent
             output = self.app.post(
                 '/test/edit/master/f/sources', data=data,
                 follow_redirects=True)
@@ -1723,6 +2270,20 @@ index 0000000..fb7093d
             self.assertEqual(output.status_code, 200)
             self.assertEqual(output.data, 'foo\n bar\n  baz')
 
+            # The file changed since the commit the edit was started from
+            data['content'] = 'foo\n bar\n  qux'
+            output = self.app.post('/test/edit/master/f/sources', data=data)
+            self.assertEqual(output.status_code, 200)
+            self.assertIn(
+                '<li class="error">This file was changed on the branch while'
+                ' you were editing it, committing again will overwrite these'
+                ' changes</li>', output.data)
+            self.assertNotIn('value="%s"' % parent, output.data)
+
+            output = self.app.get('/test/raw/master/f/sources')
+            self.assertEqual(output.status_code, 200)
+            self.assertEqual(output.data, 'foo\n bar\n  baz')
+
             # Add a fork of a fork
             item = pagure.lib.model.Project(
                 user_id=1,  # pingou
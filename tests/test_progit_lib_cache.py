@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+ (c) 2015 - Copyright Red Hat Inc
+
+ Authors:
+   Pierre-Yves Chibon <pingou@pingoured.fr>
+
+"""
+
+__requires__ = ['SQLAlchemy >= 0.8']
+import pkg_resources
+
+import unittest
+import shutil
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..'))
+
+import pagure.lib.cache
+import tests
+
+
+class PagureLibCachetests(tests.Modeltests):
+    """ Tests for pagure.lib.cache """
+
+    def test_lru_cache(self):
+        """ Test the LRUCache class of pagure.lib.cache. """
+        cache = pagure.lib.cache.LRUCache(size=2)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('foo'), None)
+        self.assertEqual(cache.get('foo', 'bar'), 'bar')
+
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('foo' in cache)
+
+        # Reading foo makes bar the least recently used entry
+        self.assertEqual(cache.get('foo'), 1)
+        cache.set('baz', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('bar' in cache)
+        self.assertEqual(cache.get('foo'), 1)
+        self.assertEqual(cache.get('baz'), 3)
+
+        # Overriding an entry does not grow the cache
+        cache.set('baz', 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('baz'), 4)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertFalse('foo' in cache)
+
+    def test_lru_cache_weight(self):
+        """ Test the LRUCache class of pagure.lib.cache bounded by the
+        weight of its entries. """
+        cache = pagure.lib.cache.get_cache(
+            'test', size=10, weigh=len, max_weight=5)
+        self.assertTrue(isinstance(cache, pagure.lib.cache.LRUCache))
+
+        cache.set('foo', 'ab')
+        cache.set('bar', 'cd')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.weight, 4)
+
+        # Adding baz goes over the weight limit and drops foo
+        cache.set('baz', 'ef')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.weight, 4)
+        self.assertFalse('foo' in cache)
+
+        # Overriding an entry replaces its weight
+        cache.set('baz', 'e')
+        self.assertEqual(cache.weight, 3)
+
+        # An entry heavier than the limit is not cached
+        cache.set('big', 'abcdef')
+        self.assertFalse('big' in cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.weight, 3)
+
+        cache.clear()
+        self.assertEqual(cache.weight, 0)
+
+    def test_disk_cache(self):
+        """ Test the DiskCache class of pagure.lib.cache. """
+        folder = tempfile.mkdtemp(prefix='pagure-tests')
+        try:
+            cache = pagure.lib.cache.get_cache('test', folder=folder)
+            self.assertTrue(isinstance(cache, pagure.lib.cache.DiskCache))
+            self.assertEqual(cache.get('foo'), None)
+            self.assertEqual(cache.get('foo', 'bar'), 'bar')
+            self.assertFalse('foo' in cache)
+
+            cache.set('foo', u'<span>bar</span>')
+            cache.set(u'café', {'a': 1})
+            self.assertTrue('foo' in cache)
+            self.assertEqual(cache.get('foo'), u'<span>bar</span>')
+            self.assertEqual(cache.get(u'café'), {'a': 1})
+
+            # The entries are shared with the other caches using the folder
+            cache = pagure.lib.cache.get_cache('test', folder=folder)
+            self.assertEqual(cache.get('foo'), u'<span>bar</span>')
+            self.assertTrue(os.path.isdir(os.path.join(folder, 'test')))
+        finally:
+            shutil.rmtree(folder)
+
+        cache = pagure.lib.cache.get_cache('test', size=10)
+        self.assertTrue(isinstance(cache, pagure.lib.cache.LRUCache))
+        self.assertEqual(cache.size, 10)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(PagureLibCachetests)
+    unittest.TextTestRunner(verbosity=2).run(SUITE)
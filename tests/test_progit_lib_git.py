@@ -11,10 +11,15 @@
 __requires__ = ['SQLAlchemy >= 0.8']
 import pkg_resources
 
+import fcntl
 import json
+import multiprocessing
 import unittest
 import shutil
+import StringIO
 import sys
+import tarfile
+import threading
 import os
 
 import pygit2
@@ -279,6 +284,47 @@ repo requests/pingou/test2
         os.unlink(outputconf)
         self.assertFalse(os.path.exists(outputconf))
 
+    def test_get_repo_obj(self):
+        """ Test the get_repo_obj function of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_pool.git')
+        pygit2.init_repository(gitpath, bare=True)
+
+        repo_obj = pagure.lib.git.get_repo_obj(gitpath)
+        self.assertTrue(isinstance(repo_obj, pygit2.Repository))
+        self.assertTrue(repo_obj.is_empty)
+        # The handle is reused
+        self.assertTrue(pagure.lib.git.get_repo_obj(gitpath) is repo_obj)
+        self.assertTrue(
+            pagure.lib.git.get_repo_obj(gitpath + '/') is repo_obj)
+
+        # But not once the repo is re-created
+        shutil.rmtree(gitpath)
+        pygit2.init_repository(gitpath, bare=True)
+        other = pagure.lib.git.get_repo_obj(gitpath)
+        self.assertFalse(other is repo_obj)
+
+        # The handles of each thread are distinct
+        handles = []
+        thread = threading.Thread(
+            target=lambda: handles.append(
+                pagure.lib.git.get_repo_obj(gitpath)))
+        thread.start()
+        thread.join()
+        self.assertFalse(handles[0] is other)
+
+        # Only GIT_REPO_POOL_SIZE handles are kept
+        secondpath = os.path.join(self.path, 'test_pool2.git')
+        pygit2.init_repository(secondpath, bare=True)
+        pagure.APP.config['GIT_REPO_POOL_SIZE'] = 1
+        try:
+            pagure.lib.git._REPO_POOL.cache = None
+            repo_obj = pagure.lib.git.get_repo_obj(gitpath)
+            pagure.lib.git.get_repo_obj(secondpath)
+            self.assertFalse(pagure.lib.git.get_repo_obj(gitpath) is repo_obj)
+        finally:
+            pagure.APP.config['GIT_REPO_POOL_SIZE'] = 20
+            pagure.lib.git._REPO_POOL.cache = None
+
     def test_commit_to_patch(self):
         """ Test the commit_to_patch function of pagure.lib.git. """
         # Create a git repo to play with
@@ -338,8 +384,8 @@ repo requests/pingou/test2
         second_commit = repo.revparse_single('HEAD')
 
         # Generate a patch for 2 commits
-        patch = pagure.lib.git.commit_to_patch(
-            repo, [first_commit, second_commit])
+        patch = ''.join(pagure.lib.git.commit_to_patch(
+            repo, [first_commit, second_commit]))
         exp = """Mon Sep 17 00:00:00 2001
 From: Alice Author <alice@authors.tld>
 Subject: [PATCH 1/2] Add sources file for testing
@@ -391,7 +437,7 @@ index 9f44358..2a552bb 100644
         self.assertEqual(patch, exp)
 
         # Generate a patch for a single commit
-        patch = pagure.lib.git.commit_to_patch(repo, second_commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(repo, second_commit))
         exp = """Mon Sep 17 00:00:00 2001
 From: Alice Author <alice@authors.tld>
 Subject: Add baz and boose to the sources
@@ -463,7 +509,7 @@ index 9f44358..2a552bb 100644
         commit = repo.revparse_single('HEAD')
 
         # Use patch to validate the repo
-        patch = pagure.lib.git.commit_to_patch(repo, commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(repo, commit))
         exp = """Mon Sep 17 00:00:00 2001
 From: pagure <pagure>
 Subject: Updated ticket <hash>: Test issue
@@ -523,7 +569,7 @@ index 0000000..60f7480
         # Use patch to validate the repo
         repo = pygit2.Repository(self.gitrepo)
         commit = repo.revparse_single('HEAD')
-        patch = pagure.lib.git.commit_to_patch(repo, commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(repo, commit))
         exp = """Mon Sep 17 00:00:00 2001
 From: pagure <pagure>
 Subject: Updated ticket <hash>: Test issue
@@ -588,7 +634,7 @@ index 458821a..77674a8
 
         # Get the uid of the ticket created
         commit = gitrepo.revparse_single('HEAD')
-        patch = pagure.lib.git.commit_to_patch(gitrepo, commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(gitrepo, commit))
         hash_file = None
         for row in patch.split('\n'):
             if row.startswith('+++ b/'):
@@ -608,6 +654,235 @@ index 458821a..77674a8
         files = [entry.name for entry in commit.tree]
         self.assertEqual(files, [])
 
+    def test_update_git_no_change(self):
+        """ Test that update_git does not commit if nothing changed. """
+        self.test_update_git()
+
+        gitpath = os.path.join(tests.HERE, 'test_ticket_repo.git')
+        gitrepo = pygit2.Repository(gitpath)
+        self.assertTrue(gitrepo.is_bare)
+        head = gitrepo.revparse_single('HEAD').oid.hex
+
+        repo = pagure.lib.get_project(self.session, 'test_ticket_repo')
+        issue = pagure.lib.search_issues(self.session, repo, issueid=1)
+        pagure.lib.git.update_git(issue, repo, tests.HERE)
+
+        # Nothing changed, so no new commit
+        self.assertEqual(gitrepo.revparse_single('HEAD').oid.hex, head)
+
+        # Removing an issue not in the git does not commit either
+        issue.uid = 'not_in_git'
+        pagure.lib.git.clean_git(issue, repo, tests.HERE)
+        self.assertEqual(gitrepo.revparse_single('HEAD').oid.hex, head)
+        self.session.rollback()
+
+    @patch('pagure.lib.notify.send_email')
+    def test_regenerate_git_repo(self, email_f):
+        """ Test the regenerate_git_repo method of pagure.lib.git. """
+        email_f.return_value = True
+        pagure.lib.git.regenerate_git_repo(
+            self.session, None, None, objtype='ticket')
+
+        # Create project
+        item = pagure.lib.model.Project(
+            user_id=1,  # pingou
+            name='test_ticket_repo',
+            description='test project for ticket',
+            hook_token='aaabbbwww',
+        )
+        self.session.add(item)
+        self.session.commit()
+
+        # Create repo
+        self.gitrepo = os.path.join(tests.HERE, 'test_ticket_repo.git')
+        os.makedirs(self.gitrepo)
+        gitrepo = pygit2.init_repository(self.gitrepo, bare=True)
+
+        # Create three issues without storing them in git, one private
+        repo = pagure.lib.get_project(self.session, 'test_ticket_repo')
+        for cnt in range(3):
+            pagure.lib.new_issue(
+                session=self.session,
+                repo=repo,
+                title='Test issue #%s' % cnt,
+                content='We should work on this',
+                user='pingou',
+                private=cnt == 2,
+                ticketfolder=None,
+            )
+        self.session.commit()
+        self.assertTrue(gitrepo.is_empty)
+
+        commit = pagure.lib.git.regenerate_git_repo(
+            self.session, repo, tests.HERE, objtype='ticket')
+
+        # A single commit containing the two public issues
+        gitrepo = pygit2.Repository(self.gitrepo)
+        head = gitrepo.revparse_single('HEAD')
+        self.assertEqual(head.oid, commit)
+        self.assertEqual(head.parents, [])
+        self.assertEqual(
+            head.message, 'Regenerated the 2 tickets of test_ticket_repo')
+        titles = sorted(
+            json.loads(gitrepo[entry.oid].data)['title']
+            for entry in head.tree)
+        self.assertEqual(titles, ['Test issue #0', 'Test issue #1'])
+
+        # Nothing changed, nothing to commit
+        self.assertEqual(
+            pagure.lib.git.regenerate_git_repo(
+                self.session, repo, tests.HERE, objtype='ticket'),
+            None)
+
+    @patch('pagure.lib.git._schedule_git_queue_flush')
+    @patch('pagure.lib.notify.send_email')
+    def test_update_git_queued(self, email_f, schedule_f):
+        """ Test the update_git of pagure.lib.git when the changes are
+        queued. """
+        email_f.return_value = True
+        pagure.APP.config['GIT_QUEUE_FOLDER'] = os.path.join(
+            self.path, 'queue')
+
+        try:
+            # Create project
+            item = pagure.lib.model.Project(
+                user_id=1,  # pingou
+                name='test_ticket_repo',
+                description='test project for ticket',
+                hook_token='aaabbbwww',
+            )
+            self.session.add(item)
+            self.session.commit()
+
+            # Create repo
+            self.gitrepo = os.path.join(tests.HERE, 'test_ticket_repo.git')
+            os.makedirs(self.gitrepo)
+            gitrepo = pygit2.init_repository(self.gitrepo, bare=True)
+
+            repo = pagure.lib.get_project(self.session, 'test_ticket_repo')
+            # Create two issues and comment on the first one
+            issue = pagure.lib.new_issue(
+                session=self.session,
+                repo=repo,
+                title='Test issue',
+                content='We should work on this',
+                user='pingou',
+                ticketfolder=tests.HERE
+            )
+            pagure.lib.new_issue(
+                session=self.session,
+                repo=repo,
+                title='Test issue #2',
+                content='We should work on this as well',
+                user='pingou',
+                ticketfolder=tests.HERE
+            )
+            self.session.commit()
+            pagure.lib.add_issue_comment(
+                session=self.session,
+                issue=issue,
+                comment='Hey look a comment!',
+                user='foo',
+                ticketfolder=tests.HERE
+            )
+            self.session.commit()
+
+            # Nothing committed yet, one update queued per issue
+            self.assertTrue(gitrepo.is_empty)
+            queuedir = pagure.lib.git._get_queue_folder(self.gitrepo)
+            queued = [
+                filename for filename in os.listdir(queuedir)
+                if not filename.startswith('.')]
+            self.assertEqual(len(queued), 2)
+            self.assertTrue(schedule_f.called)
+
+            commit = pagure.lib.git.flush_git_queue(queuedir)
+
+            # One commit with both issues, the first one with its comment
+            gitrepo = pygit2.Repository(self.gitrepo)
+            head = gitrepo.revparse_single('HEAD')
+            self.assertEqual(head.oid, commit)
+            self.assertEqual(head.parents, [])
+            self.assertTrue(head.message.startswith('Updated 2 objects'))
+            self.assertEqual(len(head.tree), 2)
+            data = json.loads(gitrepo[head.tree[issue.uid].oid].data)
+            self.assertEqual(data['title'], 'Test issue')
+            self.assertEqual(len(data['comments']), 1)
+
+            # The queue is empty
+            queued = [
+                filename for filename in os.listdir(queuedir)
+                if not filename.startswith('.')]
+            self.assertEqual(queued, [])
+            self.assertEqual(pagure.lib.git.flush_git_queue(queuedir), None)
+        finally:
+            pagure.APP.config['GIT_QUEUE_FOLDER'] = None
+
+    @patch('pagure.lib.notify.send_email')
+    def test_add_file_to_git(self, email_f):
+        """ Test the add_file_to_git method of pagure.lib.git. """
+        email_f.return_value = True
+
+        # Create project and its ticket git repo
+        item = pagure.lib.model.Project(
+            user_id=1,  # pingou
+            name='test_ticket_repo',
+            description='test project for ticket',
+            hook_token='aaabbbwww',
+        )
+        self.session.add(item)
+        self.session.commit()
+        gitpath = os.path.join(tests.HERE, 'test_ticket_repo.git')
+        pygit2.init_repository(gitpath, bare=True)
+
+        repo = pagure.lib.get_project(self.session, 'test_ticket_repo')
+        pagure.lib.new_issue(
+            session=self.session,
+            repo=repo,
+            title='Test issue',
+            content='We should work on this',
+            user='pingou',
+            ticketfolder=None,
+        )
+        self.session.commit()
+        issue = pagure.lib.search_issues(self.session, repo, issueid=1)
+        user = tests.FakeUser(username='pingou')
+
+        # No ticket folder, nothing is stored
+        self.assertEqual(
+            pagure.lib.git.add_file_to_git(
+                self.session, repo, issue, None, user, 'test.txt',
+                StringIO.StringIO('foo')),
+            None)
+
+        content = 'bar\n' * 50000
+        filename = pagure.lib.git.add_file_to_git(
+            self.session, repo, issue, tests.HERE, user, '../test.txt',
+            StringIO.StringIO(content))
+        self.assertEqual(
+            filename,
+            'files/df9075d67d254120290b1c884a2ef70503701cc59fe5679f948da574ec'
+            'd62ab8-test.txt')
+
+        gitrepo = pygit2.Repository(gitpath)
+        head = gitrepo.revparse_single('HEAD')
+        self.assertEqual(
+            head.message,
+            'Add file %s to ticket %s: Test issue' % (filename, issue.uid))
+        self.assertEqual(head.author.name, 'pingou')
+        self.assertEqual(
+            gitrepo[head.tree['files'].oid][filename[6:]].oid,
+            gitrepo.create_blob(content))
+
+        # Uploading the same content again does not commit anything
+        self.assertEqual(
+            pagure.lib.git.add_file_to_git(
+                self.session, repo, issue, tests.HERE, user, 'other.txt',
+                StringIO.StringIO(content)),
+            filename)
+        self.assertEqual(gitrepo.revparse_single('HEAD').oid, head.oid)
+        self.assertEqual(len(repo.issue_attachments), 1)
+
     @patch('pagure.lib.notify.send_email')
     def test_update_git_requests(self, email_f):
         """ Test the update_git of pagure.lib.git for pull-requests. """
@@ -655,7 +930,7 @@ index 458821a..77674a8
         commit = repo.revparse_single('HEAD')
 
         # Use patch to validate the repo
-        patch = pagure.lib.git.commit_to_patch(repo, commit)
+        patch = ''.join(pagure.lib.git.commit_to_patch(repo, commit))
         exp = """Mon Sep 17 00:00:00 2001
 From: pagure <pagure>
 Subject: Updated ticket <hash>: test PR
@@ -1108,6 +1383,932 @@ index 0000000..60f7480
         self.assertEqual(repo.requests[1].title, 'test request #2')
         self.assertEqual(len(repo.requests[1].comments), 0)
 
+    def test_set_ref_target(self):
+        """ Test the _set_ref_target method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_ref.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+        tree = pagure.lib.git._update_tree(
+            repo_obj, None, {'sources': repo_obj.create_blob('foo\n')})
+        first = repo_obj.create_commit(
+            None, author, author, 'first commit', tree, [])
+        second = repo_obj.create_commit(
+            None, author, author, 'second commit', tree, [first])
+        refname = 'refs/heads/master'
+
+        pagure.lib.git._set_ref_target(repo_obj, refname, first, None)
+        self.assertEqual(
+            pagure.lib.git._get_ref_target(repo_obj, refname), first)
+
+        # The reference exists already
+        self.assertRaises(
+            pagure.exceptions.BranchMovedException,
+            pagure.lib.git._set_ref_target,
+            repo_obj, refname, second, None
+        )
+        # The reference moved
+        self.assertRaises(
+            pagure.exceptions.BranchMovedException,
+            pagure.lib.git._set_ref_target,
+            repo_obj, refname, first, second
+        )
+        # The reference is locked by a push
+        lockfile = os.path.join(gitpath, 'refs', 'heads', 'master.lock')
+        open(lockfile, 'w').close()
+        self.assertRaises(
+            pagure.exceptions.BranchMovedException,
+            pagure.lib.git._set_ref_target,
+            repo_obj, refname, second, first
+        )
+        os.unlink(lockfile)
+        self.assertEqual(
+            pagure.lib.git._get_ref_target(repo_obj, refname), first)
+
+        pagure.lib.git._set_ref_target(repo_obj, refname, second, first)
+        self.assertEqual(
+            pagure.lib.git._get_ref_target(repo_obj, refname), second)
+
+    def test_get_merge_status(self):
+        """ Test the get_merge_status method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_merge.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(content, parents):
+            tree = pagure.lib.git._update_tree(
+                repo_obj, None, {'sources': repo_obj.create_blob(content)})
+            return repo_obj.create_commit(
+                None, author, author, 'commit', tree, parents)
+
+        base = commit('foo\n bar\n', [])
+        ffwd = commit('foo\n bar\n baz\n', [base])
+        other = commit('foo\n bar\n qux\n', [base])
+
+        self.assertEqual(
+            pagure.lib.git.get_merge_status(repo_obj, None, base),
+            ('FFORWARD', None))
+        self.assertEqual(
+            pagure.lib.git.get_merge_status(repo_obj, ffwd, base),
+            ('NO_CHANGE', None))
+        self.assertEqual(
+            pagure.lib.git.get_merge_status(repo_obj, base, ffwd),
+            ('FFORWARD', None))
+        self.assertEqual(
+            pagure.lib.git.get_merge_status(repo_obj, ffwd, other),
+            ('CONFLICTS', None))
+
+        # Changes to different files merge cleanly
+        tree = pagure.lib.git._update_tree(
+            repo_obj, repo_obj[base].tree,
+            {'README': repo_obj.create_blob('Read me\n')})
+        readme = repo_obj.create_commit(
+            None, author, author, 'readme', tree, [base])
+        status, tree = pagure.lib.git.get_merge_status(
+            repo_obj, ffwd, readme)
+        self.assertEqual(status, 'MERGE')
+        self.assertEqual(
+            sorted(entry.name for entry in repo_obj[tree]),
+            ['README', 'sources'])
+        self.assertEqual(
+            repo_obj[repo_obj[tree]['sources'].oid].data,
+            'foo\n bar\n baz\n')
+
+    def test_get_diff_commits(self):
+        """ Test the get_diff_commits method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_range.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, cnt):
+            tree = pagure.lib.git._update_tree(
+                repo_obj, None, {'sources': repo_obj.create_blob(str(cnt))})
+            return repo_obj.create_commit(
+                None, author, author, 'commit #%s' % cnt, tree, parents)
+
+        master = [commit([], 0)]
+        for cnt in range(1, 5):
+            master.append(commit([master[-1]], cnt))
+        feature = [commit([master[2]], 10)]
+        feature.append(commit([feature[-1]], 11))
+        repo_obj.create_reference('refs/heads/master', master[-1])
+        repo_obj.create_reference('refs/heads/feature', feature[-1])
+
+        # The commits of feature not in master
+        output = [
+            entry.oid for entry in pagure.lib.git.get_diff_commits(
+                repo_obj, feature[-1], base=master[-1])]
+        self.assertEqual(output, list(reversed(feature)))
+
+        # Nothing in master that is not in master
+        output = list(pagure.lib.git.get_diff_commits(
+            repo_obj, master[2], base=master[-1]))
+        self.assertEqual(output, [])
+
+        # The whole history without base, limited
+        output = [
+            entry.oid for entry in pagure.lib.git.get_diff_commits(
+                repo_obj, master[-1], limit=2)]
+        self.assertEqual(output, [master[4], master[3]])
+
+        # The base is in another repo: the parent moved since the fork
+        forkpath = os.path.join(self.path, 'test_range_fork.git')
+        fork_obj = pygit2.clone_repository(gitpath, forkpath, bare=True)
+        parent = pygit2.Repository(gitpath)
+        tree = pagure.lib.git._update_tree(
+            parent, None, {'sources': parent.create_blob('new')})
+        new_master = parent.create_commit(
+            None, author, author, 'new commit', tree, [master[-1]])
+        self.assertFalse(new_master in fork_obj)
+
+        output = [
+            entry.oid for entry in pagure.lib.git.get_diff_commits(
+                fork_obj, feature[-1], base=new_master, orig_repo=parent)]
+        self.assertEqual(output, list(reversed(feature)))
+
+        # Whose history has several heads in the fork: the parent merged
+        # the start of feature on top of a commit both have
+        future = pygit2.Signature(
+            'Alice Author', 'alice@authors.tld', 2000000000, 0)
+        for repo in (parent, fork_obj):
+            shared = repo.create_commit(
+                None, future, future, 'shared commit',
+                repo[master[-1]].tree.oid, [master[-1]])
+        merge = parent.create_commit(
+            None, author, author, 'merge', tree, [shared, feature[0]])
+        self.assertFalse(merge in fork_obj)
+
+        output = [
+            entry.oid for entry in pagure.lib.git.get_diff_commits(
+                fork_obj, feature[-1], base=merge, orig_repo=parent)]
+        self.assertEqual(output, [feature[1]])
+        output = [
+            entry.oid for entry in pagure.lib.git.get_diff_commits(
+                fork_obj, feature[-1], base=merge, orig_repo=parent,
+                limit=0)]
+        self.assertEqual(output, [])
+
+    def test_get_diff_files(self):
+        """ Test the get_diff_files method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_diff.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        tree = pagure.lib.git._update_tree(
+            repo_obj, None, {'sources': repo_obj.create_blob('foo\n')})
+        first = repo_obj.create_commit(
+            None, author, author, 'first commit', tree, [])
+        tree = pagure.lib.git._update_tree(
+            repo_obj, repo_obj[tree], {
+                'sources': repo_obj.create_blob('foo\nbar\n'),
+                'README': repo_obj.create_blob('Pagure\n'),
+            })
+        second = repo_obj.create_commit(
+            None, author, author, 'second commit', tree, [first])
+
+        self.assertRaises(
+            pagure.exceptions.PagureException,
+            pagure.lib.git.get_diff_files,
+            repo_obj, 'foo'
+        )
+
+        # Computed in the pool of workers
+        diff = pagure.lib.git.get_diff_files(repo_obj, second.hex)
+        self.assertEqual(
+            [entry.new_file_path for entry in diff], ['README', 'sources'])
+        sources = diff[1]
+        self.assertEqual(sources.additions, 1)
+        self.assertEqual(sources.deletions, 0)
+        self.assertFalse(sources.is_binary)
+        self.assertEqual(
+            sources.new_id, repo_obj[tree]['sources'].hex)
+        self.assertEqual(
+            sources.hunks[0].lines, [(' ', 'foo\n'), ('+', 'bar\n')])
+
+        # Cached
+        with patch.object(
+                pagure.lib.git, '_compute_diff_files') as compute:
+            diff = pagure.lib.git.get_diff_files(repo_obj, second.hex)
+            self.assertFalse(compute.called)
+        self.assertEqual(len(diff), 2)
+
+        # From the empty tree, computed in process
+        pagure.APP.config['DIFF_WORKERS'] = 0
+        try:
+            diff = pagure.lib.git.get_diff_files(
+                repo_obj, '..%s' % first.hex)
+            self.assertEqual(
+                [entry.new_file_path for entry in diff], ['sources'])
+
+            # Diff exceeding the limits of the workers
+            with patch.object(
+                    pagure.lib.git, '_compute_diff_files') as compute:
+                compute.return_value = pagure.lib.git.DIFF_TOO_LARGE
+                self.assertRaises(
+                    pagure.exceptions.DiffTooLargeException,
+                    pagure.lib.git.get_diff_files,
+                    repo_obj, '%s..%s' % (first.hex, second.hex),
+                    context_lines=5
+                )
+        finally:
+            pagure.APP.config['DIFF_WORKERS'] = 2
+
+        # Diff not computed in time, possibly because the workers were all
+        # busy: it is attempted again
+        with patch.object(pagure.lib.git, '_get_diff_pool') as get_pool:
+            result = get_pool.return_value.apply_async.return_value
+            result.get.side_effect = multiprocessing.TimeoutError
+            self.assertRaises(
+                pagure.exceptions.DiffTooLargeException,
+                pagure.lib.git.get_diff_files,
+                repo_obj, '%s..%s' % (first.hex, second.hex),
+                context_lines=10
+            )
+            self.assertRaises(
+                pagure.exceptions.DiffTooLargeException,
+                pagure.lib.git.get_diff_files,
+                repo_obj, '%s..%s' % (first.hex, second.hex),
+                context_lines=10
+            )
+            self.assertEqual(get_pool.return_value.apply_async.call_count, 2)
+
+        # Diff exceeding the limits of a worker, cached as too large
+        with patch.object(pagure.lib.git, '_get_diff_pool') as get_pool:
+            result = get_pool.return_value.apply_async.return_value
+            result.get.return_value = pagure.lib.git.DIFF_TOO_LARGE
+            for _ in range(2):
+                self.assertRaises(
+                    pagure.exceptions.DiffTooLargeException,
+                    pagure.lib.git.get_diff_files,
+                    repo_obj, '%s..%s' % (first.hex, second.hex),
+                    context_lines=10
+                )
+            self.assertEqual(get_pool.return_value.apply_async.call_count, 1)
+
+    def test_get_last_commits(self):
+        """ Test the get_last_commits method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_last.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, changes, message):
+            tree = pagure.lib.git._update_tree(
+                repo_obj,
+                repo_obj[parents[0]].tree if parents else None,
+                dict(
+                    (path, repo_obj.create_blob(content))
+                    for path, content in changes.items()
+                ))
+            return repo_obj.create_commit(
+                None, author, author, message, tree, parents)
+
+        first = commit([], {'README': 'foo', 'doc/index': 'foo'}, 'first')
+        second = commit([first], {'sources': 'bar'}, 'second')
+        third = commit([second], {'doc/index': 'bar'}, 'third')
+
+        last_commits = pagure.lib.git.get_last_commits(
+            repo_obj, repo_obj[third], '', ['README', 'doc', 'sources'])
+        self.assertEqual(
+            last_commits,
+            {'README': first.hex, 'doc': third.hex, 'sources': second.hex})
+
+        last_commits = pagure.lib.git.get_last_commits(
+            repo_obj, repo_obj[second], 'doc', ['index', 'unknown'])
+        self.assertEqual(last_commits, {'index': first.hex})
+
+        # A branch merged back is credited with the change it brought
+        branch = commit([first], {'doc/index': 'baz'}, 'branch')
+        merge = repo_obj.create_commit(
+            None, author, author, 'merge', repo_obj[branch].tree.oid,
+            [third, branch])
+        last_commits = pagure.lib.git.get_last_commits(
+            repo_obj, repo_obj[merge], 'doc/', ['index'])
+        self.assertEqual(last_commits, {'index': branch.hex})
+
+        # The entries known for the parent commit are reused
+        pagure.lib.git._LAST_COMMITS_CACHE.set(
+            '%s:' % third.hex, {'README': 'cached'})
+        fourth = commit([third], {'sources': 'baz'}, 'fourth')
+        last_commits = pagure.lib.git.get_last_commits(
+            repo_obj, repo_obj[fourth], '', ['README', 'sources'])
+        self.assertEqual(
+            last_commits, {'README': 'cached', 'sources': fourth.hex})
+
+    def test_get_blame(self):
+        """ Test the get_blame method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_blame.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, content):
+            tree = pagure.lib.git._update_tree(
+                repo_obj,
+                repo_obj[parents[0]].tree if parents else None,
+                {'sources': repo_obj.create_blob(content)})
+            return repo_obj.create_commit(
+                None, author, author, 'commit', tree, parents)
+
+        first = commit([], 'a\nb\nc\nd\ne\nf\ng\nh\ni\nj\n')
+        second = commit([first], 'a\nb\nc\nd\ne\nf\ng\nh\ni\nj\nk')
+
+        self.assertRaises(
+            pagure.exceptions.PagureException,
+            pagure.lib.git.get_blame,
+            repo_obj, repo_obj[second], 'foo'
+        )
+
+        blame = pagure.lib.git.get_blame(
+            repo_obj, repo_obj[second], 'sources')
+        self.assertEqual(blame, [(first.hex, 10), (second.hex, 1)])
+
+        # Derived from the blame of the parent
+        third = commit([second], 'A\nb\nc\nd\ne\nf\ng\nh\nj\nk')
+        with patch('pygit2.Repository.blame') as repo_blame:
+            blame = pagure.lib.git.get_blame(
+                repo_obj, repo_obj[third], 'sources')
+            self.assertFalse(repo_blame.called)
+        self.assertEqual(
+            blame, [(third.hex, 1), (first.hex, 8), (second.hex, 1)])
+
+        # Unchanged from the parent
+        fourth = repo_obj.create_commit(
+            None, author, author, 'commit', repo_obj[third].tree.oid,
+            [third])
+        with patch('pygit2.Repository.blame') as repo_blame:
+            self.assertEqual(
+                pagure.lib.git.get_blame(
+                    repo_obj, repo_obj[fourth], 'sources'),
+                blame)
+            self.assertFalse(repo_blame.called)
+
+        # Too many hunks changed
+        pagure.APP.config['BLAME_INCREMENTAL_HUNKS'] = 0
+        try:
+            fifth = commit([fourth], 'A\nb\nc\nd\ne\nf\ng\nh\nj\nK\n')
+            blame = pagure.lib.git.get_blame(
+                repo_obj, repo_obj[fifth], 'sources')
+            self.assertEqual(
+                blame, [(third.hex, 1), (first.hex, 8), (fifth.hex, 1)])
+        finally:
+            pagure.APP.config['BLAME_INCREMENTAL_HUNKS'] = 10
+
+    def test_generate_archive(self):
+        """ Test the get_archive, generate_archive and prune_archives
+        methods of pagure.lib.git. """
+        pagure.APP.config['ARCHIVE_FOLDER'] = os.path.join(
+            self.path, 'archives')
+        gitpath = os.path.join(self.path, 'test_archive.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        tree = repo_obj[pagure.lib.git._update_tree(
+            repo_obj, None, {'sources': repo_obj.create_blob('foo\n')})]
+        folder = os.path.join(
+            self.path, 'archives', tree.hex[:2], tree.hex)
+
+        self.assertEqual(
+            pagure.lib.git.get_archive(tree, 'test', 'tar.gz'), None)
+
+        content = ''.join(pagure.lib.git.generate_archive(
+            repo_obj, tree, 'test', 'tar.gz'))
+        archive = tarfile.open(
+            fileobj=StringIO.StringIO(content), mode='r:gz')
+        self.assertEqual(archive.getnames(), ['test', 'test/sources'])
+
+        # The archive is kept and the lock file removed
+        path = pagure.lib.git.get_archive(tree, 'test', 'tar.gz')
+        self.assertEqual(path, os.path.join(folder, 'test.tar.gz'))
+        self.assertEqual(os.listdir(folder), ['test.tar.gz'])
+        with open(path, 'rb') as stream:
+            self.assertEqual(stream.read(), content)
+
+        # Generated while waiting for the lock, read from the disk
+        with patch('subprocess.Popen') as popen:
+            self.assertEqual(
+                ''.join(pagure.lib.git.generate_archive(
+                    repo_obj, tree, 'test', 'tar.gz')),
+                content)
+            self.assertFalse(popen.called)
+
+        # Download stopped before the end, nothing is kept
+        stream = pagure.lib.git.generate_archive(
+            repo_obj, tree, 'test', 'zip')
+        next(stream)
+        stream.close()
+        self.assertEqual(os.listdir(folder), ['test.tar.gz'])
+
+        # Pruned, the archives used the least recently first
+        ''.join(pagure.lib.git.generate_archive(
+            repo_obj, tree, 'test', 'zip'))
+        os.utime(path, (0, 0))
+        self.assertEqual(pagure.lib.git.prune_archives(10 ** 9), 0)
+        self.assertEqual(
+            pagure.lib.git.prune_archives(
+                os.path.getsize(os.path.join(folder, 'test.zip'))),
+            1)
+        self.assertEqual(os.listdir(folder), ['test.zip'])
+        self.assertEqual(pagure.lib.git.prune_archives(0), 1)
+        self.assertEqual(os.listdir(folder), [])
+
+    def test_get_git_tags(self):
+        """ Test the get_git_tags method of pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+
+        gitpath = os.path.join(tests.HERE, 'repos', 'test.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        self.assertEqual(pagure.lib.git.get_git_tags(project), [])
+
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld', 1000, 0)
+        tree = pagure.lib.git._update_tree(
+            repo_obj, None, {'sources': repo_obj.create_blob('foo\n')})
+        commit = repo_obj.create_commit(
+            'refs/heads/master', author, author, 'first commit', tree, [])
+        for name, time in [('1.9', 3000), ('1.10', 2000)]:
+            tagger = pygit2.Signature('Alice Doe', 'adoe@example.com', time, 0)
+            repo_obj.create_tag(
+                name, commit.hex, pygit2.GIT_OBJ_COMMIT, tagger, name)
+        repo_obj.create_reference('refs/tags/1.8', commit)
+
+        tags = pagure.lib.git.get_git_tags(project)
+        self.assertEqual(
+            [(tag.name, tag.date) for tag in tags],
+            [('1.9', 3000), ('1.10', 2000), ('1.8', 1000)])
+        self.assertEqual(tags[0].commit, commit.hex)
+        self.assertNotEqual(tags[0].target, commit.hex)
+        self.assertEqual(tags[2].target, commit.hex)
+
+        # Cached until the tags change
+        with patch('subprocess.Popen') as popen:
+            tags = pagure.lib.git.get_git_tags(project, sort='version')
+            self.assertFalse(popen.called)
+        self.assertEqual(
+            [tag.name for tag in tags], ['1.10', '1.9', '1.8'])
+
+    def test_commit_log(self):
+        """ Test the CommitLog class of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_log.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+
+        def commit(parents, time, changes):
+            author = pygit2.Signature(
+                'Alice Author', 'alice@authors.tld', time, 0)
+            base = repo_obj[parents[0]].tree if parents else None
+            tree = pagure.lib.git._update_tree(repo_obj, base, dict(
+                (name, repo_obj.create_blob(content))
+                for name, content in changes.items()))
+            return repo_obj.create_commit(
+                None, author, author, 'commit at %s\n\nDetails' % time,
+                tree, parents).hex
+
+        # A side branch merged in master
+        first = commit([], 1, {'sources': '1'})
+        second = commit([first], 2, {'sources': '2'})
+        side = commit([first], 3, {'other': 'side'})
+        merge = commit([second, side], 4, {'other': 'side'})
+        last = commit([merge], 5, {'sources': '5'})
+
+        log = pagure.lib.git.CommitLog(repo_obj, [last], limit=2)
+        self.assertEqual([c.hex for c in log], [last, merge])
+        self.assertEqual(log.next_cursor, sorted([second, side]))
+
+        log = pagure.lib.git.CommitLog(repo_obj, log.next_cursor, limit=2)
+        self.assertEqual([c.hex for c in log], [side, second])
+        self.assertEqual(log.next_cursor, [first])
+
+        log = pagure.lib.git.CommitLog(repo_obj, log.next_cursor, limit=2)
+        self.assertEqual([c.hex for c in log], [first])
+        self.assertEqual(log.next_cursor, None)
+
+        # Only the commits changing the path
+        log = pagure.lib.git.CommitLog(repo_obj, [last], path='other')
+        self.assertEqual([c.hex for c in log], [side])
+        self.assertEqual(log.next_cursor, None)
+
+        log = pagure.lib.git.CommitLog(
+            repo_obj, [last], path='sources', limit=2)
+        self.assertEqual([c.hex for c in log], [last, second])
+        self.assertEqual(log.next_cursor, [first])
+
+        self.assertEqual(
+            list(pagure.lib.git.CommitLog(repo_obj, [], limit=2)), [])
+
+    @patch('pagure.lib.git._get_refresh_folder')
+    @patch('os.waitpid')
+    @patch('os.fork')
+    def test_refresh_project_in_background(self, fork, waitpid, folder):
+        """ Test the refresh_project_in_background method of
+        pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+        spool = os.path.join(self.path, 'refresh', '1')
+        folder.return_value = spool
+
+        # The caller only waits for the intermediate child
+        fork.return_value = 42
+        pagure.lib.git.refresh_project_in_background(
+            project, ['master', 'feature'])
+        fork.assert_called_once_with()
+        waitpid.assert_called_once_with(42, 0)
+
+        # The branches are left in the spool for the detached process
+        self.assertEqual(
+            pagure.lib.git._read_refresh_spool(spool),
+            set(['master', 'feature']))
+        self.assertEqual(os.listdir(spool), [])
+
+    @patch('pagure.lib.git.refresh_forks_divergence')
+    @patch('pagure.lib.git.refresh_merge_status')
+    @patch('pagure.lib.git.update_commit_index')
+    @patch('pagure.lib.create_session')
+    def test_refresh_project(self, session, index, merge, divergence):
+        """ Test the _refresh_project method of pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+        worker_session = session.return_value
+        worker_session.query.return_value.get.return_value = project
+
+        pagure.lib.git._refresh_project(project.id, set(['feature']))
+        index.assert_called_once_with(worker_session, project, 'feature')
+        merge.assert_called_once_with(worker_session, project, 'feature')
+        self.assertFalse(divergence.called)
+        worker_session.remove.assert_called_once_with()
+
+        # The forks only diverge further when master moves
+        pagure.lib.git._refresh_project(
+            project.id, set(['master', 'feature']))
+        self.assertEqual(
+            [call[0][2] for call in index.call_args_list],
+            ['feature', 'feature', 'master'])
+        divergence.assert_called_once_with(worker_session, project)
+
+    @patch('pagure.lib.git._refresh_project')
+    @patch('pagure.lib.git._get_refresh_folder')
+    def test_run_refresh_spool(self, folder, refresh):
+        """ Test the _run_refresh_spool method of pagure.lib.git. """
+        spool = os.path.join(self.path, 'refresh', '1')
+        os.makedirs(spool)
+        folder.return_value = spool
+        for name, branches in [('a', 'master\nfeature'), ('b', 'master')]:
+            with open(os.path.join(spool, name), 'w') as stream:
+                stream.write(branches)
+
+        # Another process works on the project: leave it the spool
+        with open(spool + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            pagure.lib.git._run_refresh_spool(1)
+        self.assertFalse(refresh.called)
+        self.assertEqual(sorted(os.listdir(spool)), ['a', 'b'])
+
+        # The branches spooled are refreshed together
+        pagure.lib.git._run_refresh_spool(1)
+        refresh.assert_called_once_with(1, set(['master', 'feature']))
+        self.assertEqual(os.listdir(spool), [])
+
+    def test_get_branch_index(self):
+        """ Test the get_branch_index method of pagure.lib.git. """
+        gitpath = os.path.join(tests.HERE, 'repos', 'test.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        index = pagure.lib.git.get_branch_index(repo_obj)
+        self.assertEqual(len(index), 0)
+        self.assertFalse('master' in index)
+
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld', 1000, 0)
+        tree = pagure.lib.git._update_tree(
+            repo_obj, None, {'sources': repo_obj.create_blob('foo\n')})
+        first = repo_obj.create_commit(
+            'refs/heads/master', author, author, 'first commit', tree, [])
+        repo_obj.create_reference('refs/heads/feature/foo', first)
+        second = repo_obj.create_commit(
+            'refs/heads/master', author, author, 'second commit', tree,
+            [first])
+
+        index = pagure.lib.git.get_branch_index(repo_obj)
+        self.assertEqual(index.names(), ['feature/foo', 'master'])
+        self.assertTrue('master' in index)
+        self.assertFalse('feature' in index)
+        self.assertEqual(index.get('master').commit, second.hex)
+        self.assertEqual(index.get('master').date, 1000)
+        self.assertEqual(
+            [branch.name for branch in index.search('feat*')],
+            ['feature/foo'])
+
+        # Cached until the branches change
+        with patch('subprocess.Popen') as popen:
+            index = pagure.lib.git.get_branch_index(repo_obj)
+            self.assertFalse(popen.called)
+        self.assertEqual(len(index), 2)
+
+        self.assertEqual(
+            pagure.lib.git.get_branch_divergence(
+                repo_obj, index.get('feature/foo'), second.hex),
+            (0, 1))
+
+        # Kept in memory in front of the CACHE_FOLDER
+        pagure.APP.config['CACHE_FOLDER'] = os.path.join(self.path, 'cache')
+        pagure.lib.git._BRANCHES_CACHE = None
+        try:
+            index = pagure.lib.git.get_branch_index(repo_obj)
+            self.assertEqual(len(index), 2)
+            with patch.object(pagure.lib.cache.DiskCache, 'get') as get:
+                index = pagure.lib.git.get_branch_index(repo_obj)
+                self.assertFalse(get.called)
+            self.assertEqual(len(index), 2)
+        finally:
+            pagure.APP.config['CACHE_FOLDER'] = None
+            pagure.lib.git._BRANCHES_CACHE = None
+
+    def test_update_commit_index(self):
+        """ Test the update_commit_index method of pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+
+        gitpath = os.path.join(self.path, 'test_index.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, cnt):
+            tree = pagure.lib.git._update_tree(
+                repo_obj, None, {'sources': repo_obj.create_blob(str(cnt))})
+            return repo_obj.create_commit(
+                None, author, author, 'commit #%s\n\nMore details' % cnt,
+                tree, parents)
+
+        # Empty branch
+        self.assertEqual(
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'master', repo_obj=repo_obj),
+            0)
+        self.assertEqual(
+            pagure.lib.git.get_commit_summaries(
+                self.session, project, 'master'),
+            (0, []))
+
+        commits = [commit([], 0)]
+        for cnt in range(1, 5):
+            commits.append(commit([commits[-1]], cnt))
+        repo_obj.create_reference('refs/heads/master', commits[-1])
+
+        self.assertEqual(
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'master', repo_obj=repo_obj),
+            5)
+        # Nothing new
+        self.assertEqual(
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'master', repo_obj=repo_obj),
+            0)
+
+        # Fast-forward, only the new commits are indexed
+        commits.append(commit([commits[-1]], 5))
+        repo_obj.create_reference(
+            'refs/heads/master', commits[-1], force=True)
+        self.assertEqual(
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'master', repo_obj=repo_obj),
+            1)
+
+        total, summaries = pagure.lib.git.get_commit_summaries(
+            self.session, project, 'master', offset=2, limit=2)
+        self.assertEqual(total, 6)
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [commits[3].hex, commits[2].hex])
+        self.assertEqual(summaries[0].message, 'commit #3')
+        self.assertEqual(summaries[0].author.email, 'alice@authors.tld')
+        self.assertEqual(summaries[0].generation, 4)
+        self.assertEqual(summaries[0].position, 3)
+
+        # Force-push, the index is rebuilt
+        forced = commit([commits[1]], 10)
+        repo_obj.create_reference('refs/heads/master', forced, force=True)
+        self.assertEqual(
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'master', repo_obj=repo_obj),
+            3)
+        total, summaries = pagure.lib.git.get_commit_summaries(
+            self.session, project, 'master')
+        self.assertEqual(total, 3)
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [forced.hex, commits[1].hex, commits[0].hex])
+
+    def test_get_history_page(self):
+        """ Test the get_history_page method of pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+
+        gitpath = os.path.join(self.path, 'test_page.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        self.assertEqual(
+            pagure.lib.git.get_history_page(
+                self.session, project, repo_obj, 'master'),
+            (0, []))
+
+        commits = []
+        for cnt in range(5):
+            tree = pagure.lib.git._update_tree(
+                repo_obj, None, {'sources': repo_obj.create_blob(str(cnt))})
+            commits.append(repo_obj.create_commit(
+                None, author, author, 'commit #%s' % cnt, tree,
+                commits[-1:]))
+        repo_obj.create_reference('refs/heads/master', commits[-1])
+
+        # Not indexed, the branch is walked up to the page
+        with patch('pagure.lib.get_commit_index') as get_index:
+            total, page = pagure.lib.git.get_history_page(
+                self.session, project, repo_obj, 'master', offset=1,
+                limit=2)
+            self.assertFalse(get_index.called)
+        # The walk stopped before the end of the branch
+        self.assertEqual(total, None)
+        self.assertEqual(
+            [commit.hex for commit in page],
+            [commits[3].hex, commits[2].hex])
+
+        # Up to its end on the last page
+        total, page = pagure.lib.git.get_history_page(
+            self.session, project, repo_obj, 'master', offset=3, limit=2)
+        self.assertEqual(total, 5)
+        self.assertEqual(
+            [commit.hex for commit in page],
+            [commits[1].hex, commits[0].hex])
+        # Nothing was indexed on the way
+        self.assertEqual(
+            pagure.lib.get_commit_index_head(
+                self.session, project, 'master'),
+            None)
+
+        # Indexed
+        pagure.lib.git.update_commit_index(
+            self.session, project, 'master', repo_obj=repo_obj)
+        with patch('pygit2.Repository.walk') as walk:
+            total, page = pagure.lib.git.get_history_page(
+                self.session, project, repo_obj, 'master', offset=1,
+                limit=2)
+            self.assertFalse(walk.called)
+        self.assertEqual(total, 5)
+        self.assertEqual(
+            [commit.hex for commit in page],
+            [commits[3].hex, commits[2].hex])
+
+    def test_get_commit_paths(self):
+        """ Test the get_commit_paths method of pagure.lib.git. """
+        gitpath = os.path.join(self.path, 'test_paths.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, changes):
+            base = repo_obj[parents[0]].tree if parents else None
+            tree = pagure.lib.git._update_tree(repo_obj, base, dict(
+                (name, repo_obj.create_blob(content) if content else None)
+                for name, content in changes.items()))
+            return repo_obj[repo_obj.create_commit(
+                None, author, author, 'commit', tree, parents)]
+
+        first = commit([], {'sources': 'foo', 'doc/index.rst': 'doc'})
+        self.assertEqual(
+            pagure.lib.git.get_commit_paths(repo_obj, first),
+            set(['sources', 'doc', 'doc/index.rst']))
+
+        second = commit([first.oid], {'doc/api/index.rst': 'api'})
+        self.assertEqual(
+            pagure.lib.git.get_commit_paths(repo_obj, second),
+            set(['doc', 'doc/api', 'doc/api/index.rst']))
+
+        # Removed files and folders
+        third = commit([second.oid], {'doc/api/index.rst': None})
+        self.assertEqual(
+            pagure.lib.git.get_commit_paths(repo_obj, third),
+            set(['doc', 'doc/api', 'doc/api/index.rst']))
+
+        # A merge only changes what differs from all its parents
+        side = commit([first.oid], {'sources': 'bar'})
+        merge = commit(
+            [second.oid, side.oid],
+            {'sources': 'bar', 'README': 'readme'})
+        self.assertEqual(
+            pagure.lib.git.get_commit_paths(repo_obj, merge),
+            set(['README']))
+
+    def test_get_path_summaries(self):
+        """ Test the get_path_summaries method of pagure.lib.git. """
+        tests.create_projects(self.session)
+        project = pagure.lib.get_project(self.session, 'test')
+
+        gitpath = os.path.join(self.path, 'test_history.git')
+        repo_obj = pygit2.init_repository(gitpath, bare=True)
+        author = pygit2.Signature('Alice Author', 'alice@authors.tld')
+
+        def commit(parents, name, cnt):
+            base = repo_obj[parents[0]].tree if parents else None
+            tree = pagure.lib.git._update_tree(
+                repo_obj, base, {name: repo_obj.create_blob(str(cnt))})
+            return repo_obj.create_commit(
+                None, author, author, 'commit #%s' % cnt, tree, parents)
+
+        commits = [commit([], 'sources', 0)]
+        commits.append(commit([commits[-1]], 'doc/index.rst', 1))
+        commits.append(commit([commits[-1]], 'sources', 2))
+        repo_obj.create_reference('refs/heads/master', commits[-1])
+
+        self.assertEqual(
+            pagure.lib.git.get_path_summaries(
+                self.session, project, repo_obj, 'foo', 'sources'),
+            (0, []))
+
+        # Not indexed yet, the branch is walked up to the page
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'sources', limit=1)
+        self.assertEqual(total, None)
+        self.assertEqual(
+            [summary.hex for summary in summaries], [commits[2].hex])
+        # Or to its end on the last page
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'sources', offset=1,
+            limit=1)
+        self.assertEqual(total, 2)
+        self.assertEqual(
+            [summary.hex for summary in summaries], [commits[0].hex])
+        self.assertEqual(
+            pagure.lib.get_commit_index_head(self.session, project, 'master'),
+            None)
+
+        pagure.lib.git.update_commit_index(
+            self.session, project, 'master', repo_obj=repo_obj)
+
+        with patch.object(pagure.lib.git, '_touches_path') as touches:
+            total, summaries = pagure.lib.git.get_path_summaries(
+                self.session, project, repo_obj, 'master', 'sources')
+            self.assertFalse(touches.called)
+        self.assertEqual(total, 2)
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [commits[2].hex, commits[0].hex])
+        self.assertEqual(summaries[0].message, 'commit #2')
+
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'doc')
+        self.assertEqual(total, 1)
+        self.assertEqual(summaries[0].hex, commits[1].hex)
+
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'sources',
+            offset=1, limit=1)
+        self.assertEqual(total, 2)
+        self.assertEqual(
+            [summary.hex for summary in summaries], [commits[0].hex])
+
+        # The commits shared with another branch are only indexed once
+        commits.append(commit([commits[-1]], 'doc/index.rst', 3))
+        repo_obj.create_reference('refs/heads/feature', commits[-1])
+        with patch('pagure.lib.git.get_commit_paths',
+                   wraps=pagure.lib.git.get_commit_paths) as get_paths:
+            pagure.lib.git.update_commit_index(
+                self.session, project, 'feature', repo_obj=repo_obj)
+            self.assertEqual(get_paths.call_count, 1)
+
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'feature', 'doc/index.rst')
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [commits[3].hex, commits[1].hex])
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'doc/index.rst')
+        self.assertEqual(
+            [summary.hex for summary in summaries], [commits[1].hex])
+
+        # Commits indexed before the commit path index existed
+        self.session.query(pagure.lib.model.CommitPathIndex).delete()
+        self.session.query(pagure.lib.model.CommitIndex).update(
+            {'paths_indexed': False})
+        self.session.commit()
+        self.assertFalse(
+            pagure.lib.has_path_index(self.session, project, 'master'))
+
+        total, summaries = pagure.lib.git.get_path_summaries(
+            self.session, project, repo_obj, 'master', 'sources')
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [commits[2].hex, commits[0].hex])
+
+        self.assertEqual(
+            pagure.lib.git.index_commit_paths(
+                self.session, project, repo_obj=repo_obj),
+            4)
+        self.assertTrue(
+            pagure.lib.has_path_index(self.session, project, 'master'))
+        self.assertEqual(
+            pagure.lib.git.index_commit_paths(
+                self.session, project, repo_obj=repo_obj),
+            0)
+        with patch.object(pagure.lib.git, '_touches_path') as touches:
+            total, summaries = pagure.lib.git.get_path_summaries(
+                self.session, project, repo_obj, 'feature', 'doc/index.rst')
+            self.assertFalse(touches.called)
+        self.assertEqual(
+            [summary.hex for summary in summaries],
+            [commits[3].hex, commits[1].hex])
+
     def test_read_git_lines(self):
         """ Test the read_git_lines method of pagure.lib.git. """
         self.test_update_git()